@@ -0,0 +1,111 @@
+__author__ = 'mdavid'
+
+# TXT record classification: the previous exception-driven base64 path against wnsresolver.records.classify_record,
+# over a corpus of wallet name TXT payloads. Both must agree on every payload.
+#
+# Run from the repository root:
+#
+#     python -m benchmarks.classify
+#     python -m benchmarks.classify --number 20000 --output classify.json
+
+import argparse
+import json
+import re
+import sys
+import timeit
+from base64 import b64decode, b64encode
+
+from wnsresolver.records import classify_record
+
+ADDRESSES = [
+    '1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3',
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',
+    '1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2',
+    '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy',
+    'bc1qar0srrr7xfkvy5l643lydnw9re59gtzzwf5mdq',
+    'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4',
+    'LdP8Qox1VAhCzLJNqrr74YovaWYyNBUWvL',
+    'D8vFz4p1L37jdg47HXKtSHA5uYLYxbGgPD',
+    'NBkfS6kuBymGBYmbNWVn8zvc5gCAfNPpCQ',
+    '0x742d35Cc6634C0532925a3b844Bc454e4438f44e',
+    'dGhpc2lzZ3JlYXQx'
+]
+
+BITCOIN_URIS = [
+    'bitcoin:1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3',
+    'bitcoin:1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa?amount=0.01&label=Donation',
+    'bitcoin:?r=https://merchant.example/i/7a9c1b2e'
+]
+
+ENDPOINT_URLS = [
+    'https://bip32address.com/getmine',
+    'https://addressimo.netki.com/address/0123456789abcdef0123456789abcdef/resolve',
+    'http://wallet.example/bip70/request'
+]
+
+
+def corpus():
+
+    # Addresses dominate real wallet name zones, followed by base64 endpoint URLs and bitcoin URIs
+    encoded = [b64encode(x.encode('utf-8')).decode('ascii') for x in BITCOIN_URIS + ENDPOINT_URLS]
+    return ADDRESSES * 4 + BITCOIN_URIS + encoded
+
+
+def legacy_classify(txt):
+
+    # The resolver's classification before wnsresolver.records, kept verbatim for comparison
+    try:
+        b64txt = b64decode(txt)
+        if not isinstance(b64txt, str):
+            b64txt = b64txt.decode('utf-8')
+    except:
+        return txt, None
+
+    if b64txt.startswith('bitcoin:'):
+        return b64txt, None
+    elif re.match(r'^https?:\/\/', b64txt):
+        return b64txt, b64txt
+    else:
+        return txt, None
+
+
+def measure(classify, payloads, number, repeat):
+
+    samples = timeit.repeat(lambda: [classify(x) for x in payloads], number=number, repeat=repeat)
+    return min(samples) / (number * len(payloads)) * 1e9
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Measure TXT record classification')
+    parser.add_argument('--number', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    payloads = corpus()
+    mismatched = [x for x in payloads if tuple(classify_record(x)) != legacy_classify(x)]
+    for txt in mismatched:
+        print('mismatch %s: %r != %r' % (txt, tuple(classify_record(txt)), legacy_classify(txt)))
+
+    results = {
+        'payloads': len(payloads),
+        'legacy_ns': round(measure(legacy_classify, payloads, args.number, args.repeat), 1),
+        'classify_record_ns': round(measure(classify_record, payloads, args.number, args.repeat), 1),
+        'mismatches': len(mismatched)
+    }
+    print('%d payloads  legacy %.1f ns  classify_record %.1f ns per record  (%.2fx)' % (
+        results['payloads'], results['legacy_ns'], results['classify_record_ns'],
+        results['legacy_ns'] / results['classify_record_ns']
+    ))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    return 1 if mismatched else 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,79 @@
+__author__ = 'mdavid'
+
+# Import time of wnsresolver in a fresh interpreter, and which heavy dependencies it loads.
+#
+# Requires Python 3.7+ (-X importtime). Run from the repository root:
+#
+#     python -m benchmarks.imports
+#     python -m benchmarks.imports --max-ms 30
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# Only loaded on first use: HTTP on endpoint fetches and Namecoin RPC, pyunbound on the first query, Flask never
+LAZY_MODULES = ('requests', 'urllib3', 'flask', 'werkzeug', 'dns', 'unbound', 'aiohttp', 'bcresolver')
+
+STATEMENTS = {
+    'import': 'import wnsresolver',
+    'resolver': 'import wnsresolver; wnsresolver.WalletNameResolver()',
+    'preprocess_name': "import wnsresolver; wnsresolver.WalletNameResolver().preprocess_name('wallet@domain.com')"
+}
+
+IMPORTTIME = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| wnsresolver$', re.M)
+
+
+def run(statement, root):
+
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    probe = '%s; import sys; print(",".join(sorted(set(x.split(".")[0] for x in sys.modules))))' % statement
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=root, env=env, capture_output=True, text=True, check=True)
+
+    # Cumulative microseconds for the wnsresolver package, including everything it imports
+    import_us = int(IMPORTTIME.search(process.stderr).group(1))
+    modules = set(process.stdout.strip().split(','))
+    return import_us, sorted(x for x in LAZY_MODULES if x in modules)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Measure wnsresolver import time')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, help='exits 1 if the median import time exceeds this')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    failed = False
+
+    for name, statement in sorted(STATEMENTS.items()):
+        samples = []
+        for _ in range(args.repeat):
+            import_us, loaded = run(statement, root)
+            samples.append(import_us / 1000.0)
+        samples.sort()
+
+        results[name] = {
+            'median_ms': round(samples[len(samples) // 2], 3),
+            'min_ms': round(samples[0], 3),
+            'lazy_modules_loaded': loaded
+        }
+        print('%-16s median %7.3f ms  min %7.3f ms  loaded %s' % (name, results[name]['median_ms'], results[name]['min_ms'], ', '.join(loaded) or '-'))
+
+        if loaded or (args.max_ms is not None and name == 'import' and results[name]['median_ms'] > args.max_ms):
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,277 @@
+__author__ = 'mdavid'
+
+# Resolution pipeline benchmark against a local DNSSEC-signed stand-in zone and a stub Addressimo.
+#
+# Requires Python 3, pyunbound, dnspython>=2.4 and cryptography. Run from the repository root:
+#
+#     python -m benchmarks.run --output results.json
+#     python -m benchmarks.run --baseline previous.json --tolerance 0.15
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+from wnsresolver import WalletNameResolver
+from wnsresolver.cache import ResultCache
+from wnsresolver.endpoint import EndpointClient
+
+from .servers import AddressimoStub, AuthoritativeServer
+from .zone import BIP70_NAME, EMAIL_NAME, ENDPOINT_HOST, WALLET_NAME, build_zone, endpoint_path, endpoint_response, wallet_address, write_trust_anchor
+
+RESULTS_VERSION = 1
+
+CLIENT_ADDRESS = '127.0.0.1'
+
+SCENARIOS = {
+    'wallet_name': (lambda resolver, i: resolver.resolve_wallet_name(WALLET_NAME % i, 'btc', forwarded_for=CLIENT_ADDRESS), wallet_address),
+    'available_currencies': (lambda resolver, i: resolver.resolve_available_currencies(WALLET_NAME % i), lambda i: ['btc', 'ltc']),
+    'email_name': (lambda resolver, i: resolver.resolve_wallet_name(EMAIL_NAME % i, 'btc', forwarded_for=CLIENT_ADDRESS), wallet_address),
+    'bip70': (lambda resolver, i: resolver.resolve_wallet_name(BIP70_NAME % i, 'btc', forwarded_for=CLIENT_ADDRESS), endpoint_response)
+}
+
+
+class BenchmarkResolver(WalletNameResolver):
+
+    def __init__(self, dns_port, **kwargs):
+
+        self.dns_port = dns_port
+        WalletNameResolver.__init__(self, **kwargs)
+
+    def _build_context(self):
+
+        # Every query goes to the local authoritative server, validated against its trust anchor
+        ctx = WalletNameResolver._build_context(self)
+        ctx.set_option('do-not-query-localhost:', 'no')
+        ctx.set_fwd('127.0.0.1@%d' % self.dns_port)
+        return ctx
+
+
+class StubEndpointAdapter(HTTPAdapter):
+
+    def send(self, request, **kwargs):
+
+        # The endpoint host only exists in the stand-in zone, the system resolver cannot connect to it
+        request.url = request.url.replace('//%s:' % ENDPOINT_HOST, '//127.0.0.1:', 1)
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+class BenchmarkEndpointClient(EndpointClient):
+
+    def _build_session(self):
+
+        session = EndpointClient._build_session(self)
+        session.mount('http://', StubEndpointAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=0))
+        return session
+
+
+class Environment:
+
+    def __init__(self, names):
+
+        self.names = names
+        self.tmpdir = tempfile.mkdtemp(prefix='wnsresolver-bench')
+
+        self.addressimo = AddressimoStub({})
+        self.addressimo.server.responses.update((endpoint_path(i), endpoint_response(i)) for i in range(names))
+
+        zone, dnskey = build_zone(names, self.addressimo.port)
+        self.dns = AuthoritativeServer(zone)
+
+        self.trust_anchor = os.path.join(self.tmpdir, 'wns.test.key')
+        write_trust_anchor(self.trust_anchor, dnskey)
+
+        # No system nameservers, only the forwarder set in BenchmarkResolver
+        self.resolv_conf = os.path.join(self.tmpdir, 'resolv.conf')
+        open(self.resolv_conf, 'w').close()
+
+    def start(self):
+
+        self.addressimo.start()
+        self.dns.start()
+        return self
+
+    def stop(self):
+
+        self.dns.stop()
+        self.addressimo.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def resolver(self, concurrency, result_cache=False, optimistic=False):
+
+        return BenchmarkResolver(
+            self.dns.port,
+            resolv_conf=self.resolv_conf,
+            dnssec_root_key=self.trust_anchor,
+            ctx_pool_size=concurrency,
+            optimistic=optimistic,
+            cache=ResultCache() if result_cache else None,
+            endpoint_client=BenchmarkEndpointClient(pool_maxsize=concurrency),
+            no_route_ranges=[]
+        )
+
+
+def percentile(sorted_values, fraction):
+
+    # Nearest-rank percentile
+    return sorted_values[max(0, int(math.ceil(fraction * len(sorted_values))) - 1)]
+
+
+def run_phase(env, resolver, scenario, requests, concurrency):
+
+    resolve, expected = SCENARIOS[scenario]
+    latencies = [None] * requests
+    errors = []
+
+    def call(index):
+
+        name_index = index % env.names
+        start = time.perf_counter()
+        try:
+            value = resolve(resolver, name_index)
+        except Exception as e:
+            value = e
+        latencies[index] = time.perf_counter() - start
+
+        if value != expected(name_index):
+            errors.append(repr(value))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': len(errors),
+        'error_sample': errors[:3],
+        'elapsed_s': round(elapsed, 6),
+        'throughput_rps': round(requests / elapsed, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3)
+    }
+
+
+def run(args):
+
+    env = Environment(max(args.names, 1)).start()
+    results = []
+
+    try:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                # Cold: a fresh resolver, its unbound cache, result cache and HTTP pool start empty. Warm: the same resolver again.
+                resolver = env.resolver(concurrency, result_cache=args.result_cache, optimistic=args.optimistic)
+                requests = min(args.requests, env.names)
+
+                for phase in ('cold', 'warm'):
+                    queries_before = env.dns.queries
+                    result = run_phase(env, resolver, scenario, requests, concurrency)
+                    result.update({
+                        'scenario': scenario,
+                        'phase': phase,
+                        'concurrency': concurrency,
+                        'upstream_queries': env.dns.queries - queries_before
+                    })
+                    results.append(result)
+
+                    print('%-22s %-5s c=%-3d %9.1f req/s  p50 %8.3f ms  p99 %8.3f ms  errors %d' % (
+                        scenario, phase, concurrency, result['throughput_rps'], result['p50_ms'], result['p99_ms'], result['errors']
+                    ))
+
+                resolver.endpoint_client.close()
+    finally:
+        env.stop()
+
+    return {
+        'version': RESULTS_VERSION,
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'options': {
+            'names': args.names,
+            'requests': args.requests,
+            'result_cache': args.result_cache,
+            'optimistic': args.optimistic
+        },
+        'results': results
+    }
+
+
+def git_commit():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+
+    # Regressions: throughput down or p50/p99 up by more than tolerance against the matching baseline run
+    key = lambda x: (x['scenario'], x['phase'], x['concurrency'])
+    previous = dict((key(x), x) for x in baseline['results'])
+    regressions = []
+
+    for result in report['results']:
+        base = previous.get(key(result))
+        if not base:
+            continue
+
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append((key(result), 'throughput_rps', base['throughput_rps'], result['throughput_rps']))
+        for metric in ('p50_ms', 'p99_ms'):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append((key(result), metric, base[metric], result[metric]))
+
+    return regressions
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark wnsresolver against a local DNSSEC-signed zone')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('--names', type=int, default=500, help='wallet names per family in the stand-in zone')
+    parser.add_argument('--requests', type=int, default=500, help='requests per phase, each name is resolved at most once per phase')
+    parser.add_argument('--result-cache', action='store_true', help='enable the ResultCache')
+    parser.add_argument('--optimistic', action='store_true', help='send list and currency queries together')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--baseline', help='JSON results to compare against, exits 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    errors = sum(x['errors'] for x in report['results'])
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(report, json.load(fp), args.tolerance)
+        for (scenario, phase, concurrency), metric, before, after in regressions:
+            print('REGRESSION %s %s c=%d %s: %s -> %s' % (scenario, phase, concurrency, metric, before, after))
+        if regressions:
+            return 1
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
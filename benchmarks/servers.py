@@ -0,0 +1,253 @@
+__author__ = 'mdavid'
+
+# Local stand-ins for the benchmark: an authoritative DNS server for the signed zone and a stub Addressimo.
+
+import bisect
+import socketserver
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class AuthoritativeZone:
+
+    def __init__(self, zone):
+
+        self.zone = zone
+        self.origin = zone.origin
+
+        # NSEC owners in canonical order, for denial of existence proofs
+        self.nsec_owners = sorted(name for name, node in zone.nodes.items() if node.get_rdataset(zone.rdclass, dns.rdatatype.NSEC))
+        self.names = set(zone.nodes.keys())
+
+    def answer(self, query):
+
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        dnssec = bool(query.ednsflags & dns.flags.DO)
+
+        question = query.question[0]
+        qname, rdtype = question.name, question.rdtype
+
+        if not qname.is_subdomain(self.origin):
+            response.set_rcode(dns.rcode.REFUSED)
+            response.flags &= ~dns.flags.AA
+            return response
+
+        if qname in self.names:
+            rrset = self._rrset(qname, rdtype, dnssec)
+            if rrset:
+                response.answer.extend(rrset)
+                return response
+
+            # NODATA, the owner's NSEC proves the type is absent
+            self._add_negative(response, [qname], dnssec)
+            return response
+
+        if [x for x in self.names if x.is_subdomain(qname)]:
+            # Empty non-terminal, NODATA proven by the covering NSEC
+            self._add_negative(response, [self._covering(qname)], dnssec)
+            return response
+
+        # NXDOMAIN, prove the name and the wildcard at its closest encloser do not exist
+        encloser = qname.parent()
+        while encloser not in self.names and encloser != self.origin:
+            encloser = encloser.parent()
+
+        response.set_rcode(dns.rcode.NXDOMAIN)
+        self._add_negative(response, [self._covering(qname), self._covering(dns.name.Name((b'*',) + encloser.labels))], dnssec)
+        return response
+
+    def _rrset(self, name, rdtype, dnssec):
+
+        node = self.zone.nodes[name]
+        rdataset = node.get_rdataset(self.zone.rdclass, rdtype)
+        if rdataset is None:
+            return []
+
+        rrsets = [dns.rrset.from_rdata_list(name, rdataset.ttl, list(rdataset))]
+        if dnssec:
+            rrsig = node.get_rdataset(self.zone.rdclass, dns.rdatatype.RRSIG, rdtype)
+            if rrsig is not None:
+                rrsets.append(dns.rrset.from_rdata_list(name, rrsig.ttl, list(rrsig)))
+        return rrsets
+
+    def _covering(self, name):
+
+        return self.nsec_owners[bisect.bisect_right(self.nsec_owners, name) - 1]
+
+    def _add_negative(self, response, nsec_owners, dnssec):
+
+        response.authority.extend(self._rrset(self.origin, dns.rdatatype.SOA, dnssec))
+        if not dnssec:
+            return
+
+        for owner in sorted(set(nsec_owners)):
+            response.authority.extend(self._rrset(owner, dns.rdatatype.NSEC, dnssec))
+
+
+class _UDPHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+
+        data, sock = self.request
+        wire = self.server.authority.respond(data, 512)
+        if wire:
+            sock.sendto(wire, self.client_address)
+
+
+class _TCPHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+
+        while True:
+            header = self._read(2)
+            if not header:
+                return
+            wire = self.server.authority.respond(self._read(struct.unpack('!H', header)[0]), 65535)
+            if wire:
+                self.request.sendall(struct.pack('!H', len(wire)) + wire)
+
+    def _read(self, length):
+
+        data = b''
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+class _ThreadingUDPServer(socketserver.ThreadingUDPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class AuthoritativeServer:
+
+    # Serves the zone over UDP and TCP on 127.0.0.1, port 0 picks a free port
+
+    def __init__(self, zone, port=0):
+
+        self.authority = AuthoritativeZone(zone)
+        self.queries = 0
+
+        self.udp = _ThreadingUDPServer(('127.0.0.1', port), _UDPHandler)
+        self.port = self.udp.server_address[1]
+        self.tcp = _ThreadingTCPServer(('127.0.0.1', self.port), _TCPHandler)
+
+        for server in (self.udp, self.tcp):
+            server.authority = self
+
+        self._threads = []
+
+    def respond(self, data, max_size):
+
+        try:
+            query = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return None
+
+        self.queries += 1
+        response = self.authority.answer(query)
+
+        if query.edns >= 0:
+            max_size = max(max_size, query.payload)
+
+        try:
+            return response.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            # Retry over TCP
+            response = dns.message.make_response(query)
+            response.flags |= dns.flags.TC
+            return response.to_wire()
+
+    def start(self):
+
+        for server in (self.udp, self.tcp):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+
+        for server in (self.udp, self.tcp):
+            server.shutdown()
+            server.server_close()
+
+
+class _AddressimoHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, do not let Nagle hold the body back on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+
+        body = self.server.responses.get(self.path)
+        self.server.requests += 1
+
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AddressimoStub:
+
+    # Answers GET <path> with a fixed bitcoin URI, like Addressimo's BIP32/BIP70 resolve endpoint
+
+    def __init__(self, responses, port=0):
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _AddressimoHandler)
+        self.server.daemon_threads = True
+        self.server.responses = responses
+        self.server.requests = 0
+        self.port = self.server.server_address[1]
+
+    @property
+    def requests(self):
+
+        return self.server.requests
+
+    def start(self):
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+
+        self.server.shutdown()
+        self.server.server_close()
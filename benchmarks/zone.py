@@ -0,0 +1,88 @@
+__author__ = 'mdavid'
+
+# Builds the DNSSEC-signed stand-in zone served to the resolver during benchmarks.
+# Requires Python 3, dnspython>=2.4 and cryptography.
+
+import hashlib
+from base64 import b64encode
+
+import dns.dnssec
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+from cryptography.hazmat.primitives.asymmetric import ec
+
+ORIGIN = 'wns.test.'
+ENDPOINT_HOST = 'pay.wns.test'
+TTL = 300
+
+# Name families, each resolving 'btc' to a known value
+WALLET_NAME = 'wallet%d.wns.test'
+EMAIL_NAME = 'user%d@wns.test'
+BIP70_NAME = 'bip70-%d.wns.test'
+
+
+def wallet_address(index):
+
+    return '1Bench%026d' % index
+
+
+def endpoint_path(index):
+
+    return '/resolve/%d' % index
+
+
+def endpoint_response(index):
+
+    return 'bitcoin:%s?amount=0.001' % wallet_address(index)
+
+
+def email_qname(index):
+
+    localpart, domain = (EMAIL_NAME % index).split('@', 1)
+    return '%s.%s' % (hashlib.sha224(localpart.encode('utf-8')).hexdigest(), domain)
+
+
+def build_zone(names, endpoint_port):
+
+    zone = dns.zone.Zone(ORIGIN, relativize=False)
+
+    records = [
+        (ORIGIN, 'SOA', 'ns.wns.test. hostmaster.wns.test. 1 3600 600 86400 %d' % TTL),
+        (ORIGIN, 'NS', 'ns.wns.test.'),
+        ('ns', 'A', '127.0.0.1'),
+        (ENDPOINT_HOST + '.', 'A', '127.0.0.1')
+    ]
+
+    for index in range(names):
+        address = wallet_address(index)
+        endpoint_url = 'http://%s:%d%s' % (ENDPOINT_HOST, endpoint_port, endpoint_path(index))
+
+        for qname in (WALLET_NAME % index, email_qname(index)):
+            records.append(('_wallet.%s.' % qname, 'TXT', '"btc ltc"'))
+            records.append(('_btc._wallet.%s.' % qname, 'TXT', '"%s"' % address))
+            records.append(('_ltc._wallet.%s.' % qname, 'TXT', '"L%s"' % address[1:]))
+
+        records.append(('_wallet.%s.' % (BIP70_NAME % index), 'TXT', '"btc"'))
+        records.append(('_btc._wallet.%s.' % (BIP70_NAME % index), 'TXT', '"%s"' % b64encode(endpoint_url.encode('utf-8')).decode('ascii')))
+
+    with zone.writer() as txn:
+        for name, rdtype, text in records:
+            rdata = dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.from_text(rdtype), text, origin=zone.origin, relativize=False)
+            txn.add(dns.name.from_text(name, zone.origin), TTL, rdata)
+
+    # A single ECDSA P-256 key signs everything and doubles as the trust anchor
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    dnskey = dns.dnssec.make_dnskey(private_key.public_key(), dns.dnssec.Algorithm.ECDSAP256SHA256, flags=257)
+    dns.dnssec.sign_zone(zone, keys=[(private_key, dnskey)], dnskey_ttl=TTL, lifetime=86400)
+
+    return zone, dnskey
+
+
+def write_trust_anchor(path, dnskey):
+
+    # Zone file format, loaded by unbound's add_ta_file in place of the root key
+    with open(path, 'w') as fp:
+        fp.write('%s %d IN DNSKEY %s\n' % (ORIGIN, TTL, dnskey.to_text()))
@@ -7,6 +7,12 @@ install_requires = [
     'requests>=2.5.1'
 ]
 
+extras_require = {
+    'async': ['aiohttp>=3.0'],
+    'benchmark': ['dnspython>=2.4', 'cryptography'],
+    'prometheus': ['prometheus_client']
+}
+
 test_requires = [
     'mock>=1.0.1'
 ]
@@ -16,6 +22,7 @@ setup(
     version='0.0.8',
     packages=['wnsresolver'],
     install_requires=install_requires,
+    extras_require=extras_require,
     tests_require=test_requires,
     test_suite = 'tests',
     url='https://github.com/netkicorp/wns-resolver',
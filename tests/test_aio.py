@@ -0,0 +1,469 @@
+__author__ = 'mdavid'
+
+import socket
+import sys
+from mock import *
+from unittest import TestCase, skipIf
+from wnsresolver import *
+from wnsresolver.cache import ResultCache
+from wnsresolver.endpoint import EndpointClient, EndpointResponseTooLargeError
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from wnsresolver.aio import AsyncWalletNameResolver
+
+@skipIf(sys.version_info < (3, 5), 'AsyncWalletNameResolver requires Python 3.5+')
+class AsyncTestCase(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def completed(self, value):
+        future = asyncio.Future(loop=self.loop)
+        future.set_result(value)
+        return future
+
+class FakeContent:
+
+    # Delivers the body in the given chunks, as aiohttp's StreamReader.iter_chunked does as data arrives
+    def __init__(self, test, chunks):
+        self.test = test
+        self.chunks = list(chunks)
+
+    def iter_chunked(self, size):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = asyncio.Future(loop=self.test.loop)
+        if self.chunks:
+            future.set_result(self.chunks.pop(0))
+        else:
+            future.set_exception(StopAsyncIteration())
+        return future
+
+class FakeResponse:
+
+    def __init__(self, test, body, status=200):
+        self.test = test
+        self.status = status
+        self.charset = None
+        self.headers = {}
+        self.content = FakeContent(test, body if isinstance(body, list) else [body])
+
+    def __aenter__(self):
+        return self.test.completed(self)
+
+    def __aexit__(self, *args):
+        return self.test.completed(False)
+
+class TestAsyncResolveWalletName(AsyncTestCase):
+
+    def setUp(self):
+
+        super(TestAsyncResolveWalletName, self).setUp()
+
+        self.patcher1 = patch('wnsresolver.aio.AsyncWalletNameResolver._query', new_callable=Mock)
+        self.patcher2 = patch('wnsresolver.WalletNameResolver._record_value')
+
+        self.mockQuery = self.patcher1.start()
+        self.mockRecordValue = self.patcher2.start()
+
+        self.records = {
+            '_wallet.wallet.mattdavid.xyz': 'btc ltc',
+            '_btc._wallet.wallet.mattdavid.xyz': '23456789MgDBffBffBff',
+            '_ltc._wallet.wallet.mattdavid.xyz': 'aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU='
+        }
+        self.mockQuery.side_effect = lambda name, qtype: self.completed((0, self.records.get(name)))
+        self.mockRecordValue.side_effect = lambda status, result: result
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+        self.patcher2.stop()
+
+        super(TestAsyncResolveWalletName, self).tearDown()
+
+    def test_go_right(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc'))
+
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual(2, self.mockQuery.call_count)
+
+    def test_go_right_not_optimistic(self):
+
+        wns_resolver = AsyncWalletNameResolver(optimistic=False)
+        ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc'))
+
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual('_wallet.wallet.mattdavid.xyz', self.mockQuery.call_args_list[0][0][0])
+        self.assertEqual('_btc._wallet.wallet.mattdavid.xyz', self.mockQuery.call_args_list[1][0][0])
+
+    def test_no_name(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertRaises(AttributeError, self.run_async, wns_resolver.resolve_wallet_name(None, 'btc'))
+        self.assertEqual(0, self.mockQuery.call_count)
+
+    def test_no_currency_list(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertRaises(WalletNameCurrencyUnavailableError, self.run_async, wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'dgc'))
+
+    def test_no_available_currency(self):
+
+        self.records['_wallet.wallet.mattdavid.xyz'] = None
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertRaises(WalletNameUnavailableError, self.run_async, wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc'))
+
+    def test_cache_hit(self):
+
+        cache = ResultCache()
+        cache.set(('_wallet.wallet.mattdavid.xyz', 'TXT'), ('btc ltc', None), 300)
+        cache.set(('_btc._wallet.wallet.mattdavid.xyz', 'TXT'), ('1cachedaddress', None), 300)
+
+        wns_resolver = AsyncWalletNameResolver(cache=cache)
+        ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc'))
+
+        self.assertEqual('1cachedaddress', ret_val)
+        self.assertEqual(0, self.mockQuery.call_count)
+
+    def test_endpoint_fetch(self):
+
+        http_session = Mock()
+        http_session.get.return_value = FakeResponse(self, b'bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc')
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session)
+        with patch.object(wns_resolver, 'get_endpoint_host', new_callable=Mock) as mockGetEndpointHost:
+            mockGetEndpointHost.return_value = self.completed(('https://bip32address.com/getmine', None))
+            ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'ltc', forwarded_for='8.8.8.8'))
+
+        self.assertEqual('bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc', ret_val)
+        self.assertEqual('https://bip32address.com/getmine', http_session.get.call_args[0][0])
+        self.assertEqual({'X-Forwarded-For': '8.8.8.8'}, http_session.get.call_args[1]['headers'])
+
+    def test_endpoint_body_in_chunks(self):
+
+        http_session = Mock()
+        http_session.get.side_effect = lambda url, headers: FakeResponse(self, [b'bitcoin:1FHz8bpEE5qUZ9Xh', b'fjzAbCCwo5b', b'T1HMNAc'])
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session)
+        ret_val = self.run_async(wns_resolver._fetch_endpoint('https://bip32address.com/getmine'))
+
+        self.assertEqual('bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc', ret_val)
+
+    def test_endpoint_chunks_too_large(self):
+
+        http_session = Mock()
+        http_session.get.side_effect = lambda url, headers: FakeResponse(self, [b'x' * 40000, b'x' * 40000])
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session)
+        self.assertRaises(EndpointResponseTooLargeError, self.run_async, wns_resolver._fetch_endpoint('https://bip32address.com/getmine'))
+
+    def test_endpoint_response_too_large(self):
+
+        http_session = Mock()
+        http_session.get.return_value = FakeResponse(self, b'x' * 65537)
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session)
+        with patch.object(wns_resolver, 'get_endpoint_host', new_callable=Mock) as mockGetEndpointHost:
+            mockGetEndpointHost.return_value = self.completed(('https://bip32address.com/getmine', None))
+            ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'ltc'))
+
+        self.assertEqual('https://bip32address.com/getmine', ret_val)
+
+    def test_endpoint_fetch_coalesced(self):
+
+        http_session = Mock()
+        http_session.get.side_effect = lambda url, headers: FakeResponse(self, b'bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc')
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session)
+        ret_val = self.run_async(asyncio.gather(
+            wns_resolver._fetch_endpoint('https://bip32address.com/getmine'),
+            wns_resolver._fetch_endpoint('https://bip32address.com/getmine')
+        ))
+
+        self.assertEqual(['bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc'] * 2, ret_val)
+        self.assertEqual(1, http_session.get.call_count)
+        self.assertEqual({}, wns_resolver._endpoint_fetches)
+
+    def test_endpoint_micro_cache(self):
+
+        http_session = Mock()
+        http_session.get.side_effect = lambda url, headers: FakeResponse(self, b'bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc')
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session, endpoint_client=EndpointClient(cache=ResultCache()))
+        self.run_async(wns_resolver._fetch_endpoint('https://bip32address.com/getmine'))
+        ret_val = self.run_async(wns_resolver._fetch_endpoint('https://bip32address.com/getmine'))
+
+        self.assertEqual('bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc', ret_val)
+        self.assertEqual(1, http_session.get.call_count)
+
+    def test_endpoint_error_not_cached(self):
+
+        http_session = Mock()
+        http_session.get.side_effect = lambda url, headers: FakeResponse(self, b'Internal Server Error', status=500)
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session, endpoint_client=EndpointClient(cache=ResultCache()))
+        self.run_async(wns_resolver._fetch_endpoint('https://bip32address.com/getmine'))
+        self.run_async(wns_resolver._fetch_endpoint('https://bip32address.com/getmine'))
+
+        self.assertEqual(2, http_session.get.call_count)
+
+    def test_endpoint_fetch_exception(self):
+
+        http_session = Mock()
+        http_session.get.side_effect = Exception()
+
+        wns_resolver = AsyncWalletNameResolver(http_session=http_session)
+        with patch.object(wns_resolver, 'get_endpoint_host', new_callable=Mock) as mockGetEndpointHost:
+            mockGetEndpointHost.return_value = self.completed(('https://bip32address.com/getmine', None))
+            ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'ltc'))
+
+        self.assertEqual('https://bip32address.com/getmine', ret_val)
+
+    @patch('wnsresolver.WalletNameResolver.resolve_wallet_name')
+    def test_namecoin_executor(self, mockResolveWalletName):
+
+        mockResolveWalletName.return_value = '23456789MgDBffBffBff'
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.bit', 'btc'))
+
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual(0, self.mockQuery.call_count)
+
+    def test_resolve_all_currencies(self):
+
+        def record_value(status, result):
+            if result == 'insecure':
+                raise WalletNameLookupInsecureError
+            return result
+
+        self.records['_wallet.wallet.mattdavid.xyz'] = 'btc ltc dgc'
+        self.records['_dgc._wallet.wallet.mattdavid.xyz'] = 'insecure'
+        self.mockRecordValue.side_effect = record_value
+
+        wns_resolver = AsyncWalletNameResolver()
+        with patch.object(wns_resolver, 'get_endpoint_host', new_callable=Mock) as mockGetEndpointHost:
+            mockGetEndpointHost.return_value = self.completed((None, 'https://bip32address.com/getmine'))
+            ret_val = self.run_async(wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz'))
+
+        self.assertEqual(['btc', 'dgc', 'ltc'], sorted(ret_val))
+        self.assertEqual('23456789MgDBffBffBff', ret_val['btc'])
+        self.assertEqual('https://bip32address.com/getmine', ret_val['ltc'])
+        self.assertIsInstance(ret_val['dgc'], WalletNameLookupInsecureError)
+        self.assertEqual('_wallet.wallet.mattdavid.xyz', self.mockQuery.call_args_list[0][0][0])
+        self.assertEqual(4, self.mockQuery.call_count)
+
+    def test_resolve_all_currencies_no_currency_list(self):
+
+        self.records['_wallet.wallet.mattdavid.xyz'] = None
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertRaises(WalletNameUnavailableError, self.run_async, wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz'))
+
+    def test_timeout(self):
+
+        # The currency record never answers, its unbound query is cancelled once the timeout runs out
+        pending = {}
+        def query(name, qtype):
+            if name.startswith('_btc'):
+                pending[name] = asyncio.Future(loop=self.loop)
+                return pending[name]
+            return self.completed((0, self.records.get(name)))
+        self.mockQuery.side_effect = query
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertRaises(WalletNameTimeoutError, self.run_async, wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc', timeout=0.01))
+        self.assertTrue(pending['_btc._wallet.wallet.mattdavid.xyz'].cancelled())
+
+    def test_within_timeout(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc', timeout=5))
+
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+
+
+class TestAsyncResolveAvailableCurrencies(AsyncTestCase):
+
+    @patch('wnsresolver.aio.AsyncWalletNameResolver.resolve', new_callable=Mock)
+    def test_go_right(self, mockResolve):
+
+        mockResolve.return_value = self.completed('btc ltc dgc')
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.resolve_available_currencies('wallet@mattdavid.xyz'))
+
+        self.assertEqual(['btc', 'ltc', 'dgc'], ret_val)
+        self.assertEqual('_wallet.9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.mattdavid.xyz', mockResolve.call_args[0][0])
+
+    @patch('wnsresolver.aio.AsyncWalletNameResolver.resolve', new_callable=Mock)
+    def test_no_currencies(self, mockResolve):
+
+        mockResolve.return_value = self.completed(None)
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertEqual([], self.run_async(wns_resolver.resolve_available_currencies('wallet.mattdavid.xyz')))
+
+
+class TestAsyncQuery(AsyncTestCase):
+
+    def setUp(self):
+
+        super(TestAsyncQuery, self).setUp()
+
+        self.patcher1 = patch('wnsresolver.WalletNameResolver._build_context')
+        self.patcher2 = patch.object(self.loop, 'add_reader')
+
+        self.mockBuildContext = self.patcher1.start()
+        self.mockAddReader = self.patcher2.start()
+
+        self.callbacks = []
+        def resolve_async(name, mydata, callback, rrtype, rrclass):
+            self.callbacks.append((callback, mydata))
+            return 0, 7
+        self.mockBuildContext.return_value.resolve_async.side_effect = resolve_async
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+        self.patcher2.stop()
+
+        super(TestAsyncQuery, self).tearDown()
+
+    def test_go_right(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        task = self.loop.create_task(wns_resolver._query('_wallet.mattdavid.xyz', 'TXT'))
+        self.run_async(asyncio.sleep(0))
+
+        callback, mydata = self.callbacks[0]
+        callback(mydata, 0, 'result')
+
+        self.assertEqual((0, 'result'), self.run_async(task))
+        self.assertEqual(1, self.mockAddReader.call_count)
+        self.assertEqual(self.mockBuildContext.return_value.process, self.mockAddReader.call_args[0][1])
+
+    def test_later_event_loop(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        task = self.loop.create_task(wns_resolver._query('_wallet.mattdavid.xyz', 'TXT'))
+        self.run_async(asyncio.sleep(0))
+        callback, mydata = self.callbacks.pop()
+        callback(mydata, 0, 'result')
+        self.run_async(task)
+
+        # A second asyncio.run() style loop, the first one closed
+        self.loop.close()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        with patch.object(self.loop, 'add_reader') as mockAddReader:
+            task = self.loop.create_task(wns_resolver._query('_wallet.mattdavid.xyz', 'TXT'))
+            self.run_async(asyncio.sleep(0))
+            callback, mydata = self.callbacks.pop()
+            callback(mydata, 0, 'result')
+
+            self.assertEqual((0, 'result'), self.run_async(task))
+            self.assertEqual(self.mockBuildContext.return_value.process, mockAddReader.call_args[0][1])
+
+        # The context and its cache carried over
+        self.assertEqual(1, self.mockBuildContext.call_count)
+
+    def test_submit_failure(self):
+
+        self.mockBuildContext.return_value.resolve_async.side_effect = None
+        self.mockBuildContext.return_value.resolve_async.return_value = (1, 0)
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.assertEqual((1, None), self.run_async(wns_resolver._query('_wallet.mattdavid.xyz', 'TXT')))
+
+    def test_cancel(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        task = self.loop.create_task(wns_resolver._query('_wallet.mattdavid.xyz', 'TXT'))
+        self.run_async(asyncio.sleep(0))
+
+        task.cancel()
+        self.assertRaises(asyncio.CancelledError, self.run_async, task)
+        self.mockBuildContext.return_value.cancel.assert_called_once_with(7)
+
+
+class TestAsyncGetEndpointHost(AsyncTestCase):
+
+    def setUp(self):
+
+        AsyncTestCase.setUp(self)
+
+        self.patcher1 = patch('wnsresolver.aio.AsyncWalletNameResolver._query', new_callable=Mock)
+        self.mockQuery = self.patcher1.start()
+
+        self.answers = {
+            'A': Mock(bogus=False, havedata=True, ttl=300),
+            'AAAA': Mock(bogus=False, havedata=False, ttl=0)
+        }
+        self.answers['A'].data.as_raw_data.return_value = [socket.inet_pton(socket.AF_INET, '93.184.216.34')]
+        self.mockQuery.side_effect = lambda name, qtype: self.completed((0, self.answers[qtype]))
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+        AsyncTestCase.tearDown(self)
+
+    def test_go_right_valid_hostname(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid'))
+
+        self.assertEqual(('http://www.example.com/pr/uuid', None), ret_val)
+        self.assertEqual([call('www.example.com', 'A'), call('www.example.com', 'AAAA')], self.mockQuery.call_args_list)
+
+    def test_hostname_addresses_cached(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        self.run_async(wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid'))
+        ret_val = self.run_async(wns_resolver.get_endpoint_host('http://www.example.com/pr/other'))
+
+        self.assertEqual(('http://www.example.com/pr/other', None), ret_val)
+        self.assertEqual(2, self.mockQuery.call_count)
+
+    def test_hostname_resolves_to_no_route_ip(self):
+
+        self.answers['AAAA'].havedata = True
+        self.answers['AAAA'].data.as_raw_data.return_value = [socket.inet_pton(socket.AF_INET6, '::1')]
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid'))
+
+        self.assertEqual((None, 'http://www.example.com/pr/uuid'), ret_val)
+
+    def test_unresolvable_hostname(self):
+
+        self.answers['A'].havedata = False
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.get_endpoint_host('https://nonexistent_hostname/pr/uuid'))
+
+        self.assertEqual((None, 'https://nonexistent_hostname/pr/uuid'), ret_val)
+
+    def test_no_route_ip(self):
+
+        wns_resolver = AsyncWalletNameResolver()
+        ret_val = self.run_async(wns_resolver.get_endpoint_host('https://192.168.100.1/pr/uuid'))
+
+        self.assertEqual((None, 'https://192.168.100.1/pr/uuid'), ret_val)
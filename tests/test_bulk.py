@@ -0,0 +1,266 @@
+__author__ = 'mdavid'
+
+import socket
+from mock import *
+from unittest import TestCase
+from wnsresolver import *
+
+class TestResolveMany(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.WalletNameResolver._submit_query')
+        self.patcher2 = patch('wnsresolver.WalletNameResolver._process_answers')
+        self.patcher3 = patch('wnsresolver.WalletNameResolver._record')
+        self.patcher4 = patch('wnsresolver.WalletNameResolver._build_context')
+
+        self.mockSubmitQuery = self.patcher1.start()
+        self.mockProcessAnswers = self.patcher2.start()
+        self.mockRecord = self.patcher3.start()
+        self.mockBuildContext = self.patcher4.start()
+
+        self.records = {
+            '_wallet.wallet.mattdavid.xyz': 'btc ltc',
+            '_btc._wallet.wallet.mattdavid.xyz': '1btcaddress',
+            '_ltc._wallet.wallet.mattdavid.xyz': 'Lltcaddress',
+            '_wallet.wallet.justinnewton.me': 'btc',
+            '_btc._wallet.wallet.justinnewton.me': '1otherbtcaddress',
+            '_wallet.notfound.mattdavid.xyz': None
+        }
+
+        # Endpoint hostname answers keyed on (name, qtype), TXT answers are the queried name
+        self.host_answers = {}
+
+        self.pending = []
+        def submit_query(ctx, name, qtype, callback, mydata):
+            self.pending.append((callback, mydata, self.host_answers.get((name, qtype), name)))
+            return 0, len(self.pending)
+
+        def process_answers(ctx):
+            # Deliver outstanding answers newest first
+            pending, self.pending = self.pending, []
+            for callback, mydata, name in reversed(pending):
+                callback(mydata, 0, name)
+
+        self.mockSubmitQuery.side_effect = submit_query
+        self.mockProcessAnswers.side_effect = process_answers
+        self.mockRecord.side_effect = lambda status, name, cache_key=None: (self.records[name], None) if self.records[name] else None
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+        self.patcher2.stop()
+        self.patcher3.stop()
+        self.patcher4.stop()
+
+    def test_go_right_ordered(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.justinnewton.me', 'btc'),
+            ('wallet.mattdavid.xyz', 'ltc')
+        ], ordered=True))
+
+        self.assertEqual([
+            ('wallet.mattdavid.xyz', 'btc', '1btcaddress'),
+            ('wallet.justinnewton.me', 'btc', '1otherbtcaddress'),
+            ('wallet.mattdavid.xyz', 'ltc', 'Lltcaddress')
+        ], ret_val)
+
+        # _wallet.wallet.mattdavid.xyz is only queried once for both currencies
+        queried = [x[0][1] for x in self.mockSubmitQuery.call_args_list]
+        self.assertEqual(1, queried.count('_wallet.wallet.mattdavid.xyz'))
+        self.assertEqual(5, self.mockSubmitQuery.call_count)
+        self.assertEqual(1, self.mockBuildContext.call_count)
+
+    def test_go_right_completion_order(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.justinnewton.me', 'btc')
+        ]))
+
+        self.assertEqual(2, len(ret_val))
+        self.assertIn(('wallet.mattdavid.xyz', 'btc', '1btcaddress'), ret_val)
+        self.assertIn(('wallet.justinnewton.me', 'btc', '1otherbtcaddress'), ret_val)
+
+    def test_max_in_flight(self):
+
+        in_flight = []
+        submit_query = self.mockSubmitQuery.side_effect
+        def tracking_submit_query(*args):
+            ret_val = submit_query(*args)
+            in_flight.append(len(self.pending))
+            return ret_val
+        self.mockSubmitQuery.side_effect = tracking_submit_query
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.justinnewton.me', 'btc'),
+            ('wallet.mattdavid.xyz', 'ltc')
+        ], max_in_flight=1))
+
+        self.assertEqual(3, len(ret_val))
+        self.assertEqual(1, max(in_flight))
+
+    def test_per_item_errors(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([
+            ('notfound.mattdavid.xyz', 'btc'),
+            ('wallet.mattdavid.xyz', 'dgc'),
+            (None, 'btc'),
+            ('wallet.mattdavid.xyz', 'btc')
+        ], ordered=True))
+
+        self.assertIsInstance(ret_val[0][2], WalletNameUnavailableError)
+        self.assertIsInstance(ret_val[1][2], WalletNameCurrencyUnavailableError)
+        self.assertIsInstance(ret_val[2][2], AttributeError)
+        self.assertEqual('1btcaddress', ret_val[3][2])
+
+    def test_list_lookup_error_shared(self):
+
+        self.mockRecord.side_effect = WalletNameLookupInsecureError()
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.mattdavid.xyz', 'ltc')
+        ]))
+
+        self.assertIsInstance(ret_val[0][2], WalletNameLookupInsecureError)
+        self.assertIsInstance(ret_val[1][2], WalletNameLookupInsecureError)
+        self.assertEqual(1, self.mockSubmitQuery.call_count)
+
+    def test_submit_failure(self):
+
+        self.mockSubmitQuery.side_effect = None
+        self.mockSubmitQuery.return_value = (1, 0)
+        self.mockRecord.side_effect = WalletNameLookupError()
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc')]))
+
+        self.assertIsInstance(ret_val[0][2], WalletNameLookupError)
+        self.assertEqual(0, self.mockProcessAnswers.call_count)
+
+    @patch('wnsresolver.request_client_address')
+    @patch('wnsresolver.EndpointClient.get')
+    def test_endpoint_hostname_resolved_on_bulk_context(self, mockEndpointGet, mockRequest):
+
+        mockEndpointGet.return_value = '1endpointaddress'
+        self.records['_btc._wallet.wallet.mattdavid.xyz'] = 'https://pay.example.com/btc'
+        self.records['_ltc._wallet.wallet.mattdavid.xyz'] = 'https://pay.example.com/ltc'
+        self.mockRecord.side_effect = lambda status, name, cache_key=None: (self.records[name], self.records[name] if self.records[name].startswith('https') else None)
+
+        self.host_answers[('pay.example.com', 'A')] = Mock(bogus=False, havedata=True, ttl=60)
+        self.host_answers[('pay.example.com', 'A')].data.as_raw_data.return_value = [socket.inet_aton('93.184.216.34')]
+        self.host_answers[('pay.example.com', 'AAAA')] = Mock(bogus=False, havedata=False, ttl=0)
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.mattdavid.xyz', 'ltc')
+        ], ordered=True))
+
+        self.assertEqual([
+            ('wallet.mattdavid.xyz', 'btc', '1endpointaddress'),
+            ('wallet.mattdavid.xyz', 'ltc', '1endpointaddress')
+        ], ret_val)
+
+        # One A and one AAAA query shared by both endpoints, on the bulk context
+        queried = [(x[0][1], x[0][2]) for x in self.mockSubmitQuery.call_args_list]
+        self.assertEqual(1, queried.count(('pay.example.com', 'A')))
+        self.assertEqual(1, queried.count(('pay.example.com', 'AAAA')))
+        self.assertEqual(1, self.mockBuildContext.call_count)
+        self.assertEqual((True, ['93.184.216.34']), wns_resolver.host_cache.get('pay.example.com'))
+
+        # Cached addresses skip the hostname queries
+        self.mockSubmitQuery.reset_mock()
+        list(wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc')]))
+        self.assertEqual(2, self.mockSubmitQuery.call_count)
+
+    @patch('wnsresolver.EndpointClient.get')
+    def test_endpoint_hostname_bogus(self, mockEndpointGet):
+
+        self.records['_btc._wallet.wallet.mattdavid.xyz'] = 'https://pay.example.com/btc'
+        self.mockRecord.side_effect = lambda status, name, cache_key=None: (self.records[name], self.records[name] if self.records[name].startswith('https') else None)
+
+        self.host_answers[('pay.example.com', 'A')] = Mock(bogus=True, havedata=True, ttl=60)
+        self.host_answers[('pay.example.com', 'AAAA')] = Mock(bogus=False, havedata=False, ttl=0)
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc')]))
+
+        self.assertEqual([('wallet.mattdavid.xyz', 'btc', 'https://pay.example.com/btc')], ret_val)
+        self.assertEqual(0, mockEndpointGet.call_count)
+        self.assertEqual((False, None), wns_resolver.host_cache.get('pay.example.com'))
+
+    @patch('wnsresolver.WalletNameResolver.resolve_wallet_name')
+    def test_namecoin_inline(self, mockResolveWalletName):
+
+        mockResolveWalletName.return_value = '1namecoinaddress'
+
+        wns_resolver = WalletNameResolver()
+        ret_val = list(wns_resolver.resolve_many([('wallet.mattdavid.bit', 'btc')]))
+
+        self.assertEqual([('wallet.mattdavid.bit', 'btc', '1namecoinaddress')], ret_val)
+        self.assertEqual(0, self.mockSubmitQuery.call_count)
+
+    def test_abandoned_iteration_cancels(self):
+
+        def process_answers(ctx):
+            callback, mydata, name = self.pending.pop(0)
+            callback(mydata, 0, name)
+        self.mockProcessAnswers.side_effect = process_answers
+
+        wns_resolver = WalletNameResolver()
+        results = wns_resolver.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.justinnewton.me', 'btc')
+        ])
+        next(results)
+        results.close()
+
+        self.assertTrue(self.mockBuildContext.return_value.cancel.called)
+
+        # The context went back to the bulk pool, none was taken from ctx_pool
+        self.assertEqual(0, len(wns_resolver.ctx_pool))
+        self.assertIsNotNone(wns_resolver.bulk_pool.acquire(blocking=False))
+        self.assertEqual(1, self.mockBuildContext.call_count)
+
+    def test_context_reused(self):
+
+        wns_resolver = WalletNameResolver()
+        list(wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc')]))
+        list(wns_resolver.resolve_many([('wallet.justinnewton.me', 'btc')]))
+
+        # Later batches keep the unbound cache and trust anchors of the first
+        self.assertEqual(1, self.mockBuildContext.call_count)
+
+    def test_pooled_context_free_while_iterating(self):
+
+        wns_resolver = WalletNameResolver()
+
+        # Synchronous calls from the loop body get a pooled context rather than waiting for the batch to end
+        for name, currency, value in wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc'), ('wallet.justinnewton.me', 'btc')]):
+            acquired = wns_resolver.ctx_pool.acquire(blocking=False)
+            self.assertIsNotNone(acquired)
+            wns_resolver.ctx_pool.release(*acquired)
+
+    def test_reload_context(self):
+
+        wns_resolver = WalletNameResolver()
+        list(wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc')]))
+        wns_resolver.reload_context()
+        list(wns_resolver.resolve_many([('wallet.mattdavid.xyz', 'btc')]))
+
+        self.assertEqual(2, self.mockBuildContext.call_count)
+
+    def test_invalid_max_in_flight(self):
+
+        wns_resolver = WalletNameResolver()
+        self.assertRaises(ValueError, wns_resolver.resolve_many, [], max_in_flight=0)
@@ -0,0 +1,158 @@
+__author__ = 'mdavid'
+
+from mock import *
+from unittest import TestCase
+from wnsresolver.cache import ResultCache, ENTRY_OVERHEAD
+from wnsresolver.records import WalletNameRecord, ENDPOINT_URL
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.cache.time')
+        self.mockTime = self.patcher1.start()
+        self.mockTime.time.return_value = 1000.0
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+
+    def test_go_right(self):
+
+        cache = ResultCache()
+        cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc ltc', None), 300)
+
+        self.assertEqual((True, ('btc ltc', None)), cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual((False, None), cache.get(('_wallet.justinnewton.me', 'TXT')))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_ttl_expiry(self):
+
+        cache = ResultCache()
+        cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+
+        self.mockTime.time.return_value = 1299.0
+        self.assertTrue(cache.get(('_wallet.mattdavid.xyz', 'TXT'))[0])
+
+        self.mockTime.time.return_value = 1300.0
+        self.assertEqual((False, None), cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual(1, cache.expirations)
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.bytes)
+
+    def test_zero_ttl_not_cached(self):
+
+        cache = ResultCache()
+        cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 0)
+
+        self.assertEqual(0, len(cache))
+
+    def test_max_ttl(self):
+
+        cache = ResultCache(max_ttl=60)
+        cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+
+        self.mockTime.time.return_value = 1060.0
+        self.assertFalse(cache.get(('_wallet.mattdavid.xyz', 'TXT'))[0])
+
+    def test_negative_entry(self):
+
+        cache = ResultCache(negative_ttl=30)
+        cache.set(('_wallet.notfound.xyz', 'TXT'), None, 3600)
+
+        self.assertEqual((True, None), cache.get(('_wallet.notfound.xyz', 'TXT')))
+
+        self.mockTime.time.return_value = 1030.0
+        self.assertEqual((False, None), cache.get(('_wallet.notfound.xyz', 'TXT')))
+
+    def test_negative_entry_record_ttl(self):
+
+        cache = ResultCache(negative_ttl=30)
+        cache.set(('_wallet.notfound.xyz', 'TXT'), None, 10)
+
+        self.mockTime.time.return_value = 1010.0
+        self.assertFalse(cache.get(('_wallet.notfound.xyz', 'TXT'))[0])
+
+    def test_lru_eviction_max_entries(self):
+
+        cache = ResultCache(max_entries=2)
+        cache.set('a', ('1', None), 300)
+        cache.set('b', ('2', None), 300)
+        cache.get('a')
+        cache.set('c', ('3', None), 300)
+
+        self.assertTrue(cache.get('a')[0])
+        self.assertFalse(cache.get('b')[0])
+        self.assertTrue(cache.get('c')[0])
+        self.assertEqual(1, cache.evictions)
+
+    def test_lru_eviction_max_bytes(self):
+
+        cache = ResultCache(max_bytes=2 * (ENTRY_OVERHEAD + 10))
+        cache.set('a', ('123456789', None), 300)
+        cache.set('b', ('123456789', None), 300)
+        cache.set('c', ('123456789', None), 300)
+
+        self.assertEqual(2, len(cache))
+        self.assertFalse(cache.get('a')[0])
+        self.assertEqual(1, cache.evictions)
+        self.assertTrue(cache.bytes <= cache.max_bytes)
+
+    def test_oversized_entry_not_cached(self):
+
+        cache = ResultCache(max_bytes=ENTRY_OVERHEAD)
+        cache.set('a', ('123456789', None), 300)
+
+        self.assertEqual(0, len(cache))
+
+    def test_replace_entry(self):
+
+        cache = ResultCache()
+        cache.set('a', ('1', None), 300)
+        cache.set('a', ('22', None), 300)
+
+        self.assertEqual((True, ('22', None)), cache.get('a'))
+        self.assertEqual(ENTRY_OVERHEAD + 3, cache.bytes)
+
+    def test_record_size(self):
+
+        cache = ResultCache()
+        cache.set('a', WalletNameRecord(ENDPOINT_URL, 'https://a.io', 'https://a.io'), 300)
+
+        self.assertEqual(ENTRY_OVERHEAD + 25, cache.bytes)
+
+    def test_entries(self):
+
+        cache = ResultCache()
+        cache.set('a', ('1', None), 300)
+        cache.set('b', ('2', None), 100)
+
+        self.mockTime.time.return_value = 1100.0
+        self.assertEqual([('a', ('1', None), 1300.0)], cache.entries())
+
+    def test_invalidate_and_clear(self):
+
+        cache = ResultCache()
+        cache.set('a', ('1', None), 300)
+        cache.set('b', ('2', None), 300)
+
+        cache.invalidate('a')
+        self.assertFalse(cache.get('a')[0])
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.bytes)
+
+    def test_stats(self):
+
+        cache = ResultCache()
+        cache.set('a', ('1', None), 300)
+        cache.get('a')
+        cache.get('b')
+
+        stats = cache.stats()
+        self.assertEqual(1, stats['entries'])
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(0, stats['evictions'])
@@ -0,0 +1,226 @@
+__author__ = 'mdavid'
+
+import threading
+from mock import *
+from unittest import TestCase
+from wnsresolver.cache import ResultCache
+from wnsresolver.endpoint import EndpointClient, EndpointResponseTooLargeError, EndpointTimeoutError
+from wnsresolver.instrumentation import timer
+
+class TestEndpointClient(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('requests.Session')
+        self.patcher2 = patch('requests.adapters.HTTPAdapter')
+
+        self.mockSession = self.patcher1.start()
+        self.mockHTTPAdapter = self.patcher2.start()
+
+        self.mockResponse = self.mockSession.return_value.get.return_value
+        self.mockResponse.headers = {}
+        self.mockResponse.encoding = None
+        self.mockResponse.status_code = 200
+        self.mockResponse.iter_content.return_value = [b'bitcoin:1FHz8bpEE5q', b'UZ9XhfjzAbCCwo5bT1HMNAc']
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+        self.patcher2.stop()
+
+    def test_session_built_once(self):
+
+        client = EndpointClient(pool_connections=5, pool_maxsize=20)
+        client.get('https://addressimo.netki.com/resolve/1')
+        client.get('https://addressimo.netki.com/resolve/2')
+
+        self.assertEqual(1, self.mockSession.call_count)
+        self.assertEqual(1, self.mockHTTPAdapter.call_count)
+        self.assertEqual(5, self.mockHTTPAdapter.call_args[1]['pool_connections'])
+        self.assertEqual(20, self.mockHTTPAdapter.call_args[1]['pool_maxsize'])
+        self.assertEqual(2, self.mockSession.return_value.mount.call_count)
+
+    def test_go_right(self):
+
+        client = EndpointClient(connect_timeout=1, read_timeout=2)
+        ret_val = client.get('https://addressimo.netki.com/resolve/1', headers={'X-Forwarded-For': '8.8.8.8'})
+
+        self.assertEqual('bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc', ret_val)
+
+        call_args = self.mockSession.return_value.get.call_args
+        self.assertEqual('https://addressimo.netki.com/resolve/1', call_args[0][0])
+        self.assertEqual({'X-Forwarded-For': '8.8.8.8'}, call_args[1]['headers'])
+        self.assertEqual((1, 2), call_args[1]['timeout'])
+        self.assertTrue(call_args[1]['stream'])
+        self.assertEqual(1, self.mockResponse.close.call_count)
+
+    @patch('wnsresolver.endpoint.timer')
+    def test_deadline_bounds_timeouts(self, mockTimer):
+
+        mockTimer.return_value = 100.0
+
+        client = EndpointClient(connect_timeout=1, read_timeout=2)
+        client.get('https://addressimo.netki.com/resolve/1', deadline=101.5)
+
+        self.assertEqual((1, 1.5), self.mockSession.return_value.get.call_args[1]['timeout'])
+
+    @patch('wnsresolver.endpoint.timer')
+    def test_deadline_passed(self, mockTimer):
+
+        mockTimer.return_value = 100.0
+
+        client = EndpointClient()
+        self.assertRaises(EndpointTimeoutError, client.get, 'https://addressimo.netki.com/resolve/1', deadline=100.0)
+        self.assertEqual(0, self.mockSession.return_value.get.call_count)
+
+    @patch('wnsresolver.endpoint.timer')
+    def test_deadline_during_body(self, mockTimer):
+
+        # A response trickling in slower than the deadline allows
+        mockTimer.side_effect = [100.0, 100.0, 100.5, 101.5, 101.5]
+
+        client = EndpointClient()
+        self.assertRaises(EndpointTimeoutError, client.get, 'https://addressimo.netki.com/resolve/1', deadline=101.0)
+        self.assertEqual(1, self.mockResponse.close.call_count)
+
+    def test_content_length_too_large(self):
+
+        self.mockResponse.headers = {'Content-Length': '1025'}
+
+        client = EndpointClient(max_response_size=1024)
+        self.assertRaises(EndpointResponseTooLargeError, client.get, 'https://addressimo.netki.com/resolve/1')
+        self.assertEqual(0, self.mockResponse.iter_content.call_count)
+        self.assertEqual(1, self.mockResponse.close.call_count)
+
+    def test_body_too_large(self):
+
+        self.mockResponse.iter_content.return_value = [b'x' * 20, b'x' * 20]
+
+        client = EndpointClient(max_response_size=32)
+        self.assertRaises(EndpointResponseTooLargeError, client.get, 'https://addressimo.netki.com/resolve/1')
+        self.assertEqual(1, self.mockResponse.close.call_count)
+
+    def test_response_encoding(self):
+
+        self.mockResponse.encoding = 'ISO-8859-1'
+        self.mockResponse.iter_content.return_value = [b'bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc?label=caf\xe9']
+
+        client = EndpointClient()
+        self.assertEqual(u'bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc?label=caf\xe9', client.get('https://addressimo.netki.com/resolve/1'))
+
+    def test_supplied_session(self):
+
+        session = Mock()
+        session.get.return_value = self.mockResponse
+
+        client = EndpointClient(session=session)
+        client.get('https://addressimo.netki.com/resolve/1')
+
+        self.assertEqual(0, self.mockSession.call_count)
+        self.assertEqual(1, session.get.call_count)
+
+    def test_close(self):
+
+        client = EndpointClient()
+        client.get('https://addressimo.netki.com/resolve/1')
+        client.close()
+
+        self.assertEqual(1, self.mockSession.return_value.close.call_count)
+        self.assertIsNone(client._session)
+
+    def test_cache_disabled_by_default(self):
+
+        client = EndpointClient()
+        client.get('https://addressimo.netki.com/resolve/1')
+        client.get('https://addressimo.netki.com/resolve/1')
+
+        self.assertEqual(2, self.mockSession.return_value.get.call_count)
+
+    def test_cache_hit(self):
+
+        client = EndpointClient(cache=ResultCache())
+        client.get('https://addressimo.netki.com/resolve/1')
+        ret_val = client.get('https://addressimo.netki.com/resolve/1')
+
+        self.assertEqual('bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc', ret_val)
+        self.assertEqual(1, self.mockSession.return_value.get.call_count)
+
+    def test_error_response_not_cached(self):
+
+        self.mockResponse.iter_content.return_value = [b'Not Found']
+
+        for status_code in (404, 503):
+            self.mockResponse.status_code = status_code
+
+            client = EndpointClient(cache=ResultCache())
+            self.assertEqual('Not Found', client.get('https://addressimo.netki.com/resolve/1'))
+            self.assertEqual((False, None), client.cache.get('https://addressimo.netki.com/resolve/1'))
+
+    def test_cache_control_no_store(self):
+
+        self.mockResponse.headers = {'Cache-Control': 'no-store'}
+
+        client = EndpointClient(cache=ResultCache())
+        client.get('https://addressimo.netki.com/resolve/1')
+        client.get('https://addressimo.netki.com/resolve/1')
+
+        self.assertEqual(2, self.mockSession.return_value.get.call_count)
+
+    def test_cache_control_max_age(self):
+
+        cache = Mock()
+        cache.get.return_value = (False, None)
+
+        client = EndpointClient(cache=cache, cache_ttl=5)
+
+        client.cache_response('https://addressimo.netki.com/resolve/1', 'text', 'public, max-age=2')
+        self.assertEqual(2, cache.set.call_args[0][2])
+
+        client.cache_response('https://addressimo.netki.com/resolve/1', 'text', 'max-age=60')
+        self.assertEqual(5, cache.set.call_args[0][2])
+
+        client.cache_response('https://addressimo.netki.com/resolve/1', 'text', 'max-age=0')
+        client.cache_response('https://addressimo.netki.com/resolve/1', 'text', 'private')
+        self.assertEqual(2, cache.set.call_count)
+
+    def test_fetch_single_flight(self):
+
+        client = EndpointClient()
+        with patch.object(client, '_flight') as mockFlight:
+            mockFlight.do_within.return_value = 'shared'
+            self.assertEqual('shared', client.get('https://addressimo.netki.com/resolve/1', headers={'X-Forwarded-For': '8.8.8.8'}))
+
+        self.assertEqual((None, 'https://addressimo.netki.com/resolve/1', client._fetch, 'https://addressimo.netki.com/resolve/1', {'X-Forwarded-For': '8.8.8.8'}, None), mockFlight.do_within.call_args[0])
+
+    def test_follower_deadline(self):
+
+        client = EndpointClient()
+        started = threading.Event()
+        release = threading.Event()
+
+        def get(url, headers=None, timeout=None, stream=False):
+            started.set()
+            release.wait(5)
+            return self.mockResponse
+        self.mockSession.return_value.get.side_effect = get
+
+        leader = threading.Thread(target=client.get, args=('https://addressimo.netki.com/resolve/1',))
+        leader.start()
+        started.wait(5)
+
+        # Joins the leader's fetch, which has no deadline, and gives up at its own
+        try:
+            self.assertRaises(EndpointTimeoutError, client.get, 'https://addressimo.netki.com/resolve/1', deadline=timer() + 0.01)
+        finally:
+            release.set()
+            leader.join()
+        self.assertEqual(1, self.mockSession.return_value.get.call_count)
+
+    def test_follower_fetches_after_leader_timeout(self):
+
+        client = EndpointClient()
+        with patch.object(client, '_flight') as mockFlight:
+            mockFlight.do_within.side_effect = [EndpointTimeoutError(), 'text']
+            self.assertEqual('text', client.get('https://addressimo.netki.com/resolve/1', deadline=timer() + 60))
+
+        self.assertEqual(2, mockFlight.do_within.call_count)
@@ -0,0 +1,32 @@
+__author__ = 'mdavid'
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestLazyImports(TestCase):
+
+    def loaded_modules(self, statement):
+
+        # Fresh interpreter, the test runner has already imported everything
+        probe = '%s; import sys; print(",".join(sorted(set(x.split(".")[0] for x in sys.modules))))' % statement
+        output = subprocess.check_output([sys.executable, '-c', probe], cwd=ROOT)
+        return set(output.decode('ascii').strip().split(','))
+
+    def test_import(self):
+
+        loaded = self.loaded_modules('import wnsresolver')
+
+        self.assertIn('wnsresolver', loaded)
+        for module in ('requests', 'flask', 'dns', 'unbound'):
+            self.assertNotIn(module, loaded)
+
+    def test_resolver_construction(self):
+
+        loaded = self.loaded_modules("import wnsresolver; wnsresolver.WalletNameResolver().preprocess_name('wallet@domain.com')")
+
+        for module in ('requests', 'flask', 'dns', 'unbound'):
+            self.assertNotIn(module, loaded)
@@ -0,0 +1,107 @@
+__author__ = 'mdavid'
+
+import logging
+import sys
+from mock import *
+from unittest import TestCase
+from wnsresolver.instrumentation import LoggingSink, MetricsSink, MultiSink, PrometheusSink, StatsSink
+
+class TestMultiSink(TestCase):
+
+    def test_go_right(self):
+
+        sink1 = Mock()
+        sink2 = Mock()
+
+        MultiSink(sink1, sink2).observe('query', 0.5, {'outcome': 'secure'})
+
+        sink1.observe.assert_called_once_with('query', 0.5, {'outcome': 'secure'})
+        sink2.observe.assert_called_once_with('query', 0.5, {'outcome': 'secure'})
+
+    def test_base_sink(self):
+
+        self.assertIsNone(MetricsSink().observe('query', 0.5, {}))
+
+class TestStatsSink(TestCase):
+
+    def test_go_right(self):
+
+        sink = StatsSink()
+        sink.observe('query', 0.5, {'qtype': 'TXT', 'outcome': 'secure'})
+        sink.observe('query', 0.25, {'qtype': 'A', 'outcome': 'secure'})
+        sink.observe('classify', 0.125, {'kind': 'address'})
+
+        self.assertEqual({('query', 'secure'): (2, 0.75), ('classify', ''): (1, 0.125)}, sink.snapshot())
+
+    def test_snapshot_is_copy(self):
+
+        sink = StatsSink()
+        snapshot = sink.snapshot()
+        sink.observe('query', 0.5, {'outcome': 'secure'})
+
+        self.assertEqual({}, snapshot)
+
+class TestLoggingSink(TestCase):
+
+    def setUp(self):
+
+        self.mockLogger = Mock()
+        self.mockLogger.isEnabledFor.return_value = True
+
+    def test_go_right(self):
+
+        LoggingSink(logger=self.mockLogger).observe('query', 0.0125, {'qtype': 'TXT', 'outcome': 'secure'})
+
+        self.assertEqual(logging.DEBUG, self.mockLogger.log.call_args[0][0])
+        self.assertEqual('duration_ms=12.5 outcome=secure qtype=TXT stage=query', self.mockLogger.log.call_args[0][1])
+        self.assertEqual(
+            {'wnsresolver': {'stage': 'query', 'duration_ms': 12.5, 'qtype': 'TXT', 'outcome': 'secure'}},
+            self.mockLogger.log.call_args[1]['extra']
+        )
+
+    def test_level_disabled(self):
+
+        self.mockLogger.isEnabledFor.return_value = False
+
+        LoggingSink(logger=self.mockLogger, level=logging.INFO).observe('query', 0.0125, {'outcome': 'secure'})
+
+        self.mockLogger.isEnabledFor.assert_called_once_with(logging.INFO)
+        self.assertEqual(0, self.mockLogger.log.call_count)
+
+    def test_default_logger(self):
+
+        self.assertEqual('wnsresolver.metrics', LoggingSink().logger.name)
+
+class TestPrometheusSink(TestCase):
+
+    def setUp(self):
+
+        self.mockPrometheus = Mock()
+        self.patcher1 = patch.dict(sys.modules, {'prometheus_client': self.mockPrometheus})
+        self.patcher1.start()
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+
+    def test_go_right(self):
+
+        sink = PrometheusSink()
+        sink.observe('classify', 0.001, {'outcome': 'ok', 'kind': 'address'})
+
+        self.assertEqual('stage_duration_seconds', self.mockPrometheus.Histogram.call_args[0][0])
+        self.assertEqual(('stage', 'qtype', 'outcome', 'kind'), self.mockPrometheus.Histogram.call_args[0][2])
+        self.assertEqual('wnsresolver', self.mockPrometheus.Histogram.call_args[1]['namespace'])
+        self.assertNotIn('registry', self.mockPrometheus.Histogram.call_args[1])
+
+        histogram = self.mockPrometheus.Histogram.return_value
+        histogram.labels.assert_called_once_with('classify', '', 'ok', 'address')
+        histogram.labels.return_value.observe.assert_called_once_with(0.001)
+
+    def test_registry(self):
+
+        registry = Mock()
+        PrometheusSink(registry=registry, namespace='wns')
+
+        self.assertEqual(registry, self.mockPrometheus.Histogram.call_args[1]['registry'])
+        self.assertEqual('wns', self.mockPrometheus.Histogram.call_args[1]['namespace'])
@@ -0,0 +1,54 @@
+__author__ = 'mdavid'
+
+from unittest import TestCase
+from wnsresolver.iprange import IpRangeIndex, NO_ROUTE_RANGES
+
+class TestIpRangeIndex(TestCase):
+
+    def test_default_ranges(self):
+
+        index = IpRangeIndex()
+
+        for ip in ['127.0.0.1', '10.1.2.3', '172.16.0.1', '172.31.255.255', '192.168.100.1', '169.254.1.1', '224.0.0.1', '::1', 'fd00::1', 'fe80::1', 'ff02::1']:
+            self.assertTrue(ip in index, ip)
+
+        for ip in ['8.8.8.8', '172.32.0.0', '11.0.0.0', '2001:4860:4860::8888']:
+            self.assertFalse(ip in index, ip)
+
+    def test_zone_index(self):
+
+        self.assertTrue('fe80::1%eth0' in IpRangeIndex())
+
+    def test_ipv4_mapped_ipv6(self):
+
+        index = IpRangeIndex()
+
+        self.assertTrue('::ffff:10.0.0.1' in index)
+        self.assertFalse('::ffff:8.8.8.8' in index)
+
+    def test_invalid_ip(self):
+
+        self.assertFalse('not-an-ip' in IpRangeIndex())
+
+    def test_custom_ranges(self):
+
+        index = IpRangeIndex(NO_ROUTE_RANGES + ['100.64.0.0/10', '2001:db8::/32', '198.51.100.7'])
+
+        self.assertTrue('100.127.255.255' in index)
+        self.assertFalse('100.128.0.0' in index)
+        self.assertTrue('2001:db8::1' in index)
+        self.assertTrue('198.51.100.7' in index)
+        self.assertFalse('198.51.100.8' in index)
+
+    def test_invalid_range(self):
+
+        self.assertRaises(ValueError, IpRangeIndex, ['10.0.0.0/33'])
+
+    def test_overlapping_ranges_merged(self):
+
+        index = IpRangeIndex(['10.0.0.0/8', '10.1.0.0/16', '11.0.0.0/8', '13.0.0.0/8'])
+
+        self.assertEqual(2, len(index._ipv4_starts))
+        self.assertTrue('11.255.255.255' in index)
+        self.assertFalse('12.0.0.0' in index)
+        self.assertTrue('13.0.0.0' in index)
@@ -0,0 +1,100 @@
+__author__ = 'mdavid'
+
+import requests
+from mock import *
+from unittest import TestCase
+from wnsresolver.namecoin import NamecoinRPCResolver, NamecoinRPCError
+
+class TestNamecoinRPCResolver(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('requests.Session')
+        self.mockSession = self.patcher1.start()
+
+        self.mockPost = self.mockSession.return_value.post
+        self.mockPost.return_value.json.return_value = {'result': {'name': 'd/mattdavid', 'value': '{}'}, 'error': None, 'id': 1}
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+
+    def test_go_right(self):
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        ret_val = nc_resolver.name_show('mattdavid')
+
+        self.assertEqual({'name': 'd/mattdavid', 'value': '{}'}, ret_val)
+        self.assertEqual('http://10.0.0.1:1234/', self.mockPost.call_args[0][0])
+        self.assertIn('"d/mattdavid"', self.mockPost.call_args[1]['data'])
+        self.assertEqual(('rpcuser', 'rpcpassword'), self.mockSession.return_value.auth)
+
+    def test_defaults(self):
+
+        nc_resolver = NamecoinRPCResolver(None, None, None, None)
+        nc_resolver.name_show('mattdavid')
+
+        self.assertEqual('http://127.0.0.1:8336/', self.mockPost.call_args[0][0])
+        self.assertEqual(60, self.mockPost.call_args[1]['timeout'])
+
+    def test_session_reused(self):
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234, cache_ttl=0)
+        nc_resolver.name_show('mattdavid')
+        nc_resolver.name_show('justinnewton')
+
+        self.assertEqual(1, self.mockSession.call_count)
+        self.assertEqual(2, self.mockPost.call_count)
+
+    def test_name_show_cached(self):
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        nc_resolver.name_show('mattdavid')
+        ret_val = nc_resolver.name_show('mattdavid')
+
+        self.assertEqual({'name': 'd/mattdavid', 'value': '{}'}, ret_val)
+        self.assertEqual(1, self.mockPost.call_count)
+
+    def test_name_not_found(self):
+
+        self.mockPost.return_value.json.return_value = {'result': None, 'error': {'code': -4, 'message': 'failed to read from name DB'}, 'id': 1}
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        self.assertIsNone(nc_resolver.name_show('mattdavid'))
+        self.assertIsNone(nc_resolver.name_show('mattdavid'))
+        self.assertEqual(1, self.mockPost.call_count)
+
+    def test_rpc_error(self):
+
+        self.mockPost.return_value.json.return_value = {'result': None, 'error': {'code': -1, 'message': 'broken'}, 'id': 1}
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        try:
+            nc_resolver.name_show('mattdavid')
+            self.fail('NamecoinRPCError not raised')
+        except NamecoinRPCError as e:
+            self.assertEqual(-1, e.code)
+            self.assertEqual('broken', e.message)
+
+    def test_connection_error(self):
+
+        self.mockPost.side_effect = requests.ConnectionError()
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        self.assertRaises(NamecoinRPCError, nc_resolver.name_show, 'mattdavid')
+
+    def test_invalid_response(self):
+
+        self.mockPost.return_value.json.side_effect = ValueError()
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        self.assertRaises(NamecoinRPCError, nc_resolver.name_show, 'mattdavid')
+
+    def test_close(self):
+
+        nc_resolver = NamecoinRPCResolver('10.0.0.1', 'rpcuser', 'rpcpassword', 1234)
+        nc_resolver.name_show('mattdavid')
+        nc_resolver.close()
+
+        self.assertEqual(1, self.mockSession.return_value.close.call_count)
+        self.assertIsNone(nc_resolver._session)
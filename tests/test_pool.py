@@ -0,0 +1,128 @@
+__author__ = 'mdavid'
+
+import threading
+from mock import *
+from unittest import TestCase
+from wnsresolver.pool import UnboundContextPool
+
+class TestUnboundContextPool(TestCase):
+
+    def setUp(self):
+
+        self.mockFactory = Mock()
+        self.mockFactory.side_effect = lambda: Mock()
+
+    def test_invalid_size(self):
+
+        self.assertRaises(ValueError, UnboundContextPool, self.mockFactory, 0)
+
+    def test_context_reused(self):
+
+        pool = UnboundContextPool(self.mockFactory)
+
+        with pool.context() as ctx1:
+            pass
+        with pool.context() as ctx2:
+            pass
+
+        self.assertIs(ctx1, ctx2)
+        self.assertEqual(1, self.mockFactory.call_count)
+        self.assertEqual(1, len(pool))
+
+    def test_nested_contexts_up_to_size(self):
+
+        pool = UnboundContextPool(self.mockFactory, size=2)
+
+        with pool.context() as ctx1:
+            with pool.context() as ctx2:
+                self.assertIsNot(ctx1, ctx2)
+
+        self.assertEqual(2, self.mockFactory.call_count)
+        self.assertEqual(2, len(pool))
+
+    def test_unbounded(self):
+
+        pool = UnboundContextPool(self.mockFactory, size=None)
+
+        with pool.context() as ctx1:
+            with pool.context() as ctx2:
+                self.assertIsNot(ctx1, ctx2)
+        with pool.context() as ctx3:
+            pass
+
+        self.assertIn(ctx3, (ctx1, ctx2))
+        self.assertEqual(2, len(pool))
+
+    def test_acquire_not_blocking(self):
+
+        pool = UnboundContextPool(self.mockFactory)
+
+        with pool.context():
+            self.assertIsNone(pool.acquire(blocking=False))
+        self.assertIsNotNone(pool.acquire(blocking=False))
+
+    def test_acquire_timeout(self):
+
+        pool = UnboundContextPool(self.mockFactory)
+
+        generation, ctx = pool.acquire()
+        self.assertIsNone(pool.acquire(timeout=0.01))
+
+        # Freed by another thread while waiting
+        threading.Timer(0.01, pool.release, (generation, ctx)).start()
+        self.assertEqual((generation, ctx), pool.acquire(timeout=5))
+
+    def test_factory_exception_frees_slot(self):
+
+        self.mockFactory.side_effect = [Exception('Trust anchor is missing or inaccessible'), Mock()]
+        pool = UnboundContextPool(self.mockFactory)
+
+        self.assertRaises(Exception, pool.acquire)
+        self.assertEqual(0, len(pool))
+
+        generation, ctx = pool.acquire()
+        self.assertIsNotNone(ctx)
+        self.assertEqual(2, self.mockFactory.call_count)
+
+    def test_reload_idle(self):
+
+        pool = UnboundContextPool(self.mockFactory)
+
+        with pool.context() as ctx1:
+            pass
+        pool.reload()
+        with pool.context() as ctx2:
+            pass
+
+        self.assertIsNot(ctx1, ctx2)
+        self.assertEqual(2, self.mockFactory.call_count)
+        self.assertEqual(1, len(pool))
+
+    def test_reload_while_busy(self):
+
+        pool = UnboundContextPool(self.mockFactory)
+
+        with pool.context() as ctx1:
+            pool.reload()
+        self.assertEqual(0, len(pool))
+
+        with pool.context() as ctx2:
+            pass
+
+        self.assertIsNot(ctx1, ctx2)
+        self.assertEqual(1, len(pool))
+
+    def test_shared(self):
+
+        pool = UnboundContextPool(self.mockFactory)
+
+        # Not checked out, the pool's own context is still available alongside it
+        with pool.context() as ctx1:
+            ctx2 = pool.shared()
+            self.assertIs(ctx2, pool.shared())
+        self.assertIsNot(ctx1, ctx2)
+        self.assertIsNotNone(pool.acquire(blocking=False))
+
+        pool.reload()
+        self.assertIsNot(ctx2, pool.shared())
+        self.assertEqual(3, self.mockFactory.call_count)
@@ -0,0 +1,119 @@
+__author__ = 'mdavid'
+
+import multiprocessing.dummy
+from mock import *
+from unittest import TestCase
+from wnsresolver import *
+from wnsresolver.process import ProcessPoolResolver
+
+class TestProcessPoolResolver(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.process.request_client_address')
+        self.mockRequestClientAddress = self.patcher1.start()
+        self.mockRequestClientAddress.return_value = None
+
+        self.mockResolverClass = MagicMock()
+        self.mockResolver = self.mockResolverClass.return_value
+        self.mockResolver.resolve_wallet_name.return_value = '1btcaddress'
+        self.mockResolver.resolve_available_currencies.return_value = ['btc', 'ltc']
+
+        # Created before the workers start, which would otherwise each create their own on first use
+        self.mockShared = self.mockResolver.ctx_pool.shared
+
+        self.mockCache = Mock()
+
+        # Threads stand in for worker processes
+        self.pool = ProcessPoolResolver(2, cache=self.mockCache, context=multiprocessing.dummy, resolver_class=self.mockResolverClass, resolv_conf='resolv.conf')
+
+    def tearDown(self):
+
+        self.pool.close()
+        self.patcher1.stop()
+
+    def test_workers_share_cache(self):
+
+        self.pool.resolve_wallet_name('wallet.mattdavid.xyz', 'btc')
+        self.pool.close()
+
+        self.assertEqual(2, self.mockResolverClass.call_count)
+        for call_args in self.mockResolverClass.call_args_list:
+            self.assertEqual({'cache': self.mockCache, 'resolv_conf': 'resolv.conf'}, call_args[1])
+
+        # Each worker's unbound context is built up front
+        self.assertEqual(2, self.mockShared.call_count)
+
+    def test_resolve_wallet_name(self):
+
+        ret_val = self.pool.resolve_wallet_name('wallet.mattdavid.xyz', 'btc', forwarded_for='8.8.8.8')
+
+        self.assertEqual('1btcaddress', ret_val)
+        self.mockResolver.resolve_wallet_name.assert_called_once_with('wallet.mattdavid.xyz', 'btc', forwarded_for='8.8.8.8', timeout=None)
+        self.assertEqual(0, self.mockRequestClientAddress.call_count)
+
+    def test_resolve_wallet_name_request_address(self):
+
+        self.mockRequestClientAddress.return_value = '1.2.3.4'
+
+        self.pool.resolve_wallet_name('wallet.mattdavid.xyz', 'btc')
+
+        self.mockResolver.resolve_wallet_name.assert_called_once_with('wallet.mattdavid.xyz', 'btc', forwarded_for='1.2.3.4', timeout=None)
+
+    def test_resolve_wallet_name_result(self):
+
+        self.mockResolver.resolve_wallet_name_result.return_value = WalletNameResult('1btcaddress', 'address', 300, True)
+
+        ret_val = self.pool.resolve_wallet_name_result('wallet.mattdavid.xyz', 'btc', forwarded_for='8.8.8.8')
+
+        self.assertEqual('1btcaddress', ret_val.value)
+        self.assertEqual(300, ret_val.ttl)
+        self.mockResolver.resolve_wallet_name_result.assert_called_once_with('wallet.mattdavid.xyz', 'btc', forwarded_for='8.8.8.8', timeout=None)
+
+    def test_resolve_wallet_name_error(self):
+
+        self.mockResolver.resolve_wallet_name.side_effect = WalletNameUnavailableError()
+
+        self.assertRaises(WalletNameUnavailableError, self.pool.resolve_wallet_name, 'wallet.mattdavid.xyz', 'btc')
+
+    def test_resolve_available_currencies(self):
+
+        self.assertEqual(['btc', 'ltc'], self.pool.resolve_available_currencies('wallet.mattdavid.xyz'))
+
+    def test_resolve_all_currencies(self):
+
+        self.mockResolver.resolve_all_currencies.return_value = {'btc': '1btcaddress', 'ltc': '1ltcaddress'}
+
+        ret_val = self.pool.resolve_all_currencies('wallet.mattdavid.xyz', forwarded_for='8.8.8.8')
+
+        self.assertEqual({'btc': '1btcaddress', 'ltc': '1ltcaddress'}, ret_val)
+        self.mockResolver.resolve_all_currencies.assert_called_once_with('wallet.mattdavid.xyz', forwarded_for='8.8.8.8', timeout=None)
+
+    def test_resolve_many(self):
+
+        error = WalletNameCurrencyUnavailableError()
+
+        def resolve(name, currency, forwarded_for=None):
+            if currency == 'dgc':
+                raise error
+            return '1%saddress' % currency
+        self.mockResolver.resolve_wallet_name.side_effect = resolve
+
+        ret_val = list(self.pool.resolve_many([
+            ('wallet.mattdavid.xyz', 'btc'),
+            ('wallet.mattdavid.xyz', 'dgc'),
+            ('wallet.mattdavid.xyz', 'ltc')
+        ], ordered=True))
+
+        self.assertEqual([
+            ('wallet.mattdavid.xyz', 'btc', '1btcaddress'),
+            ('wallet.mattdavid.xyz', 'dgc', error),
+            ('wallet.mattdavid.xyz', 'ltc', '1ltcaddress')
+        ], ret_val)
+
+    def test_close_keeps_supplied_cache(self):
+
+        pool = ProcessPoolResolver(1, cache=self.mockCache, context=multiprocessing.dummy, resolver_class=self.mockResolverClass)
+        pool.close()
+
+        self.assertEqual(0, self.mockCache.close.call_count)
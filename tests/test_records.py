@@ -0,0 +1,135 @@
+__author__ = 'mdavid'
+
+import pickle
+from unittest import TestCase
+from wnsresolver.records import *
+
+class TestClassifyRecord(TestCase):
+
+    def test_address(self):
+
+        record = classify_record('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3')
+
+        self.assertEqual(ADDRESS, record.kind)
+        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', record.value)
+        self.assertIsNone(record.endpoint_url)
+
+    def test_address_valid_base64(self):
+
+        # Decodes, but not to a bitcoin URI or URL
+        record = classify_record('dGhpc2lzZ3JlYXQx')
+
+        self.assertEqual(WalletNameRecord(ADDRESS, 'dGhpc2lzZ3JlYXQx'), record)
+
+    def test_bitcoin_uri(self):
+
+        record = classify_record('bitcoin:1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3')
+
+        self.assertEqual(WalletNameRecord(BITCOIN_URI, 'bitcoin:1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3'), record)
+
+    def test_base64_bitcoin_uri(self):
+
+        record = classify_record('Yml0Y29pbjoxTVNLMVBNbkRaTjRTTERRNmdCNGM2R0tSRXhmR0Q2R2Iz')
+
+        self.assertEqual(WalletNameRecord(BITCOIN_URI, 'bitcoin:1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3'), record)
+
+    def test_base64_endpoint_url(self):
+
+        record = classify_record('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')
+
+        self.assertEqual(WalletNameRecord(ENDPOINT_URL, 'https://bip32address.com/getmine', 'https://bip32address.com/getmine'), record)
+
+    def test_prefix_bad_padding(self):
+
+        self.assertEqual(ADDRESS, classify_record('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU').kind)
+
+    def test_prefix_bad_charset(self):
+
+        self.assertEqual(ADDRESS, classify_record('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1p$U=').kind)
+
+    def test_prefix_not_utf8(self):
+
+        # 'http' followed by invalid UTF-8
+        self.assertEqual(WalletNameRecord(ADDRESS, 'aHR0cP//'), classify_record('aHR0cP//'))
+
+    def test_prefix_not_url(self):
+
+        # 'httpx' decodes but is not a URL
+        self.assertEqual(ADDRESS, classify_record('aHR0cHg=').kind)
+
+class TestTxtValue(TestCase):
+
+    def test_single_string(self):
+
+        self.assertEqual('1btcaddress', txt_value(b'\x0b1btcaddress'))
+
+    def test_multiple_strings(self):
+
+        self.assertEqual('1btcaddress', txt_value(b'\x041btc\x00\x07address'))
+
+    def test_long_value(self):
+
+        value = 'a' * 255 + 'b' * 45
+        rdata = b'\xff' + value[:255].encode('ascii') + b'\x2d' + value[255:].encode('ascii')
+
+        self.assertEqual(value, txt_value(rdata))
+
+    def test_empty(self):
+
+        self.assertEqual('', txt_value(b''))
+        self.assertEqual('', txt_value(b'\x00'))
+
+    def test_truncated(self):
+
+        # Character-string longer than the buffer
+        self.assertEqual('1btc', txt_value(b'\x0b1btc'))
+        self.assertEqual('1btcaddr', txt_value(b'\x041btc\x07addr'))
+
+    def test_bytearray(self):
+
+        self.assertEqual('1btc', txt_value(bytearray(b'\x041btc')))
+
+class TestWalletNameRecord(TestCase):
+
+    def test_unpacks_as_tuple(self):
+
+        record = WalletNameRecord(ENDPOINT_URL, 'https://bip32address.com/getmine', 'https://bip32address.com/getmine')
+        value, endpoint_url = record
+
+        self.assertEqual('https://bip32address.com/getmine', value)
+        self.assertEqual('https://bip32address.com/getmine', endpoint_url)
+        self.assertEqual('https://bip32address.com/getmine', record[1])
+        self.assertEqual(2, len(record))
+        self.assertEqual(('https://bip32address.com/getmine', 'https://bip32address.com/getmine'), record)
+
+    def test_equality(self):
+
+        self.assertEqual(WalletNameRecord(ADDRESS, 'btc'), WalletNameRecord(ADDRESS, 'btc'))
+        self.assertNotEqual(WalletNameRecord(ADDRESS, 'btc'), WalletNameRecord(BITCOIN_URI, 'btc'))
+        self.assertEqual(hash(('btc', None)), hash(WalletNameRecord(ADDRESS, 'btc')))
+
+    def test_slots(self):
+
+        self.assertRaises(AttributeError, setattr, WalletNameRecord(ADDRESS, 'btc'), 'ttl', 300)
+
+    def test_pickle(self):
+
+        record = WalletNameRecord(BITCOIN_URI, 'bitcoin:1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', expires=1300.0)
+        copy = pickle.loads(pickle.dumps(record, 2))
+
+        self.assertEqual(record, copy)
+        self.assertEqual(BITCOIN_URI, copy.kind)
+        self.assertEqual(1300.0, copy.expires)
+
+class TestWalletNameResult(TestCase):
+
+    def test_pickle(self):
+
+        result = WalletNameResult('1btcaddress', ADDRESS, 300, True, NAMECOIN, 0.25)
+        copy = pickle.loads(pickle.dumps(result, 2))
+
+        self.assertEqual(('1btcaddress', ADDRESS, 300, True, NAMECOIN, 0.25), (copy.value, copy.kind, copy.ttl, copy.secure, copy.source, copy.elapsed))
+
+    def test_slots(self):
+
+        self.assertRaises(AttributeError, setattr, WalletNameResult('1btcaddress'), 'endpoint_url', None)
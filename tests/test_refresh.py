@@ -0,0 +1,151 @@
+__author__ = 'mdavid'
+
+from mock import *
+from unittest import TestCase
+from wnsresolver.refresh import CacheRefresher
+
+class TestCacheRefresher(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.refresh.time')
+        self.mockTime = self.patcher1.start()
+        self.mockTime.time.return_value = 1000.0
+
+        self.refreshed = []
+        self.refresher = CacheRefresher(refresh_fraction=0.75, min_hits=2, workers=2)
+        self.refresher.stored(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 100)
+
+    def tearDown(self):
+
+        self.refresher.close()
+        self.patcher1.stop()
+
+    def refresh(self, key):
+
+        self.refreshed.append(key)
+        self.refresher.stored(key, ('btc ltc', None), 100)
+
+    def test_hot_and_due(self):
+
+        self.mockTime.time.return_value = 1080.0
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+
+        # Workers drain the queue before they stop
+        self.refresher.close()
+
+        self.assertEqual([('_wallet.mattdavid.xyz', 'TXT')], self.refreshed)
+        stats = self.refresher.stats()
+        self.assertEqual(1, stats['refreshes'])
+        self.assertEqual(5.0, stats['lag_seconds_max'])
+        self.assertEqual(5.0, stats['lag_seconds_total'])
+
+    def test_not_hot(self):
+
+        self.mockTime.time.return_value = 1080.0
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.close()
+
+        self.assertEqual([], self.refreshed)
+
+    def test_not_due(self):
+
+        self.mockTime.time.return_value = 1050.0
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.close()
+
+        self.assertEqual([], self.refreshed)
+
+    def test_untracked(self):
+
+        self.mockTime.time.return_value = 1080.0
+        self.refresher.touch(('_wallet.justinnewton.me', 'TXT'), self.refresh)
+        self.refresher.touch(('_wallet.justinnewton.me', 'TXT'), self.refresh)
+        self.refresher.close()
+
+        self.assertEqual([], self.refreshed)
+
+    def test_hits_reset_on_store(self):
+
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.stored(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 100)
+
+        self.mockTime.time.return_value = 1080.0
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        self.refresher.close()
+
+        self.assertEqual([], self.refreshed)
+
+    def test_refresh_error(self):
+
+        refresh = Mock(side_effect=Exception())
+
+        self.mockTime.time.return_value = 1080.0
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), refresh)
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), refresh)
+        self.refresher.close()
+
+        self.assertEqual(1, refresh.call_count)
+        self.assertEqual(1, self.refresher.stats()['refresh_errors'])
+
+        # Retried after retry_interval, the last good value is kept
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), refresh)
+        self.assertEqual(0, self.refresher.stats()['queued'])
+        self.assertEqual(('btc', None), self.refresher.stale(('_wallet.mattdavid.xyz', 'TXT')))
+
+    def test_refresh_without_record(self):
+
+        refresh = Mock()
+
+        self.mockTime.time.return_value = 1080.0
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), refresh)
+        self.refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), refresh)
+        self.refresher.close()
+
+        # Nothing stored, the name is gone and no longer tracked
+        self.assertEqual(0, self.refresher.stats()['tracked'])
+        self.assertIsNone(self.refresher.stale(('_wallet.mattdavid.xyz', 'TXT')))
+
+    def test_queue_full(self):
+
+        refresher = CacheRefresher(min_hits=1, queue_size=1)
+        refresher._start = Mock()
+        refresher.stored(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 100)
+        refresher.stored(('_wallet.justinnewton.me', 'TXT'), ('btc', None), 100)
+
+        self.mockTime.time.return_value = 1080.0
+        refresher.touch(('_wallet.mattdavid.xyz', 'TXT'), self.refresh)
+        refresher.touch(('_wallet.justinnewton.me', 'TXT'), self.refresh)
+
+        self.assertEqual(1, refresher.stats()['queued'])
+        self.assertEqual(1, refresher.stats()['dropped'])
+
+    def test_stale(self):
+
+        self.mockTime.time.return_value = 1100.0 + 3600
+        self.assertEqual(('btc', None), self.refresher.stale(('_wallet.mattdavid.xyz', 'TXT')))
+
+        self.mockTime.time.return_value = 1100.0 + 3601
+        self.assertIsNone(self.refresher.stale(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertIsNone(self.refresher.stale(('_wallet.justinnewton.me', 'TXT')))
+
+        self.assertEqual(1, self.refresher.stats()['stale_served'])
+
+    def test_negative_not_tracked(self):
+
+        self.refresher.stored(('_wallet.justinnewton.me', 'TXT'), None, 100)
+        self.refresher.stored(('_wallet.netki.com', 'TXT'), ('btc', None), 0)
+
+        self.assertEqual(1, self.refresher.stats()['tracked'])
+
+    def test_max_entries(self):
+
+        refresher = CacheRefresher(max_entries=1)
+        refresher.stored(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 100)
+        refresher.stored(('_wallet.justinnewton.me', 'TXT'), ('btc', None), 100)
+
+        self.assertIsNone(refresher.stale(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual(('btc', None), refresher.stale(('_wallet.justinnewton.me', 'TXT')))
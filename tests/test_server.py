@@ -0,0 +1,265 @@
+__author__ = 'mdavid'
+
+import json
+import sys
+from mock import *
+from unittest import TestCase, skipIf
+from wnsresolver import *
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    try:
+        from aiohttp.test_utils import make_mocked_request
+        from wnsresolver.server import ResolutionService
+    except ImportError:
+        make_mocked_request = None
+
+RESOLVE_MATCH = {'name': 'wallet.domain.com', 'currency': 'btc'}
+
+@skipIf(sys.version_info < (3, 5) or make_mocked_request is None, 'ResolutionService requires Python 3.5+ and aiohttp')
+class ServerTestCase(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.mockResolver = Mock()
+        self.mockResolver.resolver.cache = None
+        self.mockResolver.resolver.refresher = None
+
+        self.mockStats = Mock()
+        self.mockStats.snapshot.return_value = {('query', 'secure'): (2, 0.5)}
+
+        self.service = ResolutionService(self.mockResolver, stats=self.mockStats, batch_limit=3)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def completed(self, value):
+        future = asyncio.Future(loop=self.loop)
+        future.set_result(value)
+        return future
+
+    def failed(self, exception):
+        future = asyncio.Future(loop=self.loop)
+        future.set_exception(exception)
+        return future
+
+    def make_request(self, method, path, match_info=None, headers=None, body=None):
+        transport = Mock()
+        transport.get_extra_info.return_value = ('127.0.0.1', 54321)
+        request = make_mocked_request(method, path, headers=headers, match_info=match_info or {}, transport=transport)
+        if body is not None:
+            request.json = Mock(side_effect=lambda: self.completed(body))
+        return request
+
+    def call(self, handler, *args, **kwargs):
+        response = self.run_async(handler(self.make_request(*args, **kwargs)))
+        return response.status, json.loads(response.text)
+
+class TestResolve(ServerTestCase):
+
+    def test_go_right(self):
+
+        self.mockResolver.resolve_wallet_name.return_value = self.completed('1btcaddress')
+
+        status, body = self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)
+
+        self.assertEqual(200, status)
+        self.assertEqual({'name': 'wallet.domain.com', 'currency': 'btc', 'result': '1btcaddress'}, body)
+        self.assertEqual(1, self.mockResolver.resolve_wallet_name.call_count)
+        self.assertEqual(('wallet.domain.com', 'btc'), self.mockResolver.resolve_wallet_name.call_args[0])
+        self.assertEqual('127.0.0.1', self.mockResolver.resolve_wallet_name.call_args[1]['forwarded_for'])
+
+    def test_forwarded_for_ignored_by_default(self):
+
+        self.mockResolver.resolve_wallet_name.return_value = self.completed('1btcaddress')
+
+        self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH, headers={'X-Forwarded-For': '8.8.8.8'})
+
+        self.assertEqual('127.0.0.1', self.mockResolver.resolve_wallet_name.call_args[1]['forwarded_for'])
+
+    def test_forwarded_for_trusted(self):
+
+        self.service.trust_forwarded = True
+        self.mockResolver.resolve_wallet_name.return_value = self.completed('1btcaddress')
+
+        self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH, headers={'X-Forwarded-For': '8.8.8.8, 10.0.0.1'})
+
+        self.assertEqual('8.8.8.8', self.mockResolver.resolve_wallet_name.call_args[1]['forwarded_for'])
+
+    def test_no_result(self):
+
+        self.mockResolver.resolve_wallet_name.return_value = self.completed(None)
+
+        status, body = self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)
+
+        self.assertEqual(404, status)
+        self.assertEqual('WalletNameUnavailableError', body['error'])
+
+    def test_error_status(self):
+
+        for exception, expected in [
+            (AttributeError('Improper domain name'), 400),
+            (WalletNameCurrencyUnavailableError(), 404),
+            (WalletNameLookupInsecureError(), 502),
+            (WalletNameLookupError(), 502),
+            (WalletNameTimeoutError(), 504),
+            (WalletNameNamecoinUnavailable(), 501),
+            (ValueError('unexpected'), 500)
+        ]:
+            self.mockResolver.resolve_wallet_name.return_value = self.failed(exception)
+
+            status, body = self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)
+
+            self.assertEqual(expected, status)
+            self.assertEqual(type(exception).__name__, body['error'])
+            self.assertEqual('wallet.domain.com', body['name'])
+
+        # Internal error details are not returned
+        self.assertEqual('', body['message'])
+
+    def test_timeout(self):
+
+        self.service.timeout = 2.5
+        self.mockResolver.resolve_wallet_name.return_value = self.completed('1btcaddress')
+
+        self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)
+
+        self.assertEqual(2.5, self.mockResolver.resolve_wallet_name.call_args[1]['timeout'])
+
+    def test_concurrent_requests_coalesced(self):
+
+        pending = asyncio.Future(loop=self.loop)
+        self.mockResolver.resolve_wallet_name.return_value = pending
+        self.loop.call_later(0.01, pending.set_result, '1btcaddress')
+
+        responses = self.run_async(asyncio.gather(*[
+            self.service.handle_resolve(self.make_request('GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)) for _ in range(3)
+        ]))
+
+        self.assertEqual([200, 200, 200], [x.status for x in responses])
+        self.assertEqual(1, self.mockResolver.resolve_wallet_name.call_count)
+        self.assertEqual(2, self.service.counters['coalesced'])
+        self.assertEqual({}, self.service.inflight)
+
+    def test_sequential_requests_not_coalesced(self):
+
+        self.mockResolver.resolve_wallet_name.side_effect = lambda *args, **kwargs: self.completed('1btcaddress')
+
+        self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)
+        self.call(self.service.handle_resolve, 'GET', '/resolve/wallet.domain.com/btc', match_info=RESOLVE_MATCH)
+
+        self.assertEqual(2, self.mockResolver.resolve_wallet_name.call_count)
+        self.assertEqual(0, self.service.counters['coalesced'])
+
+class TestCurrencies(ServerTestCase):
+
+    def test_go_right(self):
+
+        self.mockResolver.resolve_available_currencies.return_value = self.completed(['btc', 'ltc'])
+
+        status, body = self.call(self.service.handle_currencies, 'GET', '/currencies/wallet.domain.com', match_info={'name': 'wallet.domain.com'})
+
+        self.assertEqual(200, status)
+        self.assertEqual({'name': 'wallet.domain.com', 'currencies': ['btc', 'ltc']}, body)
+
+    def test_unavailable(self):
+
+        self.mockResolver.resolve_available_currencies.return_value = self.failed(WalletNameUnavailableError())
+
+        status, body = self.call(self.service.handle_currencies, 'GET', '/currencies/wallet.domain.com', match_info={'name': 'wallet.domain.com'})
+
+        self.assertEqual(404, status)
+        self.assertEqual('WalletNameUnavailableError', body['error'])
+
+class TestBatch(ServerTestCase):
+
+    def test_go_right(self):
+
+        results = {'wallet.domain.com': self.completed('1btcaddress'), 'missing.domain.com': self.failed(WalletNameUnavailableError())}
+        self.mockResolver.resolve_wallet_name.side_effect = lambda name, currency, forwarded_for=None, timeout=None: results[name]
+
+        status, body = self.call(self.service.handle_batch, 'POST', '/resolve', body=[{'name': 'wallet.domain.com', 'currency': 'btc'}, {'name': 'missing.domain.com', 'currency': 'btc'}])
+
+        self.assertEqual(200, status)
+        self.assertEqual({'name': 'wallet.domain.com', 'currency': 'btc', 'result': '1btcaddress'}, body['results'][0])
+        self.assertEqual(404, body['results'][1]['status'])
+        self.assertEqual('WalletNameUnavailableError', body['results'][1]['error'])
+
+    def test_invalid_body(self):
+
+        for payload in [{'name': 'wallet.domain.com'}, [{'name': 'wallet.domain.com'}], 'text']:
+            status, body = self.call(self.service.handle_batch, 'POST', '/resolve', body=payload)
+            self.assertEqual(400, status)
+
+        self.assertEqual(0, self.mockResolver.resolve_wallet_name.call_count)
+
+    def test_too_large(self):
+
+        status, body = self.call(self.service.handle_batch, 'POST', '/resolve', body=[{'name': 'wallet.domain.com', 'currency': 'btc'}] * 4)
+
+        self.assertEqual(413, status)
+        self.assertEqual(0, self.mockResolver.resolve_wallet_name.call_count)
+
+class TestHealthMetrics(ServerTestCase):
+
+    def test_health(self):
+
+        status, body = self.call(self.service.handle_health, 'GET', '/health')
+
+        self.assertEqual(200, status)
+        self.assertEqual('ok', body['status'])
+
+    def test_metrics(self):
+
+        self.mockResolver.resolver.cache = Mock()
+        self.mockResolver.resolver.cache.stats.return_value = {'hits': 5}
+        self.mockResolver.resolver.refresher = Mock()
+        self.mockResolver.resolver.refresher.stats.return_value = {'refreshes': 3, 'lag_seconds_max': 0.25}
+
+        response = self.run_async(self.service.handle_metrics(self.make_request('GET', '/metrics')))
+        text = response.text
+
+        self.assertEqual(200, response.status)
+        self.assertIn('wnsresolver_server_requests_total{worker=', text)
+        self.assertIn('wnsresolver_cache_hits{worker=', text)
+        self.assertIn('wnsresolver_refresh_refreshes{worker=', text)
+        self.assertIn('} 0.25', text)
+        self.assertIn('stage="query",outcome="secure"} 2', text)
+        self.assertIn('stage="query",outcome="secure"} 0.500000', text)
+
+class TestSnapshots(ServerTestCase):
+
+    def setUp(self):
+        super(TestSnapshots, self).setUp()
+        self.service = ResolutionService(self.mockResolver, stats=self.mockStats, snapshot='/var/lib/wnsresolver/cache.snapshot', snapshot_secret=b'secret')
+
+    def test_start_and_stop(self):
+
+        self.run_async(self.service.start_snapshots())
+        self.mockResolver.resolver.load_snapshot.assert_called_once_with('/var/lib/wnsresolver/cache.snapshot', b'secret')
+        self.assertIsNotNone(self.service._snapshot_task)
+
+        self.run_async(self.service.stop_snapshots())
+        self.mockResolver.resolver.save_snapshot.assert_called_once_with('/var/lib/wnsresolver/cache.snapshot', b'secret')
+        self.assertIsNone(self.service._snapshot_task)
+
+    def test_start_without_snapshot(self):
+
+        self.mockResolver.resolver.load_snapshot.side_effect = IOError()
+
+        self.run_async(self.service.start_snapshots())
+        self.assertIsNotNone(self.service._snapshot_task)
+        self.run_async(self.service.stop_snapshots())
+
+    def test_save_error(self):
+
+        self.mockResolver.resolver.save_snapshot.side_effect = OSError()
+
+        self.run_async(self.service.save_snapshot())
+        self.assertEqual(1, self.mockResolver.resolver.save_snapshot.call_count)
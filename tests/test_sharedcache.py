@@ -0,0 +1,163 @@
+__author__ = 'mdavid'
+
+import multiprocessing
+import os
+import pickle
+from mock import *
+from unittest import TestCase
+from wnsresolver.sharedcache import FILE_HEADER, VERSION, SharedResultCache
+
+def _set_in_child(cache):
+    cache.set(('_btc._wallet.mattdavid.xyz', 'TXT'), ('1childaddress', None), 300)
+
+class TestSharedResultCache(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.sharedcache.time')
+        self.mockTime = self.patcher1.start()
+        self.mockTime.time.return_value = 1000.0
+
+        self.cache = SharedResultCache(slots=64)
+
+    def tearDown(self):
+
+        self.cache.close()
+        self.patcher1.stop()
+
+    def test_go_right(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc ltc', None), 300)
+
+        self.assertEqual((True, ('btc ltc', None)), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual((False, None), self.cache.get(('_wallet.justinnewton.me', 'TXT')))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+        self.assertEqual(1, len(self.cache))
+
+    def test_ttl_expiry(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+
+        self.mockTime.time.return_value = 1299.0
+        self.assertTrue(self.cache.get(('_wallet.mattdavid.xyz', 'TXT'))[0])
+
+        self.mockTime.time.return_value = 1300.0
+        self.assertEqual((False, None), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual(1, self.cache.expirations)
+        self.assertEqual(0, len(self.cache))
+
+    def test_zero_ttl_not_cached(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 0)
+
+        self.assertEqual(0, len(self.cache))
+
+    def test_negative_entry(self):
+
+        cache = SharedResultCache(slots=64, negative_ttl=30)
+        cache.set(('_wallet.mattdavid.xyz', 'TXT'), None, 0)
+
+        self.assertEqual((True, None), cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+
+        self.mockTime.time.return_value = 1030.0
+        self.assertEqual((False, None), cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        cache.close()
+
+    def test_value_too_large(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('x' * 1024, None), 300)
+
+        self.assertEqual((False, None), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+
+    def test_overwrite(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc ltc', None), 300)
+
+        self.assertEqual((True, ('btc ltc', None)), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual(1, len(self.cache))
+
+    def test_writer_killed_mid_update(self):
+
+        # Every slot left mid-write by a writer that never finished
+        for index in range(self.cache.slots):
+            VERSION.pack_into(self.cache._map, FILE_HEADER.size + index * self.cache.slot_size, 7)
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+        self.assertEqual((True, ('btc', None)), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+
+    def test_eviction(self):
+
+        cache = SharedResultCache(slots=1)
+        cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+        cache.set(('_wallet.justinnewton.me', 'TXT'), ('ltc', None), 300)
+
+        self.assertEqual((False, None), cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual((True, ('ltc', None)), cache.get(('_wallet.justinnewton.me', 'TXT')))
+        self.assertEqual(1, cache.evictions)
+        cache.close()
+
+    def test_invalidate_and_clear(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+        self.cache.set(('_wallet.justinnewton.me', 'TXT'), ('ltc', None), 300)
+
+        self.cache.invalidate(('_wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual((False, None), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+        self.assertEqual(1, len(self.cache))
+
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+    def test_entries(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+        self.cache.set(('_wallet.justinnewton.me', 'TXT'), ('ltc', None), 100)
+
+        self.mockTime.time.return_value = 1100.0
+        self.assertEqual([(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 1300.0)], self.cache.entries())
+
+    def test_shared_between_mappings(self):
+
+        other = SharedResultCache(path=self.cache.path, slots=64)
+        other.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+
+        self.assertEqual((True, ('btc', None)), self.cache.get(('_wallet.mattdavid.xyz', 'TXT')))
+
+        # Not the creator, the file stays
+        other.close()
+        self.assertTrue(os.path.exists(self.cache.path))
+
+    def test_pickle_maps_same_file(self):
+
+        self.cache.set(('_wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+
+        copy = pickle.loads(pickle.dumps(self.cache))
+
+        self.assertEqual(self.cache.path, copy.path)
+        self.assertEqual((True, ('btc', None)), copy.get(('_wallet.mattdavid.xyz', 'TXT')))
+        copy.close()
+
+    def test_geometry_mismatch(self):
+
+        self.assertRaises(ValueError, SharedResultCache, path=self.cache.path, slots=128)
+
+    def test_close_removes_created_file(self):
+
+        cache = SharedResultCache(slots=64)
+        cache.close()
+
+        self.assertFalse(os.path.exists(cache.path))
+
+class TestSharedResultCacheProcesses(TestCase):
+
+    def test_visible_to_forked_process(self):
+
+        cache = SharedResultCache(slots=64)
+        child = multiprocessing.Process(target=_set_in_child, args=(cache,))
+        child.start()
+        child.join()
+
+        self.assertEqual((True, ('1childaddress', None)), cache.get(('_btc._wallet.mattdavid.xyz', 'TXT')))
+        cache.close()
@@ -0,0 +1,103 @@
+__author__ = 'mdavid'
+
+import threading
+from mock import *
+from unittest import TestCase
+from wnsresolver.singleflight import SingleFlight, SingleFlightTimeoutError
+
+class TestSingleFlight(TestCase):
+
+    def test_go_right(self):
+
+        flight = SingleFlight()
+        fn = Mock(return_value='result')
+
+        self.assertEqual('result', flight.do('key', fn, 'arg', kw='kwarg'))
+        fn.assert_called_once_with('arg', kw='kwarg')
+        self.assertEqual(0, len(flight))
+
+    def test_concurrent_calls_share_result(self):
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+        leader.start()
+        started.wait()
+
+        # Count followers as they start waiting on the leader's call
+        call = flight._calls['key']
+        waiting = threading.Semaphore(0)
+        event_wait = call.event.wait
+        def wait(*args):
+            waiting.release()
+            return event_wait(*args)
+        call.event.wait = wait
+
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', fn))) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        for _ in followers:
+            waiting.acquire()
+
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(['result'] * 4, results)
+
+    def test_exception_shared_and_cleared(self):
+
+        flight = SingleFlight()
+        fn = Mock(side_effect=[ValueError('failed'), 'result'])
+
+        self.assertRaises(ValueError, flight.do, 'key', fn)
+        self.assertEqual(0, len(flight))
+
+        # Failures are not remembered, the next call runs again
+        self.assertEqual('result', flight.do('key', fn))
+
+    def test_distinct_keys(self):
+
+        flight = SingleFlight()
+        fn = Mock(return_value='result')
+
+        flight.do('key1', fn)
+        flight.do('key2', fn)
+
+        self.assertEqual(2, fn.call_count)
+
+    def test_follower_timeout(self):
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def fn():
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+        leader.start()
+        started.wait(5)
+
+        try:
+            self.assertRaises(SingleFlightTimeoutError, flight.do_within, 0.01, 'key', fn)
+        finally:
+            release.set()
+            leader.join()
+
+        # The leader's call carried on
+        self.assertEqual(['result'], results)
@@ -0,0 +1,161 @@
+__author__ = 'mdavid'
+
+import os
+import shutil
+import struct
+import tempfile
+from mock import *
+from unittest import TestCase
+from wnsresolver import WalletNameResolver
+from wnsresolver.cache import ResultCache
+from wnsresolver.records import WalletNameRecord, ADDRESS, ENDPOINT_URL
+from wnsresolver.snapshot import FILE_HEADER, ENTRY_HEADER, MAC_SIZE, save, load
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.cache.time')
+        self.patcher2 = patch('wnsresolver.snapshot.time')
+        self.mockTime = self.patcher1.start()
+        self.patcher2.start().time = self.mockTime.time
+        self.mockTime.time.return_value = 1000.0
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.snapshot')
+
+        self.records = ResultCache()
+        self.records.set(('_wallet.mattdavid.xyz', 'TXT'), WalletNameRecord(ADDRESS, 'btc ltc', expires=1300.0), 300)
+        self.records.set(('_btc._wallet.mattdavid.xyz', 'TXT'), WalletNameRecord(ENDPOINT_URL, 'https://bip32address.com/getmine', 'https://bip32address.com/getmine'), 60)
+        self.records.set(('_dgc._wallet.mattdavid.xyz', 'TXT', 'all'), [WalletNameRecord(ADDRESS, 'D1'), WalletNameRecord(ADDRESS, u'D2')], 600)
+        self.records.set(('_wallet.justinnewton.me', 'TXT'), None, 30)
+
+        self.hosts = ResultCache()
+        self.hosts.set('bip32address.com', ['2001:db8::1', '93.184.216.34'], 120)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+        self.patcher1.stop()
+        self.patcher2.stop()
+
+    def test_round_trip(self):
+
+        self.assertEqual(5, save(self.path, {'records': self.records, 'hosts': self.hosts}, 'secret'))
+
+        self.mockTime.time.return_value = 1010.0
+        records = ResultCache()
+        hosts = ResultCache()
+        stats = load(self.path, {'records': records, 'hosts': hosts}, 'secret')
+
+        self.assertEqual({'loaded': 5, 'expired': 0, 'rejected': 0}, stats)
+        self.assertEqual(sorted(self.records.entries()), sorted(records.entries()))
+        self.assertEqual(self.hosts.entries(), hosts.entries())
+
+        hit, record = records.get(('_wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual((ADDRESS, 'btc ltc', None, 1300.0), (record.kind, record.value, record.endpoint_url, record.expires))
+        self.assertEqual((True, None), records.get(('_wallet.justinnewton.me', 'TXT')))
+
+    def test_expired(self):
+
+        save(self.path, {'records': self.records, 'hosts': self.hosts}, 'secret')
+
+        self.mockTime.time.return_value = 1200.0
+        records = ResultCache()
+        stats = load(self.path, {'records': records, 'hosts': ResultCache()}, 'secret')
+
+        self.assertEqual({'loaded': 2, 'expired': 3, 'rejected': 0}, stats)
+        expires = dict((key, expires) for key, value, expires in records.entries())
+        self.assertEqual({('_wallet.mattdavid.xyz', 'TXT'): 1300.0, ('_dgc._wallet.mattdavid.xyz', 'TXT', 'all'): 1600.0}, expires)
+
+    def test_tampered_entry(self):
+
+        save(self.path, {'hosts': self.hosts, 'records': self.records}, 'secret')
+
+        with open(self.path, 'rb') as fp:
+            data = bytearray(fp.read())
+
+        # Flip a byte in the first entry's body
+        data[FILE_HEADER.size + ENTRY_HEADER.size + 4] ^= 0x01
+        with open(self.path, 'wb') as fp:
+            fp.write(bytes(data))
+
+        stats = load(self.path, {'records': ResultCache(), 'hosts': ResultCache()}, 'secret')
+        self.assertEqual({'loaded': 4, 'expired': 0, 'rejected': 1}, stats)
+
+    def test_tampered_expiry(self):
+
+        save(self.path, {'hosts': self.hosts}, 'secret')
+
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+
+        length, expires = ENTRY_HEADER.unpack_from(data, FILE_HEADER.size)
+        data = data[:FILE_HEADER.size] + ENTRY_HEADER.pack(length, expires + 86400) + data[FILE_HEADER.size + ENTRY_HEADER.size:]
+        with open(self.path, 'wb') as fp:
+            fp.write(data)
+
+        hosts = ResultCache()
+        self.assertEqual({'loaded': 0, 'expired': 0, 'rejected': 1}, load(self.path, {'hosts': hosts}, 'secret'))
+        self.assertEqual(0, len(hosts))
+
+    def test_wrong_secret(self):
+
+        save(self.path, {'records': self.records, 'hosts': self.hosts}, 'secret')
+
+        stats = load(self.path, {'records': ResultCache(), 'hosts': ResultCache()}, 'other secret')
+        self.assertEqual({'loaded': 0, 'expired': 0, 'rejected': 5}, stats)
+
+    def test_truncated(self):
+
+        save(self.path, {'hosts': self.hosts, 'records': self.records}, 'secret')
+
+        with open(self.path, 'rb') as fp:
+            data = fp.read()
+        with open(self.path, 'wb') as fp:
+            fp.write(data[:-MAC_SIZE - 1])
+
+        stats = load(self.path, {'records': ResultCache(), 'hosts': ResultCache()}, 'secret')
+        self.assertEqual({'loaded': 4, 'expired': 0, 'rejected': 1}, stats)
+
+    def test_unknown_version(self):
+
+        with open(self.path, 'wb') as fp:
+            fp.write(struct.pack('<4sB3x', b'WNSS', 2))
+
+        self.assertRaises(ValueError, load, self.path, {'records': ResultCache()}, 'secret')
+
+    def test_not_a_snapshot(self):
+
+        with open(self.path, 'wb') as fp:
+            fp.write(b'WNSC')
+
+        self.assertRaises(ValueError, load, self.path, {'records': ResultCache()}, 'secret')
+
+    def test_secret_required(self):
+
+        self.assertRaises(ValueError, save, self.path, {'records': self.records}, '')
+
+    def test_section_not_loaded(self):
+
+        save(self.path, {'records': self.records, 'hosts': self.hosts}, 'secret')
+
+        stats = load(self.path, {'hosts': ResultCache()}, 'secret')
+        self.assertEqual({'loaded': 1, 'expired': 0, 'rejected': 0}, stats)
+
+    def test_replaces_atomically(self):
+
+        save(self.path, {'records': self.records}, 'secret')
+        save(self.path, {'hosts': self.hosts}, 'secret')
+
+        self.assertEqual(['cache.snapshot'], os.listdir(self.tmpdir))
+        self.assertEqual(1, load(self.path, {'records': ResultCache(), 'hosts': ResultCache()}, 'secret')['loaded'])
+
+    def test_resolver(self):
+
+        wns_resolver = WalletNameResolver(cache=self.records, host_cache=self.hosts)
+        wns_resolver.save_snapshot(self.path, 'secret')
+
+        restarted = WalletNameResolver(cache=ResultCache())
+        self.assertEqual({'loaded': 5, 'expired': 0, 'rejected': 0}, restarted.load_snapshot(self.path, 'secret'))
+        self.assertEqual((True, ['2001:db8::1', '93.184.216.34']), restarted.host_cache.get('bip32address.com'))
@@ -0,0 +1,307 @@
+__author__ = 'mdavid'
+
+import os
+import shutil
+import tempfile
+from mock import *
+from unittest import TestCase
+from wnsresolver import *
+from wnsresolver.upstream import QueryPolicy, read_nameservers
+
+def txt_rdata(*strings):
+    return b''.join(bytes(bytearray([len(x)])) + x.encode('ascii') for x in strings)
+
+class TestReadNameservers(TestCase):
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'resolv.conf')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def test_go_right(self):
+
+        with open(self.path, 'w') as fp:
+            fp.write('# upstreams\nsearch example.com\nnameserver 192.0.2.1\nnameserver  2001:db8::53\nnameserver 192.0.2.1\nnameserver\n')
+
+        self.assertEqual(['192.0.2.1', '2001:db8::53'], read_nameservers(self.path))
+
+class TestQueryPolicy(TestCase):
+
+    def test_ranked(self):
+
+        policy = QueryPolicy()
+        policy.observed('192.0.2.1', 0.3)
+        policy.observed('192.0.2.2', 0.1)
+
+        self.assertEqual(['192.0.2.3', '192.0.2.2', '192.0.2.1'], policy.ranked(['192.0.2.1', '192.0.2.2', '192.0.2.3']))
+
+    def test_srtt(self):
+
+        policy = QueryPolicy()
+        policy.observed('192.0.2.1', 0.1)
+        policy.observed('192.0.2.1', 0.9)
+
+        self.assertAlmostEqual(0.2, policy.stats()['upstreams']['192.0.2.1']['srtt_seconds'])
+
+    def test_failure_penalty(self):
+
+        policy = QueryPolicy(failure_penalty=1.0)
+        policy.observed('192.0.2.1', 0.01, failed=True)
+
+        stats = policy.stats()['upstreams']['192.0.2.1']
+        self.assertEqual(1.0, stats['srtt_seconds'])
+        self.assertEqual(1, stats['failures'])
+
+    def test_hedge_after(self):
+
+        policy = QueryPolicy(hedge_delay=0.2, min_samples=10, hedge_quantile=0.9)
+        for rtt in range(1, 10):
+            policy.observed('192.0.2.1', rtt / 100.0)
+
+        # Too few samples for a quantile
+        self.assertEqual(0.2, policy.hedge_after('192.0.2.1'))
+
+        policy.observed('192.0.2.1', 0.5)
+        self.assertEqual(0.5, policy.hedge_after('192.0.2.1'))
+
+        self.assertIsNone(QueryPolicy(hedge=False).hedge_after('192.0.2.1'))
+
+    @patch('wnsresolver.upstream.random')
+    def test_backoff_delay(self, mockRandom):
+
+        mockRandom.uniform.side_effect = lambda low, high: high
+
+        policy = QueryPolicy(backoff=0.1, max_backoff=0.3)
+        self.assertEqual([0.1, 0.2, 0.3], [policy.backoff_delay(x) for x in range(3)])
+
+class TestHedgedQuery(TestCase):
+
+    def setUp(self):
+
+        self.patcher1 = patch('wnsresolver.ub_ctx')
+        self.patcher2 = patch('wnsresolver.os')
+        self.patcher3 = patch('wnsresolver.read_nameservers')
+        self.patcher4 = patch('wnsresolver.timer')
+        self.patcher5 = patch('wnsresolver.select')
+        self.patcher6 = patch('wnsresolver.time.sleep')
+        self.patcher7 = patch('wnsresolver.upstream.random')
+
+        self.mockUnbound = self.patcher1.start()
+        self.patcher2.start()
+        self.mockReadNameservers = self.patcher3.start()
+        self.mockTimer = self.patcher4.start()
+        self.mockSelect = self.patcher5.start()
+        self.mockSleep = self.patcher6.start()
+        self.mockRandom = self.patcher7.start()
+
+        self.mockReadNameservers.return_value = ['192.0.2.1', '192.0.2.2']
+
+        # Simulated clock, unbound contexts and forwarders: {forwarder: (latency, status, result)}
+        self.now = 0.0
+        self.contexts = []
+        self.forwarders = {}
+        self.mockTimer.side_effect = lambda: self.now
+        self.mockSelect.select.side_effect = self.select
+        self.mockSleep.side_effect = self.sleep
+        self.mockRandom.uniform.side_effect = lambda low, high: high
+        self.mockUnbound.side_effect = self.build_context
+
+    def tearDown(self):
+
+        self.patcher1.stop()
+        self.patcher2.stop()
+        self.patcher3.stop()
+        self.patcher4.stop()
+        self.patcher5.stop()
+        self.patcher6.stop()
+        self.patcher7.stop()
+
+    def result(self, secure=True, rcode=0):
+
+        result = Mock()
+        result.secure = secure
+        result.bogus = False
+        result.havedata = True
+        result.rcode = rcode
+        result.ttl = 300
+        result.data.as_raw_data.return_value = [txt_rdata('1btcaddress' if secure else '1insecureaddress')]
+        return result
+
+    def build_context(self):
+
+        ctx = Mock()
+        ctx.fd.return_value = len(self.contexts)
+        ctx.queries = {}
+
+        def resolve_async(name, mydata, callback, rrtype, rrclass):
+            latency, status, result = self.forwarders[ctx.set_fwd.call_args[0][0]]
+            ctx.queries[len(ctx.queries) + 1] = (self.now + latency, callback, mydata, status, result)
+            return 0, len(ctx.queries)
+
+        def process():
+            for async_id, (due, callback, mydata, status, result) in list(ctx.queries.items()):
+                if due <= self.now:
+                    del ctx.queries[async_id]
+                    callback(mydata, status, result)
+
+        ctx.resolve_async.side_effect = resolve_async
+        ctx.process.side_effect = process
+        ctx.cancel.side_effect = lambda async_id: ctx.queries.pop(async_id)
+        self.contexts.append(ctx)
+        return ctx
+
+    def select(self, fds, writable, errors, timeout):
+
+        due = [(query[0], ctx.fd()) for ctx in self.contexts if ctx.fd() in fds for query in ctx.queries.values()]
+        first = min(due)[0] if due else None
+        if first is None or first > self.now + timeout:
+            self.now += timeout
+            return [], [], []
+
+        self.now = first
+        return [fd for at, fd in due if at <= self.now], [], []
+
+    def sleep(self, delay):
+
+        self.now += delay
+
+    def forwarded(self):
+
+        return [ctx.set_fwd.call_args[0][0] for ctx in self.contexts]
+
+    def test_fast_forwarder(self):
+
+        self.forwarders = {'192.0.2.1': (0.05, 0, self.result()), '192.0.2.2': (0.05, 0, self.result())}
+
+        policy = QueryPolicy()
+        wns_resolver = WalletNameResolver(query_policy=policy)
+
+        self.assertEqual('1btcaddress', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual(['192.0.2.1'], self.forwarded())
+        self.assertEqual(0, policy.stats()['hedges'])
+        self.assertEqual(0, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_hedged_to_next_forwarder(self):
+
+        self.forwarders = {'192.0.2.1': (3.0, 0, self.result()), '192.0.2.2': (0.05, 0, self.result())}
+
+        policy = QueryPolicy(hedge_delay=0.2)
+        wns_resolver = WalletNameResolver(query_policy=policy)
+
+        self.assertEqual('1btcaddress', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertAlmostEqual(0.25, self.now)
+        self.assertEqual(['192.0.2.1', '192.0.2.2'], self.forwarded())
+        self.assertEqual(1, self.contexts[0].cancel.call_count)
+        self.assertEqual(1, policy.stats()['hedges'])
+
+        # The slow forwarder is ranked last from now on
+        self.assertEqual(['192.0.2.2', '192.0.2.1'], policy.ranked(['192.0.2.1', '192.0.2.2']))
+
+    def test_servfail_fails_over(self):
+
+        self.forwarders = {'192.0.2.1': (0.01, 0, self.result(rcode=RCODE_SERVFAIL)), '192.0.2.2': (0.05, 0, self.result())}
+
+        policy = QueryPolicy(hedge_delay=0.2)
+        wns_resolver = WalletNameResolver(query_policy=policy)
+
+        self.assertEqual('1btcaddress', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertAlmostEqual(0.06, self.now)
+        self.assertEqual(0, policy.stats()['hedges'])
+        self.assertEqual(1, policy.stats()['upstreams']['192.0.2.1']['failures'])
+
+    def test_first_secure_answer(self):
+
+        self.forwarders = {'192.0.2.1': (0.5, 0, self.result()), '192.0.2.2': (0.05, 0, self.result(secure=False))}
+
+        wns_resolver = WalletNameResolver(query_policy=QueryPolicy(hedge_delay=0.2))
+
+        # The hedge's insecure answer arrives first, the secure one is waited for
+        self.assertEqual('1btcaddress', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertAlmostEqual(0.5, self.now)
+
+    def test_insecure(self):
+
+        self.forwarders = {'192.0.2.1': (0.05, 0, self.result(secure=False)), '192.0.2.2': (0.05, 0, self.result())}
+
+        wns_resolver = WalletNameResolver(query_policy=QueryPolicy())
+
+        # Nothing else in flight, insecure answers are not retried elsewhere
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT')
+        self.assertEqual(['192.0.2.1'], self.forwarded())
+
+    def test_retries_with_backoff(self):
+
+        self.forwarders = {'192.0.2.1': (0.01, 2, None), '192.0.2.2': (0.01, 2, None)}
+
+        policy = QueryPolicy(retries=2, backoff=0.1)
+        wns_resolver = WalletNameResolver(query_policy=policy)
+
+        self.assertRaises(WalletNameLookupError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT')
+        self.assertEqual([call(0.1), call(0.2)], self.mockSleep.call_args_list)
+        self.assertEqual(2, policy.stats()['retries'])
+        self.assertEqual(3, policy.stats()['upstreams']['192.0.2.1']['queries'])
+        self.assertEqual(3, policy.stats()['upstreams']['192.0.2.2']['queries'])
+
+    def test_deadline(self):
+
+        self.forwarders = {'192.0.2.1': (60.0, 0, self.result()), '192.0.2.2': (60.0, 0, self.result())}
+
+        wns_resolver = WalletNameResolver(query_policy=QueryPolicy(deadline=2.0))
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT')
+        self.assertAlmostEqual(2.0, self.now)
+        self.assertEqual(0, self.mockSleep.call_count)
+        for ctx in self.contexts:
+            self.assertEqual(1, ctx.cancel.call_count)
+
+    def test_call_timeout(self):
+
+        self.forwarders = {'192.0.2.1': (60.0, 0, self.result()), '192.0.2.2': (60.0, 0, self.result())}
+
+        # The caller's timeout bounds the query when shorter than the policy deadline
+        wns_resolver = WalletNameResolver(query_policy=QueryPolicy(deadline=2.0))
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT', timeout=0.5)
+        self.assertAlmostEqual(0.5, self.now)
+        for ctx in self.contexts:
+            self.assertEqual(ctx.resolve_async.call_count, ctx.cancel.call_count)
+
+    def test_call_timeout_contexts_busy(self):
+
+        wns_resolver = WalletNameResolver(ctx_pool_size=1, query_policy=QueryPolicy(deadline=2.0))
+        held = [(pool, pool.acquire()) for pool in wns_resolver._upstreams().values()]
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT', timeout=0.01)
+        for ctx in self.contexts:
+            self.assertEqual(0, ctx.resolve_async.call_count)
+
+        for pool, (generation, ctx) in held:
+            pool.release(generation, ctx)
+
+    def test_no_nameservers(self):
+
+        self.mockReadNameservers.side_effect = IOError()
+        self.mockUnbound.side_effect = None
+        self.mockUnbound.return_value.resolve.return_value = (0, self.result())
+
+        wns_resolver = WalletNameResolver(query_policy=QueryPolicy())
+
+        self.assertEqual('1btcaddress', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockUnbound.return_value.set_fwd.call_count)
+
+    def test_reload_context(self):
+
+        self.forwarders = {'192.0.2.1': (0.05, 0, self.result()), '192.0.2.2': (0.05, 0, self.result())}
+
+        wns_resolver = WalletNameResolver(query_policy=QueryPolicy())
+        wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.reload_context()
+        wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(2, self.mockReadNameservers.call_count)
+        self.assertEqual(2, len(self.contexts))
@@ -1,8 +1,18 @@
 __author__ = 'mdavid'
 
+import hashlib
+import socket
+import threading
 from mock import *
 from unittest import TestCase
 from wnsresolver import *
+from wnsresolver.cache import ResultCache
+from wnsresolver.endpoint import EndpointTimeoutError
+from wnsresolver.namecoin import NamecoinRPCResolver
+
+def txt_rdata(*strings):
+    # TXT RDATA in wire format, one character-string per argument
+    return b''.join(bytes(bytearray([len(x)])) + x.encode('ascii') for x in strings)
 
 class TestInit(TestCase):
 
@@ -26,6 +36,20 @@ class TestInit(TestCase):
         self.assertEqual('rpcpassword', wns_resolver.nc_password)
         self.assertEqual('/tmp', wns_resolver.nc_tmpdir)
 
+    def test_endpoint_client(self):
+
+        endpoint_client = Mock()
+
+        self.assertIsNotNone(WalletNameResolver().endpoint_client)
+        self.assertEqual(endpoint_client, WalletNameResolver(endpoint_client=endpoint_client).endpoint_client)
+
+    def test_ctx_pool_size(self):
+
+        wns_resolver = WalletNameResolver(ctx_pool_size=4)
+
+        self.assertEqual(4, wns_resolver.ctx_pool.size)
+        self.assertEqual(0, len(wns_resolver.ctx_pool))
+
     def test_defaults(self):
 
         wns_resolver = WalletNameResolver()
@@ -37,6 +61,7 @@ class TestInit(TestCase):
         self.assertIsNone(wns_resolver.nc_user)
         self.assertIsNone(wns_resolver.nc_password)
         self.assertIsNone(wns_resolver.nc_tmpdir)
+        self.assertIsNone(wns_resolver.ctx_pool.size)
 
 
 class TestNamecoinOptions(TestCase):
@@ -150,14 +175,16 @@ class TestResolveWalletName(TestCase):
 
         self.patcher1 = patch('wnsresolver.WalletNameResolver.resolve')
         self.patcher2 = patch('bcresolver.NamecoinResolver')
+        self.patcher3 = patch('wnsresolver.WalletNameResolver.resolve_result')
 
         self.mockWnsResolver = self.patcher1.start()
         self.mockNamecoinResolver = self.patcher2.start()
+        self.mockResolveResult = self.patcher3.start()
 
         self.mockWnsResolver.side_effect = [
-            'btc',
-            '23456789MgDBffBffBff'
+            'btc'
         ]
+        self.mockResolveResult.return_value = WalletNameResult('23456789MgDBffBffBff', 'address', 300, True)
 
         self.mockNamecoinResolver.return_value.resolve.side_effect = [
             'btc',
@@ -168,6 +195,7 @@ class TestResolveWalletName(TestCase):
 
         self.patcher1.stop()
         self.patcher2.stop()
+        self.patcher3.stop()
         
     def test_go_right(self):
         
@@ -175,7 +203,19 @@ class TestResolveWalletName(TestCase):
         ret_val = wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc')
 
         self.assertEqual('23456789MgDBffBffBff', ret_val)
-        self.assertEqual(2, self.mockWnsResolver.call_count)
+        self.assertEqual(1, self.mockWnsResolver.call_count)
+        self.assertEqual(1, self.mockResolveResult.call_count)
+
+    def test_go_right_result(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_wallet_name_result('wallet.mattdavid.xyz', 'btc')
+
+        self.assertIs(self.mockResolveResult.return_value, ret_val)
+        self.assertEqual('23456789MgDBffBffBff', ret_val.value)
+        self.assertEqual(300, ret_val.ttl)
+        self.assertTrue(ret_val.elapsed >= 0)
+        self.mockResolveResult.assert_called_once_with('_btc._wallet.wallet.mattdavid.xyz', 'TXT', forwarded_for=None, timeout=None)
 
     def test_go_right_email_format(self):
 
@@ -183,9 +223,9 @@ class TestResolveWalletName(TestCase):
         ret_val = wns_resolver.resolve_wallet_name('wallet@mattdavid.xyz', 'btc')
 
         self.assertEqual('_wallet.9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.mattdavid.xyz', self.mockWnsResolver.call_args_list[0][0][0])
-        self.assertEqual('_btc._wallet.9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.mattdavid.xyz', self.mockWnsResolver.call_args_list[1][0][0])
+        self.assertEqual('_btc._wallet.9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.mattdavid.xyz', self.mockResolveResult.call_args[0][0])
         self.assertEqual('23456789MgDBffBffBff', ret_val)
-        self.assertEqual(2, self.mockWnsResolver.call_count)
+        self.assertEqual(1, self.mockWnsResolver.call_count)
 
 
     def test_no_name(self):
@@ -230,6 +270,18 @@ class TestResolveWalletName(TestCase):
         self.assertEqual(wns_resolver.nc_port, self.mockNamecoinResolver.call_args[1]['port'])
         self.assertEqual(wns_resolver.nc_tmpdir, self.mockNamecoinResolver.call_args[1]['temp_dir'])
 
+    def test_namecoin_result(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_wallet_name_result('wallet.mattdavid.bit', 'btc')
+
+        self.assertEqual('23456789MgDBffBffBff', ret_val.value)
+        self.assertEqual('address', ret_val.kind)
+        self.assertEqual('namecoin', ret_val.source)
+        self.assertIsNone(ret_val.ttl)
+        self.assertTrue(ret_val.secure)
+        self.assertEqual(0, self.mockResolveResult.call_count)
+
     def test_namecoin_import_error(self):
 
         self.mockNamecoinResolver.side_effect = ImportError()
@@ -238,316 +290,1507 @@ class TestResolveWalletName(TestCase):
         self.assertRaises(WalletNameNamecoinUnavailable, wns_resolver.resolve_wallet_name, 'wallet.mattdavid.bit', 'btc')
         self.assertEqual(1, self.mockNamecoinResolver.call_count)
 
+    def test_namecoin_resolver_reused(self):
+
+        self.mockNamecoinResolver.return_value.resolve.side_effect = ['btc', '23456789MgDBffBffBff', 'btc', '23456789MgDBffBffBff']
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver.resolve_wallet_name('wallet.mattdavid.bit', 'btc')
+        ret_val = wns_resolver.resolve_wallet_name('wallet.mattdavid.bit', 'btc')
+
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual(1, self.mockNamecoinResolver.call_count)
+        self.assertEqual(4, self.mockNamecoinResolver.return_value.resolve.call_count)
+        self.assertEqual(NamecoinRPCResolver, self.mockNamecoinResolver.call_args[1]['nc_name_resolver'])
+
+    def test_namecoin_resolver_rebuilt_on_options_change(self):
+
+        self.mockNamecoinResolver.return_value.resolve.side_effect = ['btc', '23456789MgDBffBffBff', 'btc', '23456789MgDBffBffBff']
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver.resolve_wallet_name('wallet.mattdavid.bit', 'btc')
+        wns_resolver.set_namecoin_options(host='10.0.0.1', user='rpcuser', password='rpcpassword')
+        wns_resolver.resolve_wallet_name('wallet.mattdavid.bit', 'btc')
+
+        self.assertEqual(2, self.mockNamecoinResolver.call_count)
+        self.assertEqual('10.0.0.1', self.mockNamecoinResolver.call_args[1]['host'])
+
+
+class TestResolveWalletNameOptimistic(TestCase):
 
-class TestResolve(TestCase):
     def setUp(self):
-        self.patcher1 = patch('wnsresolver.ub_ctx')
-        self.patcher2 = patch('wnsresolver.requests')
-        self.patcher3 = patch('wnsresolver.os')
-        self.patcher4 = patch('wnsresolver.request')
-        self.patcher5 = patch('wnsresolver.WalletNameResolver.get_endpoint_host')
 
-        self.mockUnbound = self.patcher1.start()
-        self.mockRequests = self.patcher2.start()
-        self.mockOS = self.patcher3.start()
-        self.mockRequest = self.patcher4.start()
-        self.mockGetEndpointHost = self.patcher5.start()
+        self.patcher1 = patch('wnsresolver.WalletNameResolver._query_many')
+        self.patcher2 = patch('wnsresolver.WalletNameResolver._process_result')
+        self.patcher3 = patch('wnsresolver.WalletNameResolver._process_result_detail')
 
-        self.mockResult = Mock()
-        self.mockResult.secure = True
-        self.mockResult.bogus = False
-        self.mockResult.havedata = True
-        self.mockResult.data.as_domain_list.return_value = ['Yml0Y29pbjo/cj1odHRwczovL21lcmNoYW50LmNvbS9wYXkucGhwP2glM0QyYTg2MjhmYzJmYmU=']
-        self.mockUnbound.return_value.resolve.return_value = (0, self.mockResult)
+        self.mockQueryMany = self.patcher1.start()
+        self.mockProcessResult = self.patcher2.start()
+        self.mockProcessResultDetail = self.patcher3.start()
 
-        self.mockRequests.get.return_value.text = 'test response text'
-        self.mockRequest.access_route = ['8.8.8.8']
+        self.mockQueryMany.return_value = [(0, 'list_result'), (0, 'currency_result')]
+        self.mockProcessResult.side_effect = [
+            'btc ltc'
+        ]
+        self.mockProcessResultDetail.return_value = WalletNameResult('23456789MgDBffBffBff', 'address', 300, True)
 
     def tearDown(self):
+
         self.patcher1.stop()
         self.patcher2.stop()
         self.patcher3.stop()
-        self.patcher4.stop()
-        self.patcher5.stop()
-
-    def test_go_right_startswith_bitcoin_uri(self):
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+    def test_go_right(self):
 
-        # Validate response
-        self.assertEqual('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', ret_val)
+        wns_resolver = WalletNameResolver(optimistic=True)
+        ret_val = wns_resolver.resolve_wallet_name('wallet@mattdavid.xyz', 'btc')
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual(1, self.mockQueryMany.call_count)
+        self.assertEqual([
+            ('_wallet.9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.mattdavid.xyz', 'TXT'),
+            ('_btc._wallet.9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.mattdavid.xyz', 'TXT')
+        ], self.mockQueryMany.call_args[0][0])
+        self.assertEqual((0, 'list_result'), self.mockProcessResult.call_args_list[0][0])
+        self.assertEqual((0, 'currency_result'), self.mockProcessResultDetail.call_args[0])
 
-    def test_go_right_startswith_http_get_endpoint_returns_lookup_url(self):
+    def test_no_currency_list(self):
 
-        # Setup Test case
-        self.mockGetEndpointHost.return_value = 'lookup_url_returned', None
-        self.mockResult.data.as_domain_list.return_value = ['aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=']
+        wns_resolver = WalletNameResolver(optimistic=True)
+        self.assertRaises(WalletNameCurrencyUnavailableError, wns_resolver.resolve_wallet_name, 'wallet.mattdavid.xyz', 'dgc')
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        # Currency record is never processed for an unlisted currency
+        self.assertEqual(1, self.mockProcessResult.call_count)
+        self.assertEqual(0, self.mockProcessResultDetail.call_count)
 
-        # Validate response
-        self.assertEqual('test response text', ret_val)
+    def test_no_available_currency(self):
 
-        # Validate GET contains b64txt and headers
-        self.assertEqual('lookup_url_returned', self.mockRequests.get.call_args[0][0])
-        self.assertEqual({'X-Forwarded-For': '8.8.8.8'}, self.mockRequests.get.call_args[1].get('headers'))
+        self.mockProcessResult.side_effect = [None]
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(1, self.mockGetEndpointHost.call_count)
-        self.assertEqual(1, self.mockRequests.get.call_count)
+        wns_resolver = WalletNameResolver(optimistic=True)
+        self.assertRaises(WalletNameUnavailableError, wns_resolver.resolve_wallet_name, 'wallet.mattdavid.xyz', 'btc')
+        self.assertEqual(1, self.mockProcessResult.call_count)
 
-    def test_go_right_startswith_http_get_endpoint_returns_return_data(self):
+    @patch('wnsresolver.WalletNameResolver.resolve_result')
+    @patch('wnsresolver.WalletNameResolver.resolve')
+    def test_cached_currency_list_not_optimistic(self, mockResolve, mockResolveResult):
 
-        # Setup test case
-        self.mockGetEndpointHost.return_value = None, 'myretdata'
-        self.mockResult.data.as_domain_list.return_value = ['aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=']
+        mockResolveResult.return_value = WalletNameResult('23456789MgDBffBffBff')
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        cache = ResultCache()
+        cache.set(('_wallet.wallet.mattdavid.xyz', 'TXT'), ('btc', None), 300)
+        refresher = Mock()
 
-        # Validate response
-        self.assertEqual('myretdata', ret_val)
+        wns_resolver = WalletNameResolver(optimistic=True, cache=cache, refresher=refresher)
+        ret_val = wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc')
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(1, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual(0, self.mockQueryMany.call_count)
+        self.assertEqual(1, mockResolveResult.call_count)
 
-    def test_go_right_b64decode_exception(self):
+        # The cached currency list is used as probed, one hit and one refresher touch
+        self.assertEqual(0, mockResolve.call_count)
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(1, refresher.touch.call_count)
 
-        # Setup Test case
-        self.mockResult.data.as_domain_list.return_value = ['1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3']
+    @patch('bcresolver.NamecoinResolver')
+    def test_namecoin_not_optimistic(self, mockNamecoinResolver):
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        mockNamecoinResolver.return_value.resolve.side_effect = ['btc', '23456789MgDBffBffBff']
 
-        # Validate response
-        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', ret_val)
+        wns_resolver = WalletNameResolver(optimistic=True)
+        ret_val = wns_resolver.resolve_wallet_name('wallet.mattdavid.bit', 'btc')
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.assertEqual('23456789MgDBffBffBff', ret_val)
+        self.assertEqual(0, self.mockQueryMany.call_count)
+        self.assertEqual(2, mockNamecoinResolver.return_value.resolve.call_count)
 
-    def test_go_right_end_of_chain(self):
 
-        # Setup Test case
-        self.mockResult.data.as_domain_list.return_value = ['dGhpc2lzZ3JlYXQx']
+class TestQueryMany(TestCase):
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+    def setUp(self):
 
-        # Validate response
-        self.assertEqual('dGhpc2lzZ3JlYXQx', ret_val)
+        self.patcher1 = patch('wnsresolver.ub_ctx')
+        self.patcher2 = patch('wnsresolver.os')
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.mockUnbound = self.patcher1.start()
+        self.mockOS = self.patcher2.start()
 
-    def test_trust_anchor_missing(self):
+        self.callbacks = []
+        def resolve_async(name, mydata, callback, rrtype, rrclass):
+            self.callbacks.append((callback, mydata, name))
+            return 0, len(self.callbacks)
 
-        # Setup Test case
-        self.mockOS.path.isfile.return_value = False
+        def wait():
+            # Deliver answers out of order
+            for callback, mydata, name in reversed(self.callbacks):
+                callback(mydata, 0, 'result for %s' % name)
 
-        wns_resolver = WalletNameResolver()
-        self.assertRaisesRegexp(
-            Exception,
-            'Trust anchor is missing or inaccessible',
-            wns_resolver.resolve,
-            'wallet.mattdavid.xyz',
-            'TXT'
-        )
+        self.mockUnbound.return_value.resolve_async.side_effect = resolve_async
+        self.mockUnbound.return_value.wait.side_effect = wait
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(0, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+    def tearDown(self):
 
-    def test_status_not_0(self):
+        self.patcher1.stop()
+        self.patcher2.stop()
 
-        # Setup Test case
-        from wnsresolver import WalletNameLookupError
-        self.mockUnbound.return_value.resolve.return_value = (1, self.mockResult)
+    def test_go_right(self):
 
         wns_resolver = WalletNameResolver()
-        self.assertRaises(
-            WalletNameLookupError,
-            wns_resolver.resolve,
-            'wallet.mattdavid.xyz',
-            'TXT'
-        )
+        ret_val = wns_resolver._query_many([('_wallet.mattdavid.xyz', 'TXT'), ('_btc._wallet.mattdavid.xyz', 'TXT')])
 
-        # Validate all calls
+        self.assertEqual([(0, 'result for _wallet.mattdavid.xyz'), (0, 'result for _btc._wallet.mattdavid.xyz')], ret_val)
         self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.assertEqual(2, self.mockUnbound.return_value.resolve_async.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.wait.call_count)
 
-    def test_insecure_result(self):
+    def test_submit_failure(self):
 
-        # Setup Test case
-        from wnsresolver import WalletNameLookupInsecureError
-        self.mockResult.secure = False
+        self.mockUnbound.return_value.resolve_async.side_effect = [(0, 1), (1, 0)]
+        self.mockUnbound.return_value.wait.side_effect = None
 
         wns_resolver = WalletNameResolver()
-        self.assertRaises(
-            WalletNameLookupInsecureError,
-            wns_resolver.resolve,
-            'wallet.mattdavid.xyz',
-            'TXT'
-        )
+        ret_val = wns_resolver._query_many([('_wallet.mattdavid.xyz', 'TXT'), ('_btc._wallet.mattdavid.xyz', 'TXT')])
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.assertEqual((1, None), ret_val[1])
+        self.assertEqual(1, self.mockUnbound.return_value.wait.call_count)
 
-    def test_bogus_result(self):
 
-        # Setup Test case
-        from wnsresolver import WalletNameLookupInsecureError
-        self.mockResult.bogus = True
+class TestResolveAllCurrencies(TestCase):
 
-        wns_resolver = WalletNameResolver()
-        self.assertRaises(
-            WalletNameLookupInsecureError,
-            wns_resolver.resolve,
-            'wallet.mattdavid.xyz',
-            'TXT'
-        )
+    def setUp(self):
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.patcher1 = patch('wnsresolver.WalletNameResolver.resolve')
+        self.patcher2 = patch('wnsresolver.WalletNameResolver._query_many')
+        self.patcher3 = patch('wnsresolver.WalletNameResolver._record_value')
+        self.patcher4 = patch('wnsresolver.WalletNameResolver._host_addresses')
+        self.patcher5 = patch('wnsresolver.request_client_address')
+
+        self.mockResolve = self.patcher1.start()
+        self.mockQueryMany = self.patcher2.start()
+        self.mockRecordValue = self.patcher3.start()
+        self.mockHostAddresses = self.patcher4.start()
+        self.mockRequestClientAddress = self.patcher5.start()
+
+        self.mockResolve.return_value = 'btc ltc dgc btc'
+        self.records = {
+            '_btc._wallet.wallet.mattdavid.xyz': '1btcaddress',
+            '_ltc._wallet.wallet.mattdavid.xyz': 'aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=',
+            '_dgc._wallet.wallet.mattdavid.xyz': 'aHR0cHM6Ly9hZGRyZXNzaW1vLm5ldGtpLmNvbS9yZXNvbHZl'
+        }
+        self.mockQueryMany.side_effect = lambda queries, deadline=None: [(0, self.records.get(name)) for name, qtype in queries]
+        self.mockRecordValue.side_effect = lambda status, result: result
+        self.mockHostAddresses.return_value = ['93.184.216.34']
+        self.mockRequestClientAddress.return_value = None
+
+        self.fetch_threads = set()
+        def get(url, headers=None, deadline=None):
+            self.fetch_threads.add(threading.current_thread().name)
+            return 'bitcoin:%s' % url
+        self.mockEndpointClient = Mock()
+        self.mockEndpointClient.get.side_effect = get
 
-    def test_havedata_false(self):
+    def tearDown(self):
 
-        # Setup Test case
-        self.mockResult.havedata = False
+        self.patcher1.stop()
+        self.patcher2.stop()
+        self.patcher3.stop()
+        self.patcher4.stop()
+        self.patcher5.stop()
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+    def test_go_right(self):
 
-        # Validate response
-        self.assertIsNone(ret_val)
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+        ret_val = wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz')
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(0, self.mockGetEndpointHost.call_count)
-        self.assertEqual(0, self.mockRequests.get.call_count)
+        self.assertEqual({
+            'btc': '1btcaddress',
+            'ltc': 'bitcoin:https://bip32address.com/getmine',
+            'dgc': 'bitcoin:https://addressimo.netki.com/resolve'
+        }, ret_val)
 
-    def test_exception_during_lookup_url_get(self):
+        # One currency list lookup, every currency record in one batch, every endpoint hostname in another
+        self.mockResolve.assert_called_once_with('_wallet.wallet.mattdavid.xyz', 'TXT', timeout=None)
+        self.assertEqual(2, self.mockQueryMany.call_count)
+        self.assertEqual([
+            ('_btc._wallet.wallet.mattdavid.xyz', 'TXT'),
+            ('_ltc._wallet.wallet.mattdavid.xyz', 'TXT'),
+            ('_dgc._wallet.wallet.mattdavid.xyz', 'TXT')
+        ], self.mockQueryMany.call_args_list[0][0][0])
+        self.assertEqual([
+            ('bip32address.com', 'A'), ('bip32address.com', 'AAAA'),
+            ('addressimo.netki.com', 'A'), ('addressimo.netki.com', 'AAAA')
+        ], sorted(self.mockQueryMany.call_args_list[1][0][0], key=lambda x: x[0] != 'bip32address.com'))
 
-        # Setup Test case
-        self.mockGetEndpointHost.return_value = 'urls', None
-        self.mockResult.data.as_domain_list.return_value = ['aHR0cHM6Ly9iaXA3MHBheW1lbnRyZXF1ZXN0LmNvbS9nZXRtaW5l']
-        self.mockRequests.get.side_effect = Exception()
+        # Endpoints fetched on separate threads
+        self.assertEqual(2, self.mockEndpointClient.get.call_count)
+        self.assertEqual(2, len(self.fetch_threads))
 
-        wns_resolver = WalletNameResolver()
-        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+    def test_currency_errors(self):
 
-        # Validate response
-        self.assertEqual('https://bip70paymentrequest.com/getmine', ret_val)
+        def record_value(status, result):
+            if status != 0:
+                raise WalletNameLookupError
+            return result
 
-        # Validate all calls
-        self.assertEqual(1, self.mockUnbound.call_count)
-        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
-        self.assertEqual(1, self.mockGetEndpointHost.call_count)
-        self.assertEqual(1, self.mockRequests.get.call_count)
+        self.mockQueryMany.side_effect = lambda queries, deadline=None: [(1 if name.startswith('_ltc') else 0, self.records.get(name)) for name, qtype in queries]
+        self.mockRecordValue.side_effect = record_value
+        del self.records['_dgc._wallet.wallet.mattdavid.xyz']
 
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+        ret_val = wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz')
 
-class TestGetEndpointHost(TestCase):
-    def setUp(self):
-        self.patcher1 = patch('wnsresolver.socket')
-        self.mockSocket = self.patcher1.start()
+        self.assertEqual('1btcaddress', ret_val['btc'])
+        self.assertIsInstance(ret_val['ltc'], WalletNameLookupError)
+        self.assertIsNone(ret_val['dgc'])
+        self.assertEqual(1, self.mockQueryMany.call_count)
+        self.assertEqual(0, self.mockEndpointClient.get.call_count)
 
-    def tearDown(self):
-        self.patcher1.stop()
+    def test_cached_records(self):
 
-    def test_go_right_valid_hostname(self):
+        cache = ResultCache()
+        cache.set(('_btc._wallet.wallet.mattdavid.xyz', 'TXT'), WalletNameRecord('address', '1cachedaddress'), 300)
+        cache.set('bip32address.com', ['93.184.216.34'], 300)
 
-        wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+        wns_resolver = WalletNameResolver(cache=cache, endpoint_client=self.mockEndpointClient, host_cache=cache)
+        ret_val = wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz')
 
-        self.assertEqual('http://www.example.com/pr/uuid', return_url)
-        self.assertIsNone(return_data)
+        self.assertEqual('1cachedaddress', ret_val['btc'])
+        self.assertEqual([('_ltc._wallet.wallet.mattdavid.xyz', 'TXT'), ('_dgc._wallet.wallet.mattdavid.xyz', 'TXT')], self.mockQueryMany.call_args_list[0][0][0])
+        self.assertEqual([('addressimo.netki.com', 'A'), ('addressimo.netki.com', 'AAAA')], self.mockQueryMany.call_args_list[1][0][0])
 
-    def test_go_right_valid_ipv4(self):
+    def test_request_client_address(self):
 
-        wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('https://8.8.8.8/pr/uuid')
+        self.mockRequestClientAddress.return_value = '1.2.3.4'
 
-        self.assertEqual('https://8.8.8.8/pr/uuid', return_url)
-        self.assertIsNone(return_data)
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+        wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz')
 
-    def test_go_right_valid_ipv6(self):
+        # Taken on the calling thread, fetch threads have no request context
+        self.assertEqual(1, self.mockRequestClientAddress.call_count)
+        for call_args in self.mockEndpointClient.get.call_args_list:
+            self.assertEqual({'X-Forwarded-For': '1.2.3.4'}, call_args[1]['headers'])
 
-        wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('https://[2001:4860:4860::8888]/pr/uuid')
+    def test_no_currency_list(self):
 
-        self.assertEqual('https://[2001:4860:4860::8888]/pr/uuid', return_url)
-        self.assertIsNone(return_data)
+        self.mockResolve.return_value = None
 
-    def test_hostname_localhost(self):
+        wns_resolver = WalletNameResolver()
+        self.assertRaises(WalletNameUnavailableError, wns_resolver.resolve_all_currencies, 'wallet.mattdavid.xyz')
+        self.assertEqual(0, self.mockQueryMany.call_count)
+
+    def test_no_name(self):
 
         wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('https://localhost/pr/uuid')
+        self.assertRaises(AttributeError, wns_resolver.resolve_all_currencies, None)
+        self.assertEqual(0, self.mockResolve.call_count)
 
-        self.assertIsNone(return_url)
-        self.assertEqual('https://localhost/pr/uuid', return_data)
+    @patch('bcresolver.NamecoinResolver')
+    def test_namecoin(self, mockNamecoinResolver):
 
-    def test_hostname_is_none(self):
+        mockNamecoinResolver.return_value.resolve.side_effect = ['btc ltc', '1btcaddress', WalletNameLookupError()]
 
         wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('https://')
+        ret_val = wns_resolver.resolve_all_currencies('wallet.mattdavid.bit')
 
-        self.assertIsNone(return_url)
-        self.assertEqual('https://', return_data)
+        self.assertEqual('1btcaddress', ret_val['btc'])
+        self.assertIsInstance(ret_val['ltc'], WalletNameLookupError)
+        self.assertEqual(1, mockNamecoinResolver.call_count)
+        self.assertEqual(0, self.mockQueryMany.call_count)
 
-    def test_gethostbyname_returns_socket_gaierror(self):
+    def test_hostname_timeout(self):
 
-        import socket
-        self.mockSocket.gaierror = socket.gaierror
-        self.mockSocket.gethostbyname.side_effect = self.mockSocket.gaierror
+        def query_many(queries, deadline=None):
+            if queries[0][1] == 'TXT':
+                return [(0, self.records.get(name)) for name, qtype in queries]
+            # bip32address.com answered in time, addressimo.netki.com did not
+            return [(0, None), (0, None), (STATUS_DEADLINE, None), (STATUS_DEADLINE, None)]
+        self.mockQueryMany.side_effect = query_many
 
-        wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('https://nonexistent_hostname/pr/uuid')
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+        ret_val = wns_resolver.resolve_all_currencies('wallet.mattdavid.xyz', timeout=1.0)
 
-        self.assertIsNone(return_url)
-        self.assertEqual('https://nonexistent_hostname/pr/uuid', return_data)
+        self.assertEqual('1btcaddress', ret_val['btc'])
+        self.assertEqual('bitcoin:https://bip32address.com/getmine', ret_val['ltc'])
+        self.assertIsInstance(ret_val['dgc'], WalletNameTimeoutError)
+        self.assertEqual(1, self.mockHostAddresses.call_count)
+        self.assertEqual(1, self.mockEndpointClient.get.call_count)
 
-    def test_no_route_ip(self):
 
-        wns_resolver = WalletNameResolver()
-        return_url, return_data = wns_resolver.get_endpoint_host('https://192.168.100.1/pr/uuid')
+class TestTimeout(TestCase):
 
-        self.assertIsNone(return_url)
-        self.assertEqual('https://192.168.100.1/pr/uuid', return_data)
+    def setUp(self):
 
-class TestPreprocessName(TestCase):
+        self.patcher1 = patch('wnsresolver.ub_ctx')
+        self.patcher2 = patch('wnsresolver.os')
+        self.patcher3 = patch('wnsresolver.timer')
+        self.patcher4 = patch('wnsresolver.select')
 
-    def test_no_change(self):
+        self.mockUnbound = self.patcher1.start()
+        self.patcher2.start()
+        self.mockTimer = self.patcher3.start()
+        self.mockSelect = self.patcher4.start()
+
+        # Simulated clock and unbound context answering each name, or (name, rrtype), after its latency:
+        # {name: (latency, status, result)}
+        self.now = 0.0
+        self.answers = {
+            '_wallet.wallet.mattdavid.xyz': (0.4, 0, self.result('btc ltc')),
+            '_btc._wallet.wallet.mattdavid.xyz': (0.4, 0, self.result('1btcaddress')),
+            '_ltc._wallet.wallet.mattdavid.xyz': (0.1, 0, self.result('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU='))
+        }
+        self.mockTimer.side_effect = lambda: self.now
+        self.mockSelect.select.side_effect = self.select
+
+        self.ctx = self.mockUnbound.return_value
+        self.ctx.queries = {}
+        self.ctx.fd.return_value = 3
+
+        def resolve_async(name, mydata, callback, rrtype, rrclass):
+            latency, status, result = self.answers.get((name, rrtype)) or self.answers.get(name, (60.0, 0, None))
+            self.ctx.queries[len(self.ctx.queries) + 1] = (self.now + latency, callback, mydata, status, result)
+            return 0, len(self.ctx.queries)
+
+        def process():
+            for async_id, (due, callback, mydata, status, result) in list(self.ctx.queries.items()):
+                if due <= self.now:
+                    del self.ctx.queries[async_id]
+                    callback(mydata, status, result)
+
+        self.ctx.resolve_async.side_effect = resolve_async
+        self.ctx.process.side_effect = process
+        self.ctx.cancel.side_effect = lambda async_id: self.ctx.queries.pop(async_id)
+
+        self.mockEndpointClient = Mock()
+        self.mockEndpointClient.get.return_value = 'bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc'
 
-        wns_resolver = WalletNameResolver()
+    def tearDown(self):
+
+        self.patcher1.stop()
+        self.patcher2.stop()
+        self.patcher3.stop()
+        self.patcher4.stop()
+
+    def result(self, txt=None, addresses=None):
+
+        result = Mock()
+        result.secure = True
+        result.bogus = False
+        result.rcode = 0
+        result.ttl = 300
+        result.havedata = bool(txt or addresses)
+        result.data.as_raw_data.return_value = addresses or [txt_rdata(txt)] if result.havedata else []
+        return result
+
+    def select(self, fds, writable, errors, timeout):
+
+        due = [query[0] for query in self.ctx.queries.values()]
+        if not due or min(due) > self.now + timeout:
+            self.now += timeout
+            return [], [], []
+
+        self.now = min(due)
+        return [3], [], []
+
+    def test_go_right(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('_btc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=1.0)
+
+        self.assertEqual('1btcaddress', ret_val)
+        self.assertAlmostEqual(0.4, self.now)
+        self.assertEqual(0, self.ctx.resolve.call_count)
+
+    def test_query_timeout(self):
+
+        wns_resolver = WalletNameResolver()
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_dgc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=1.0)
+        self.assertAlmostEqual(1.0, self.now)
+
+        # The abandoned query is cancelled and the context returned to the pool
+        self.assertEqual(1, self.ctx.cancel.call_count)
+        self.assertEqual({}, self.ctx.queries)
+        self.assertIsNotNone(wns_resolver.ctx_pool.acquire(blocking=False))
+
+    def test_pooled_context_busy(self):
+
+        wns_resolver = WalletNameResolver(ctx_pool_size=1)
+
+        # The wait for a free context counts against the timeout
+        with wns_resolver.ctx_pool.context():
+            self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_btc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=0.01)
+        self.assertEqual(0, self.ctx.resolve_async.call_count)
+
+    def test_budget_spread_across_queries(self):
+
+        wns_resolver = WalletNameResolver()
+
+        # Each query fits in the timeout, the currency list and currency record together do not
+        self.assertEqual('1btcaddress', wns_resolver.resolve_wallet_name('wallet.mattdavid.xyz', 'btc', timeout=1.0))
+        self.now = 0.0
+        self.assertRaises(WalletNameTimeoutError, WalletNameResolver().resolve_wallet_name, 'wallet.mattdavid.xyz', 'btc', timeout=0.6)
+
+    def test_optimistic_timeout(self):
+
+        self.answers['_btc._wallet.wallet.mattdavid.xyz'] = (2.0, 0, self.result('1btcaddress'))
+
+        wns_resolver = WalletNameResolver(optimistic=True)
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve_wallet_name, 'wallet.mattdavid.xyz', 'btc', timeout=1.0)
+        self.assertAlmostEqual(1.0, self.now)
+        self.assertEqual({}, self.ctx.queries)
+
+    def test_hostname_timeout(self):
+
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_ltc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=1.0)
+        self.assertEqual(2, self.ctx.cancel.call_count)
+        self.assertEqual(0, self.mockEndpointClient.get.call_count)
+
+    def test_endpoint_fetch_timeout(self):
+
+        self.answers['bip32address.com'] = (0.1, 0, self.result(addresses=[b'\x5d\xb8\xd8\x22']))
+        self.answers[('bip32address.com', RR_TYPES['AAAA'])] = (0.1, 0, self.result())
+
+        def get(url, headers=None, deadline=None):
+            self.now = deadline
+            raise EndpointTimeoutError()
+        self.mockEndpointClient.get.side_effect = get
+
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+
+        self.assertRaises(WalletNameTimeoutError, wns_resolver.resolve, '_ltc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=1.0)
+        self.assertAlmostEqual(1.0, self.mockEndpointClient.get.call_args[1]['deadline'])
+
+    def test_endpoint_fetch_within_timeout(self):
+
+        self.answers['bip32address.com'] = (0.1, 0, self.result(addresses=[b'\x5d\xb8\xd8\x22']))
+        self.answers[('bip32address.com', RR_TYPES['AAAA'])] = (0.1, 0, self.result())
+
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+        ret_val = wns_resolver.resolve('_ltc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=1.0)
+
+        self.assertEqual('bitcoin:1FHz8bpEE5qUZ9XhfjzAbCCwo5bT1HMNAc', ret_val)
+
+    def test_endpoint_error_within_timeout(self):
+
+        # Endpoint failures before the deadline still return the URL for the requester to handle
+        self.answers['bip32address.com'] = (0.1, 0, self.result(addresses=[b'\x5d\xb8\xd8\x22']))
+        self.answers[('bip32address.com', RR_TYPES['AAAA'])] = (0.1, 0, self.result())
+        self.mockEndpointClient.get.side_effect = Exception()
+
+        wns_resolver = WalletNameResolver(endpoint_client=self.mockEndpointClient)
+        ret_val = wns_resolver.resolve('_ltc._wallet.wallet.mattdavid.xyz', 'TXT', timeout=1.0)
+
+        self.assertEqual('https://bip32address.com/getmine', ret_val)
+
+    def test_is_lookup_error(self):
+
+        self.assertTrue(issubclass(WalletNameTimeoutError, WalletNameLookupError))
+
+
+class TestRequestClientAddress(TestCase):
+
+    def test_flask_not_loaded(self):
+
+        with patch.dict('sys.modules', {'flask': None}):
+            self.assertIsNone(request_client_address())
+
+    def test_outside_request_context(self):
+
+        import flask
+        self.assertIsNone(request_client_address())
+
+    def test_request_context(self):
+
+        from flask import Flask
+        with Flask('test').test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}, headers={'X-Forwarded-For': '8.8.8.8'}):
+            self.assertEqual('8.8.8.8', request_client_address())
+
+
+class TestResolve(TestCase):
+    def setUp(self):
+        self.patcher1 = patch('wnsresolver.ub_ctx')
+        self.patcher2 = patch('wnsresolver.EndpointClient.get')
+        self.patcher3 = patch('wnsresolver.os')
+        self.patcher4 = patch('wnsresolver.request_client_address')
+        self.patcher5 = patch('wnsresolver.WalletNameResolver.get_endpoint_host')
+
+        self.mockUnbound = self.patcher1.start()
+        self.mockEndpointGet = self.patcher2.start()
+        self.mockOS = self.patcher3.start()
+        self.mockRequest = self.patcher4.start()
+        self.mockGetEndpointHost = self.patcher5.start()
+
+        self.mockResult = Mock()
+        self.mockResult.secure = True
+        self.mockResult.bogus = False
+        self.mockResult.havedata = True
+        self.mockResult.ttl = 300
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('Yml0Y29pbjo/cj1odHRwczovL21lcmNoYW50LmNvbS9wYXkucGhwP2glM0QyYTg2MjhmYzJmYmU=')]
+        self.mockUnbound.return_value.resolve.return_value = (0, self.mockResult)
+
+        self.mockEndpointGet.return_value = 'test response text'
+        self.mockRequest.return_value = '8.8.8.8'
+
+    def tearDown(self):
+        self.patcher1.stop()
+        self.patcher2.stop()
+        self.patcher3.stop()
+        self.patcher4.stop()
+        self.patcher5.stop()
+
+    def test_go_right_startswith_bitcoin_uri(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertEqual('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', ret_val)
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_pooled_context_busy(self):
+
+        wns_resolver = WalletNameResolver()
+
+        # Blocking resolves run on the shared context, never waiting for a pooled one
+        with wns_resolver.ctx_pool.context():
+            ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', ret_val)
+        self.assertEqual(2, self.mockUnbound.call_count)
+
+    def test_concurrent_resolves(self):
+
+        lock = threading.Lock()
+        all_resolving = threading.Event()
+        resolving = []
+
+        def resolve(name, rrtype, rrclass):
+            with lock:
+                resolving.append(name)
+                if len(resolving) == 4:
+                    all_resolving.set()
+            all_resolving.wait(5)
+            return 0, self.mockResult
+        self.mockUnbound.return_value.resolve.side_effect = resolve
+
+        wns_resolver = WalletNameResolver()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT'))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every thread was inside ub_resolve at once on the one shared context
+        self.assertTrue(all_resolving.is_set())
+        self.assertEqual(4, len(results))
+        self.assertEqual(1, self.mockUnbound.call_count)
+
+    def test_concurrent_async_queries(self):
+
+        lock = threading.Lock()
+        all_waiting = threading.Event()
+        waiting = []
+
+        def build_context():
+            ctx = Mock()
+            queries = []
+
+            def resolve_async(name, mydata, callback, rrtype, rrclass):
+                queries.append((callback, mydata))
+                return 0, len(queries)
+
+            def wait():
+                with lock:
+                    waiting.append(ctx)
+                    if len(waiting) == 4:
+                        all_waiting.set()
+                all_waiting.wait(5)
+
+                result = Mock()
+                result.bogus = False
+                result.havedata = False
+                for callback, mydata in queries:
+                    callback(mydata, 0, result)
+
+            ctx.resolve_async.side_effect = resolve_async
+            ctx.wait.side_effect = wait
+            return ctx
+        self.mockUnbound.side_effect = build_context
+
+        wns_resolver = WalletNameResolver()
+        results = []
+        threads = [threading.Thread(target=lambda x=x: results.append(wns_resolver._hostname_addresses('host%d.mattdavid.xyz' % x))) for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Hostname checks on every thread waited on their answers at once, each on a context of its own
+        self.assertTrue(all_waiting.is_set())
+        self.assertEqual([[]] * 4, results)
+        self.assertEqual(4, len(wns_resolver.ctx_pool))
+
+    def test_go_right_startswith_http_get_endpoint_returns_lookup_url(self):
+
+        # Setup Test case
+        self.mockGetEndpointHost.return_value = 'lookup_url_returned', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertEqual('test response text', ret_val)
+
+        # Validate GET contains b64txt and headers
+        self.assertEqual('lookup_url_returned', self.mockEndpointGet.call_args[0][0])
+        self.assertEqual({'X-Forwarded-For': '8.8.8.8'}, self.mockEndpointGet.call_args[1].get('headers'))
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(1, self.mockGetEndpointHost.call_count)
+        self.assertEqual(1, self.mockEndpointGet.call_count)
+
+    def test_explicit_forwarded_for(self):
+
+        # Setup Test case
+        self.mockGetEndpointHost.return_value = 'lookup_url_returned', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT', forwarded_for='1.2.3.4')
+
+        # Validate response
+        self.assertEqual('test response text', ret_val)
+        self.assertEqual({'X-Forwarded-For': '1.2.3.4'}, self.mockEndpointGet.call_args[1].get('headers'))
+        self.assertEqual(0, self.mockRequest.call_count)
+
+    def test_no_client_address(self):
+
+        # Setup Test case
+        self.mockRequest.return_value = None
+        self.mockGetEndpointHost.return_value = 'lookup_url_returned', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Endpoint is still fetched, without X-Forwarded-For
+        self.assertEqual('test response text', ret_val)
+        self.assertEqual({}, self.mockEndpointGet.call_args[1].get('headers'))
+
+    def test_go_right_startswith_http_get_endpoint_returns_return_data(self):
+
+        # Setup test case
+        self.mockGetEndpointHost.return_value = None, 'myretdata'
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertEqual('myretdata', ret_val)
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(1, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_go_right_b64decode_exception(self):
+
+        # Setup Test case
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', ret_val)
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_go_right_end_of_chain(self):
+
+        # Setup Test case
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('dGhpc2lzZ3JlYXQx')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertEqual('dGhpc2lzZ3JlYXQx', ret_val)
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_context_reused_between_queries(self):
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolvconf.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.add_ta_file.call_count)
+        self.assertEqual(2, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_reload_context(self):
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.reload_context()
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate all calls
+        self.assertEqual(2, self.mockUnbound.call_count)
+        self.assertEqual(2, self.mockUnbound.return_value.add_ta_file.call_count)
+        self.assertEqual(2, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_cache_hit(self):
+
+        self.mockResult.ttl = 300
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3')]
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(1, wns_resolver.cache.hits)
+        self.assertEqual(1, wns_resolver.cache.misses)
+
+    def test_cache_keyed_on_qtype(self):
+
+        self.mockResult.ttl = 300
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'A')
+
+        self.assertEqual(2, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_cache_negative_result(self):
+
+        self.mockResult.ttl = 300
+        self.mockResult.havedata = False
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        self.assertIsNone(wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertIsNone(wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_cache_skips_insecure_result(self):
+
+        self.mockResult.ttl = 300
+        self.mockResult.secure = False
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT')
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(2, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, len(wns_resolver.cache))
+
+    def test_cache_skips_bogus_result(self):
+
+        self.mockResult.ttl = 300
+        self.mockResult.bogus = True
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, '_btc._wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(0, len(wns_resolver.cache))
+
+    def test_cache_endpoint_still_fetched(self):
+
+        self.mockResult.ttl = 300
+        self.mockGetEndpointHost.return_value = 'lookup_url_returned', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        self.assertEqual('test response text', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual('test response text', wns_resolver.resolve('_btc._wallet.mattdavid.xyz', 'TXT'))
+
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(2, self.mockEndpointGet.call_count)
+
+    def test_multiple_character_strings(self):
+
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJl', 'c3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual('endpoint_url', ret_val.kind)
+        self.assertEqual('https://bip32address.com/getmine', self.mockGetEndpointHost.call_args[0][0])
+
+    def test_resolve_all(self):
+
+        self.mockResult.data.as_raw_data.return_value = [
+            txt_rdata('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3'),
+            txt_rdata('Yml0Y29pbjo/cj1odHRwczovL21lcmNoYW50LmNvbS9wYXkucGhwP2glM0QyYTg2MjhmYzJmYmU=')
+        ]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_all('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(['1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', 'bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe'], ret_val)
+        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT'))
+
+    def test_resolve_all_no_data(self):
+
+        self.mockResult.havedata = False
+
+        wns_resolver = WalletNameResolver()
+        self.assertEqual([], wns_resolver.resolve_all('wallet.mattdavid.xyz', 'TXT'))
+
+    def test_resolve_all_insecure(self):
+
+        self.mockResult.secure = False
+
+        wns_resolver = WalletNameResolver()
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve_all, 'wallet.mattdavid.xyz', 'TXT')
+
+    def test_resolve_all_cached(self):
+
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('1btcaddress'), txt_rdata('1otheraddress')]
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.resolve_all('wallet.mattdavid.xyz', 'TXT')
+        ret_val = wns_resolver.resolve_all('wallet.mattdavid.xyz', 'TXT')
+
+        # Single and all record answers are cached apart
+        self.assertEqual(['1btcaddress', '1otheraddress'], ret_val)
+        self.assertEqual(2, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(2, len(wns_resolver.cache))
+
+    def test_result(self):
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', ret_val.value)
+        self.assertEqual('bitcoin_uri', ret_val.kind)
+        self.assertEqual(300, ret_val.ttl)
+        self.assertTrue(ret_val.secure)
+        self.assertEqual('icann', ret_val.source)
+        self.assertTrue(ret_val.elapsed >= 0)
+
+    @patch('wnsresolver.time')
+    def test_result_cache_hit_remaining_ttl(self, mockTime):
+
+        mockTime.time.return_value = 1000.0
+
+        wns_resolver = WalletNameResolver(cache=ResultCache())
+        wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        mockTime.time.return_value = 1120.0
+        ret_val = wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(180, ret_val.ttl)
+        self.assertEqual('bitcoin_uri', ret_val.kind)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_result_endpoint_not_cacheable(self):
+
+        self.mockGetEndpointHost.return_value = 'lookup_url_returned', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual('test response text', ret_val.value)
+        self.assertEqual('endpoint_url', ret_val.kind)
+        self.assertEqual(0, ret_val.ttl)
+
+    def test_result_no_data(self):
+
+        self.mockResult.havedata = False
+        self.mockResult.ttl = 60
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertIsNone(ret_val.value)
+        self.assertIsNone(ret_val.kind)
+        self.assertEqual(60, ret_val.ttl)
+
+    def test_serve_stale_on_failure(self):
+
+        wns_resolver = WalletNameResolver(refresher=CacheRefresher())
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.mockUnbound.return_value.resolve.return_value = (2, None)
+        ret_val = wns_resolver.resolve_result('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', ret_val.value)
+        self.assertEqual(1, wns_resolver.refresher.stale_served)
+
+    def test_serve_stale_on_servfail(self):
+
+        wns_resolver = WalletNameResolver(refresher=CacheRefresher())
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.mockUnbound.return_value.resolve.return_value = (0, Mock(rcode=2, secure=False, havedata=False))
+
+        self.assertEqual('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT'))
+
+    def test_serve_stale_nothing_stale(self):
+
+        self.mockUnbound.return_value.resolve.return_value = (2, None)
+
+        wns_resolver = WalletNameResolver(refresher=CacheRefresher())
+        self.assertRaises(WalletNameLookupError, wns_resolver.resolve, 'wallet.mattdavid.xyz', 'TXT')
+
+    def test_serve_stale_not_insecure(self):
+
+        wns_resolver = WalletNameResolver(refresher=CacheRefresher())
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.mockResult.secure = False
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, 'wallet.mattdavid.xyz', 'TXT')
+
+    def test_refresher_touched_on_hit(self):
+
+        refresher = Mock()
+
+        wns_resolver = WalletNameResolver(cache=ResultCache(), refresher=refresher)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        refresher.stored.assert_called_once_with(('wallet.mattdavid.xyz', 'TXT'), ANY, 300)
+        refresher.touch.assert_called_once_with(('wallet.mattdavid.xyz', 'TXT'), wns_resolver._refresh)
+
+    def test_refresh(self):
+
+        wns_resolver = WalletNameResolver(cache=ResultCache(), refresher=CacheRefresher())
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3')]
+        wns_resolver._refresh(('wallet.mattdavid.xyz', 'TXT'))
+
+        self.assertEqual('1MSK1PMnDZN4SLDQ6gB4c6GKRExfGD6Gb3', wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual(2, self.mockUnbound.return_value.resolve.call_count)
+
+    def test_refresh_endpoint_host(self):
+
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver(cache=ResultCache(), refresher=CacheRefresher())
+        with patch.object(wns_resolver, '_hostname_addresses') as mockHostnameAddresses:
+            wns_resolver._refresh(('wallet.mattdavid.xyz', 'TXT'))
+
+        mockHostnameAddresses.assert_called_once_with('bip32address.com')
+
+    def test_refresh_failure_keeps_entry(self):
+
+        wns_resolver = WalletNameResolver(cache=ResultCache(), refresher=CacheRefresher())
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.mockUnbound.return_value.resolve.return_value = (2, None)
+        self.assertRaises(WalletNameLookupError, wns_resolver._refresh, ('wallet.mattdavid.xyz', 'TXT'))
+
+        self.assertEqual(0, wns_resolver.refresher.stale_served)
+        self.assertEqual((True, ('bitcoin:?r=https://merchant.com/pay.php?h%3D2a8628fc2fbe', None)), wns_resolver.cache.get(('wallet.mattdavid.xyz', 'TXT')))
+
+    def test_trust_anchor_missing(self):
+
+        # Setup Test case
+        self.mockOS.path.isfile.return_value = False
+
+        wns_resolver = WalletNameResolver()
+        self.assertRaisesRegexp(
+            Exception,
+            'Trust anchor is missing or inaccessible',
+            wns_resolver.resolve,
+            'wallet.mattdavid.xyz',
+            'TXT'
+        )
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(0, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_status_not_0(self):
+
+        # Setup Test case
+        from wnsresolver import WalletNameLookupError
+        self.mockUnbound.return_value.resolve.return_value = (1, self.mockResult)
+
+        wns_resolver = WalletNameResolver()
+        self.assertRaises(
+            WalletNameLookupError,
+            wns_resolver.resolve,
+            'wallet.mattdavid.xyz',
+            'TXT'
+        )
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_insecure_result(self):
+
+        # Setup Test case
+        from wnsresolver import WalletNameLookupInsecureError
+        self.mockResult.secure = False
+
+        wns_resolver = WalletNameResolver()
+        self.assertRaises(
+            WalletNameLookupInsecureError,
+            wns_resolver.resolve,
+            'wallet.mattdavid.xyz',
+            'TXT'
+        )
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_bogus_result(self):
+
+        # Setup Test case
+        from wnsresolver import WalletNameLookupInsecureError
+        self.mockResult.bogus = True
+
+        wns_resolver = WalletNameResolver()
+        self.assertRaises(
+            WalletNameLookupInsecureError,
+            wns_resolver.resolve,
+            'wallet.mattdavid.xyz',
+            'TXT'
+        )
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_havedata_false(self):
+
+        # Setup Test case
+        self.mockResult.havedata = False
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertIsNone(ret_val)
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(0, self.mockGetEndpointHost.call_count)
+        self.assertEqual(0, self.mockEndpointGet.call_count)
+
+    def test_exception_during_lookup_url_get(self):
+
+        # Setup Test case
+        self.mockGetEndpointHost.return_value = 'urls', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXA3MHBheW1lbnRyZXF1ZXN0LmNvbS9nZXRtaW5l')]
+        self.mockEndpointGet.side_effect = Exception()
+
+        wns_resolver = WalletNameResolver()
+        ret_val = wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        # Validate response
+        self.assertEqual('https://bip70paymentrequest.com/getmine', ret_val)
+
+        # Validate all calls
+        self.assertEqual(1, self.mockUnbound.call_count)
+        self.assertEqual(1, self.mockUnbound.return_value.resolve.call_count)
+        self.assertEqual(1, self.mockGetEndpointHost.call_count)
+        self.assertEqual(1, self.mockEndpointGet.call_count)
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        self.patcher1 = patch('wnsresolver.ub_ctx')
+        self.patcher2 = patch('wnsresolver.EndpointClient.get')
+        self.patcher3 = patch('wnsresolver.os')
+        self.patcher4 = patch('wnsresolver.request_client_address')
+        self.patcher5 = patch('wnsresolver.WalletNameResolver.get_endpoint_host')
+
+        self.mockUnbound = self.patcher1.start()
+        self.mockEndpointGet = self.patcher2.start()
+        self.mockOS = self.patcher3.start()
+        self.mockRequest = self.patcher4.start()
+        self.mockGetEndpointHost = self.patcher5.start()
+
+        self.mockResult = Mock()
+        self.mockResult.secure = True
+        self.mockResult.bogus = False
+        self.mockResult.havedata = True
+        self.mockResult.ttl = 300
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('1btcaddress')]
+        self.mockUnbound.return_value.resolve.return_value = (0, self.mockResult)
+
+        self.mockEndpointGet.return_value = 'test response text'
+        self.mockRequest.return_value = '8.8.8.8'
+
+        self.mockMetrics = Mock()
+
+    def tearDown(self):
+        self.patcher1.stop()
+        self.patcher2.stop()
+        self.patcher3.stop()
+        self.patcher4.stop()
+        self.patcher5.stop()
+
+    def observed(self):
+
+        return [(x[0][0], x[0][2]) for x in self.mockMetrics.observe.call_args_list]
+
+    def test_go_right(self):
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual([
+            ('context', {'outcome': 'ok'}),
+            ('trust_anchor', {'outcome': 'ok'}),
+            ('query', {'qtype': 'TXT', 'outcome': 'secure'}),
+            ('classify', {'outcome': 'ok', 'kind': 'address'})
+        ], self.observed())
+
+        for call_args in self.mockMetrics.observe.call_args_list:
+            self.assertTrue(call_args[0][1] >= 0)
+
+    def test_bitcoin_uri_kind(self):
+
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('Yml0Y29pbjo/cj1odHRwczovL21lcmNoYW50LmNvbS9wYXkucGhwP2glM0QyYTg2MjhmYzJmYmU=')]
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(('classify', {'outcome': 'ok', 'kind': 'bitcoin_uri'}), self.observed()[-1])
+
+    def test_endpoint_stages(self):
+
+        self.mockGetEndpointHost.return_value = 'https://bip32address.com/getmine', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual([
+            ('classify', {'outcome': 'ok', 'kind': 'endpoint_url'}),
+            ('endpoint_host', {'outcome': 'routable'}),
+            ('endpoint_fetch', {'outcome': 'ok'})
+        ], self.observed()[-3:])
+
+    def test_endpoint_unroutable(self):
+
+        self.mockGetEndpointHost.return_value = None, 'https://bip32address.com/getmine'
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(('endpoint_host', {'outcome': 'unroutable'}), self.observed()[-1])
+
+    def test_endpoint_fetch_error(self):
+
+        self.mockGetEndpointHost.return_value = 'https://bip32address.com/getmine', None
+        self.mockResult.data.as_raw_data.return_value = [txt_rdata('aHR0cHM6Ly9iaXAzMmFkZHJlc3MuY29tL2dldG1pbmU=')]
+        self.mockEndpointGet.side_effect = Exception()
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual(('endpoint_fetch', {'outcome': 'error'}), self.observed()[-1])
+
+    def test_trust_anchor_missing(self):
+
+        self.mockOS.path.isfile.return_value = False
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        self.assertRaises(Exception, wns_resolver.resolve, 'wallet.mattdavid.xyz', 'TXT')
+
+        self.assertEqual([('context', {'outcome': 'ok'}), ('trust_anchor', {'outcome': 'missing'})], self.observed())
+
+    def test_query_outcomes(self):
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+
+        self.mockResult.secure = False
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, 'wallet.mattdavid.xyz', 'TXT')
+        self.assertEqual(('query', {'qtype': 'TXT', 'outcome': 'insecure'}), self.observed()[-1])
+
+        self.mockResult.bogus = True
+        self.assertRaises(WalletNameLookupInsecureError, wns_resolver.resolve, 'wallet.mattdavid.xyz', 'TXT')
+        self.assertEqual(('query', {'qtype': 'TXT', 'outcome': 'bogus'}), self.observed()[-1])
+
+        self.mockResult.secure = True
+        self.mockResult.bogus = False
+        self.mockResult.havedata = False
+        self.assertIsNone(wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT'))
+        self.assertEqual(('query', {'qtype': 'TXT', 'outcome': 'nodata'}), self.observed()[-1])
+
+        self.mockUnbound.return_value.resolve.return_value = (2, None)
+        self.assertRaises(WalletNameLookupError, wns_resolver.resolve, 'wallet.mattdavid.xyz', 'TXT')
+        self.assertEqual(('query', {'qtype': 'TXT', 'outcome': 'error'}), self.observed()[-1])
+
+    def test_record_cache(self):
+
+        wns_resolver = WalletNameResolver(cache=ResultCache(), metrics=self.mockMetrics)
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+        wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT')
+
+        observed = self.observed()
+        self.assertEqual(('record_cache', {'qtype': 'TXT', 'outcome': 'miss'}), observed[0])
+        self.assertEqual(('record_cache', {'qtype': 'TXT', 'outcome': 'hit'}), observed[-1])
+        self.assertEqual(1, [x[0] for x in observed].count('query'))
+
+    def test_async_query_timed(self):
+
+        callback = Mock()
+        ctx = Mock()
+        ctx.resolve_async.return_value = (0, 1)
+
+        wns_resolver = WalletNameResolver(metrics=self.mockMetrics)
+        wns_resolver._submit_query(ctx, 'wallet.mattdavid.xyz', 'TXT', callback, 'mydata')
+
+        self.assertEqual(0, self.mockMetrics.observe.call_count)
+
+        # unbound delivers the answer
+        ctx.resolve_async.call_args[0][2]('mydata', 0, self.mockResult)
+
+        callback.assert_called_once_with('mydata', 0, self.mockResult)
+        self.assertEqual([('query', {'qtype': 'TXT', 'outcome': 'secure'})], self.observed())
+
+    def test_no_metrics(self):
+
+        callback = Mock()
+        ctx = Mock()
+        ctx.resolve_async.return_value = (0, 1)
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver._submit_query(ctx, 'wallet.mattdavid.xyz', 'TXT', callback, 'mydata')
+        self.assertIs(callback, ctx.resolve_async.call_args[0][2])
+
+        self.assertEqual('1btcaddress', wns_resolver.resolve('wallet.mattdavid.xyz', 'TXT'))
+
+
+class TestGetEndpointHost(TestCase):
+    def setUp(self):
+        self.patcher1 = patch('wnsresolver.WalletNameResolver._query_many')
+        self.mockQueryMany = self.patcher1.start()
+
+        self.mockA = Mock(bogus=False, havedata=True, ttl=300)
+        self.mockA.data.as_raw_data.return_value = [socket.inet_pton(socket.AF_INET, '93.184.216.34')]
+        self.mockAAAA = Mock(bogus=False, havedata=True, ttl=60)
+        self.mockAAAA.data.as_raw_data.return_value = [socket.inet_pton(socket.AF_INET6, '2606:2800:220:1:248:1893:25c8:1946')]
+
+        self.mockQueryMany.side_effect = lambda queries, deadline=None: [(0, self.mockA), (0, self.mockAAAA)]
+
+    def tearDown(self):
+        self.patcher1.stop()
+
+    def test_go_right_valid_hostname(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+
+        self.assertEqual('http://www.example.com/pr/uuid', return_url)
+        self.assertIsNone(return_data)
+
+        # A and AAAA are queried together through unbound
+        self.assertEqual([('www.example.com', 'A'), ('www.example.com', 'AAAA')], self.mockQueryMany.call_args[0][0])
+
+    def test_hostname_addresses_cached(self):
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+        return_url, return_data = wns_resolver.get_endpoint_host('https://www.example.com/pr/other')
+
+        self.assertEqual('https://www.example.com/pr/other', return_url)
+        self.assertEqual(1, self.mockQueryMany.call_count)
+        self.assertEqual(
+            (True, ['2606:2800:220:1:248:1893:25c8:1946', '93.184.216.34']),
+            wns_resolver.host_cache.get('www.example.com')
+        )
+
+    def test_hostname_cached_for_shortest_ttl(self):
+
+        host_cache = Mock()
+        host_cache.get.return_value = (False, None)
+
+        wns_resolver = WalletNameResolver(host_cache=host_cache)
+        wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+
+        self.assertEqual(60, host_cache.set.call_args[0][2])
+
+    def test_insecure_hostname_accepted(self):
+
+        self.mockA.secure = False
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+
+        self.assertEqual('http://www.example.com/pr/uuid', return_url)
+
+    def test_bogus_hostname(self):
+
+        self.mockAAAA.bogus = True
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('http://www.example.com/pr/uuid', return_data)
+        self.assertEqual((False, None), wns_resolver.host_cache.get('www.example.com'))
+
+    def test_hostname_lookup_failed(self):
+
+        self.mockQueryMany.side_effect = lambda queries, deadline=None: [(2, None), (0, self.mockAAAA)]
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('http://www.example.com/pr/uuid', return_data)
+        self.assertEqual((False, None), wns_resolver.host_cache.get('www.example.com'))
+
+    def test_hostname_without_addresses(self):
+
+        self.mockA.havedata = False
+        self.mockAAAA.havedata = False
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://nonexistent_hostname/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://nonexistent_hostname/pr/uuid', return_data)
+
+        # Negative answers are cached too
+        wns_resolver.get_endpoint_host('https://nonexistent_hostname/pr/uuid')
+        self.assertEqual(1, self.mockQueryMany.call_count)
+
+    def test_addresses_supplied(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('http://www.example.com/pr/uuid', addresses=['192.168.1.1'])
+
+        self.assertIsNone(return_url)
+        self.assertEqual(0, self.mockQueryMany.call_count)
+
+    def test_go_right_valid_ipv4(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://8.8.8.8/pr/uuid')
+
+        self.assertEqual('https://8.8.8.8/pr/uuid', return_url)
+        self.assertIsNone(return_data)
+
+    def test_go_right_valid_ipv6(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://[2001:4860:4860::8888]/pr/uuid')
+
+        self.assertEqual('https://[2001:4860:4860::8888]/pr/uuid', return_url)
+        self.assertIsNone(return_data)
+
+    def test_hostname_localhost(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://localhost/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://localhost/pr/uuid', return_data)
+
+    def test_hostname_is_none(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://', return_data)
+
+    def test_hostname_resolves_to_no_route_ip(self):
+
+        self.mockA.data.as_raw_data.return_value.append(socket.inet_pton(socket.AF_INET, '10.0.0.1'))
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://www.example.com/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://www.example.com/pr/uuid', return_data)
+
+    def test_hostname_resolves_to_link_local_ipv6(self):
+
+        self.mockAAAA.data.as_raw_data.return_value = [socket.inet_pton(socket.AF_INET6, 'fe80::1')]
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://www.example.com/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://www.example.com/pr/uuid', return_data)
+
+    def test_no_route_ip(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://192.168.100.1/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://192.168.100.1/pr/uuid', return_data)
+
+    def test_no_route_ipv4_mapped_ipv6(self):
+
+        wns_resolver = WalletNameResolver()
+        return_url, return_data = wns_resolver.get_endpoint_host('https://[::ffff:192.168.100.1]/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://[::ffff:192.168.100.1]/pr/uuid', return_data)
+
+    def test_custom_no_route_ranges(self):
+
+        from wnsresolver.iprange import NO_ROUTE_RANGES
+
+        wns_resolver = WalletNameResolver(no_route_ranges=NO_ROUTE_RANGES + ['93.184.216.0/24'])
+        return_url, return_data = wns_resolver.get_endpoint_host('https://www.example.com/pr/uuid')
+
+        self.assertIsNone(return_url)
+        self.assertEqual('https://www.example.com/pr/uuid', return_data)
+
+        return_url, return_data = wns_resolver.get_endpoint_host('https://192.168.100.1/pr/uuid')
+        self.assertIsNone(return_url)
+
+class TestPreprocessName(TestCase):
+
+    def test_no_change(self):
+
+        wns_resolver = WalletNameResolver()
         name = wns_resolver.preprocess_name('wallet.domain.com')
         self.assertEqual('wallet.domain.com', name)
 
@@ -561,4 +1804,63 @@ class TestPreprocessName(TestCase):
 
         wns_resolver = WalletNameResolver()
         name = wns_resolver.preprocess_name('wallet@wallet@domain.com')
-        self.assertEqual('9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.wallet@domain.com', name)
\ No newline at end of file
+        self.assertEqual('9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.wallet@domain.com', name)
+
+    def test_unicode_email_walletname(self):
+
+        wns_resolver = WalletNameResolver()
+        name = wns_resolver.preprocess_name(u'wallet@domain.com')
+        self.assertEqual('9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.domain.com', name)
+
+    def test_internationalized_localpart_normalized(self):
+
+        wns_resolver = WalletNameResolver()
+        composed = wns_resolver.preprocess_name(u'jos\u00e9@domain.com')
+        decomposed = wns_resolver.preprocess_name(u'jose\u0301@domain.com')
+
+        self.assertEqual('%s.domain.com' % hashlib.sha224(u'jos\u00e9'.encode('utf-8')).hexdigest(), composed)
+        self.assertEqual(composed, decomposed)
+
+    def test_utf8_bytes_localpart(self):
+
+        wns_resolver = WalletNameResolver()
+        name = wns_resolver.preprocess_name(u'jos\u00e9@domain.com'.encode('utf-8'))
+        self.assertEqual(wns_resolver.preprocess_name(u'jos\u00e9@domain.com'), name)
+
+    def test_internationalized_domain(self):
+
+        # Not converted, an email-style name's domain is queried as a plain name with that domain would be
+        wns_resolver = WalletNameResolver()
+        name = wns_resolver.preprocess_name(u'wallet@stra\u00dfe.de')
+        self.assertEqual(u'9e9285c79443cf2c0f868b0216308fb0e3ffeb45ade2c10ac67147f5.stra\u00dfe.de', name)
+
+    @patch('wnsresolver.hashlib')
+    def test_memoized(self, mockHashlib):
+
+        mockHashlib.sha224.return_value.hexdigest.return_value = 'hashed'
+
+        wns_resolver = WalletNameResolver()
+        wns_resolver.preprocess_name('wallet@domain.com')
+        name = wns_resolver.preprocess_name('wallet@domain.com')
+
+        self.assertEqual('hashed.domain.com', name)
+        self.assertEqual(1, mockHashlib.sha224.call_count)
+
+    def test_memo_bounded(self):
+
+        wns_resolver = WalletNameResolver(name_cache_size=2)
+        for localpart in ('one', 'two', 'three'):
+            wns_resolver.preprocess_name('%s@domain.com' % localpart)
+
+        self.assertEqual(['two@domain.com', 'three@domain.com'], list(wns_resolver._names))
+
+    @patch('wnsresolver.hashlib')
+    def test_preprocess_names(self, mockHashlib):
+
+        mockHashlib.sha224.return_value.hexdigest.return_value = 'hashed'
+
+        wns_resolver = WalletNameResolver(name_cache_size=0)
+        names = wns_resolver.preprocess_names(['wallet@domain.com', 'wallet.domain.com', 'wallet@domain.com'])
+
+        self.assertEqual(['hashed.domain.com', 'wallet.domain.com', 'hashed.domain.com'], names)
+        self.assertEqual(1, mockHashlib.sha224.call_count)
\ No newline at end of file
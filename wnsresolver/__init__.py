@@ -3,19 +3,38 @@ __author__ = 'mdavid'
 import hashlib
 import iptools
 import os
-import re
-import requests
+import select
 import socket
-from base64 import b64decode
-from dns import rdatatype
-from flask import request
-from unbound import ub_ctx, RR_CLASS_IN
-from urlparse import urlparse
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+from . import snapshot
+from .bulk import BulkResolution
+from .cache import ResultCache
+from .endpoint import EndpointClient
+from .instrumentation import timer
+from .iprange import IpRangeIndex, NO_ROUTE_RANGES
+from .namecoin import NamecoinRPCResolver
+from .pool import UnboundContextPool
+from .records import ENDPOINT_URL, ICANN, NAMECOIN, WalletNameRecord, WalletNameResult, classify_record, txt_value
+from .refresh import CacheRefresher
+from .upstream import QueryPolicy, read_nameservers
 
 
 class WalletNameLookupError(Exception):
     pass
 
+class WalletNameTimeoutError(WalletNameLookupError):
+    pass
+
 class WalletNameLookupInsecureError(Exception):
     pass
 
@@ -31,9 +50,45 @@ class WalletNameUnavailableError(Exception):
 class WalletNameResolutionError(Exception):
     pass
 
+# RR class and the RR types the resolver queries, others are looked up in dnspython on first use
+RR_CLASS_IN = 1
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+
+# Query status when no answer arrived before the call's timeout or the QueryPolicy deadline, unbound's own are positive
+STATUS_DEADLINE = -1
+RR_TYPES = {'A': 1, 'TXT': 16, 'AAAA': 28}
+
+def rr_type(qtype):
+
+    if qtype in RR_TYPES:
+        return RR_TYPES[qtype]
+
+    from dns import rdatatype
+    return rdatatype.from_text(qtype)
+
+def ub_ctx():
+
+    # pyunbound is only loaded once a context is needed
+    from unbound import ub_ctx
+    return ub_ctx()
+
+def remaining(deadline):
+
+    # Seconds left until an absolute timer() deadline, None without one
+    return None if deadline is None else max(0.0, deadline - timer())
+
+def request_client_address():
+
+    # Client address of the current Flask request, if any. Flask is never imported here, without it loaded there is no request.
+    flask = sys.modules.get('flask')
+    if flask is None or not flask.has_request_context():
+        return None
+    return flask.request.access_route[0]
+
 class WalletNameResolver:
 
-    def __init__(self, resolv_conf='/etc/resolv.conf', dnssec_root_key='/usr/local/etc/unbound/root.key', nc_host=None, nc_port=8336, nc_rpcuser=None, nc_rpcpassword=None, nc_tmpdir=None):
+    def __init__(self, resolv_conf='/etc/resolv.conf', dnssec_root_key='/usr/local/etc/unbound/root.key', nc_host=None, nc_port=8336, nc_rpcuser=None, nc_rpcpassword=None, nc_tmpdir=None, ctx_pool_size=None, optimistic=False, cache=None, endpoint_client=None, no_route_ranges=NO_ROUTE_RANGES, host_cache=None, metrics=None, name_cache_size=4096, refresher=None, query_policy=None):
 
         self.resolv_conf = resolv_conf
         self.dnssec_root_key = dnssec_root_key
@@ -42,135 +97,811 @@ class WalletNameResolver:
         self.nc_user = nc_rpcuser
         self.nc_password = nc_rpcpassword
         self.nc_tmpdir = nc_tmpdir
+        self.optimistic = optimistic
+
+        # Optional ResultCache of classified records keyed on (name, qtype)
+        self.cache = cache
+
+        # Pooled keep-alive HTTP session with timeouts for BIP32/BIP70 endpoint fetches
+        self.endpoint_client = endpoint_client or EndpointClient()
+
+        # Endpoints resolving into these ranges are never fetched, extend with NO_ROUTE_RANGES + [...]
+        self.no_route_index = IpRangeIndex(no_route_ranges)
+
+        # Endpoint hostname -> addresses, resolved through unbound and kept for the shortest A/AAAA TTL
+        self.host_cache = host_cache if host_cache is not None else ResultCache(max_entries=1024, negative_ttl=60)
+
+        # Long-lived unbound contexts keep config, trust anchors and the validated cache between queries. Blocking
+        # resolves share one context across threads. Async queries check one out for their whole wait, so by default a
+        # context is added whenever all are busy, ctx_pool_size caps how many.
+        self.ctx_pool = UnboundContextPool(self._build_context, size=ctx_pool_size)
+
+        # resolve_many holds a context for as long as its caller iterates, these are kept apart from ctx_pool
+        self.bulk_pool = UnboundContextPool(self._build_context, size=None)
+
+        # Optional MetricsSink receiving per-stage durations and outcomes, nothing is timed without one
+        self.metrics = metrics
+
+        # Optional CacheRefresher, re-resolves hot cached records before they expire and serves stale ones on failure
+        self.refresher = refresher
+
+        # Optional QueryPolicy, queries each resolv_conf forwarder on its own contexts with retries and hedging
+        self.query_policy = query_policy
+        self._upstream_pools = None
+        self._upstream_lock = threading.Lock()
+
+        # Email-style name -> hashed DNS name, oldest entries dropped past name_cache_size
+        self.name_cache_size = name_cache_size
+        self._names = OrderedDict()
+        self._names_lock = threading.Lock()
+
+        # Namecoin backend, built on first .bit lookup and shared across threads
+        self._namecoin_resolver = None
+        self._namecoin_lock = threading.Lock()
 
     def set_namecoin_options(self, host=None, port=8336, user=None, password=None, tmpdir=None):
 
-        self.nc_host = host
-        self.nc_port = port
-        self.nc_user = user
-        self.nc_password = password
-        self.nc_tmpdir = tmpdir
+        with self._namecoin_lock:
+            self.nc_host = host
+            self.nc_port = port
+            self.nc_user = user
+            self.nc_password = password
+            self.nc_tmpdir = tmpdir
+
+            # Rebuilt with the new options on next use
+            self._namecoin_resolver = None
+
+    def _get_namecoin_resolver(self):
 
-    def resolve_available_currencies(self, name):
+        resolver = self._namecoin_resolver
+        if resolver is not None:
+            return resolver
+
+        with self._namecoin_lock:
+            if self._namecoin_resolver is None:
+                try:
+                    from bcresolver import NamecoinResolver
+                    self._namecoin_resolver = NamecoinResolver(
+                        resolv_conf=self.resolv_conf,
+                        dnssec_root_key=self.dnssec_root_key,
+                        host=self.nc_host,
+                        user=self.nc_user,
+                        password=self.nc_password,
+                        port=self.nc_port,
+                        temp_dir=self.nc_tmpdir,
+                        nc_name_resolver=NamecoinRPCResolver
+                    )
+                except ImportError:
+                    raise WalletNameNamecoinUnavailable('Namecoin Lookup Required the bcresolver module.')
+            return self._namecoin_resolver
+
+    def resolve_available_currencies(self, name, timeout=None):
 
         if not name:
             raise AttributeError('resolve_wallet_name requires both name and currency')
 
         if name.endswith('.bit'):
             # Namecoin Resolution Required
-            try:
-                from bcresolver import NamecoinResolver
-                resolver = NamecoinResolver(
-                    resolv_conf=self.resolv_conf,
-                    dnssec_root_key=self.dnssec_root_key,
-                    host=self.nc_host,
-                    user=self.nc_user,
-                    password=self.nc_password,
-                    port=self.nc_port,
-                    temp_dir=self.nc_tmpdir
-                )
-            except ImportError:
-                raise WalletNameNamecoinUnavailable('Namecoin Lookup Required the bcresolver module.')
+            resolver = self._get_namecoin_resolver()
         else:
             # Default ICANN Resolution
             resolver = self
 
         # Resolve Top-Level Available Currencies
-        currency_list_str = resolver.resolve('_wallet.%s' % self.preprocess_name(name), 'TXT')
+        if resolver is self:
+            currency_list_str = self.resolve('_wallet.%s' % self.preprocess_name(name), 'TXT', timeout=timeout)
+        else:
+            currency_list_str = resolver.resolve('_wallet.%s' % self.preprocess_name(name), 'TXT')
         if not currency_list_str:
             return []
         return currency_list_str.split()
 
 
-    def resolve_wallet_name(self, name, currency):
+    def resolve_wallet_name(self, name, currency, forwarded_for=None, timeout=None):
+
+        return self.resolve_wallet_name_result(name, currency, forwarded_for=forwarded_for, timeout=timeout).value
+
+    def resolve_wallet_name_result(self, name, currency, forwarded_for=None, timeout=None):
+
+        # resolve_wallet_name returning a WalletNameResult, elapsed covers the currency list lookup too. timeout in seconds
+        # bounds every DNS query and the endpoint fetch together, WalletNameTimeoutError is raised once it runs out.
+        start = timer()
+        deadline = start + timeout if timeout is not None else None
 
         if not name or not currency:
             raise AttributeError('resolve_wallet_name requires both name and currency')
 
         if name.endswith('.bit'):
             # Namecoin Resolution Required
-            try:
-                from bcresolver import NamecoinResolver
-                resolver = NamecoinResolver(
-                    resolv_conf=self.resolv_conf,
-                    dnssec_root_key=self.dnssec_root_key,
-                    host=self.nc_host,
-                    user=self.nc_user,
-                    password=self.nc_password,
-                    port=self.nc_port,
-                    temp_dir=self.nc_tmpdir
-                )
-            except ImportError:
-                raise WalletNameNamecoinUnavailable('Namecoin Lookup Required the bcresolver module.')
+            resolver = self._get_namecoin_resolver()
         else:
             # Default ICANN Resolution
             resolver = self
 
         name = self.preprocess_name(name)
 
+        # The optimistic probe's cached currency list is reused below, so it is counted and touched only once
+        list_query = ('_wallet.%s' % name, 'TXT')
+        list_hit, list_record = self._cache_get(*list_query) if self.optimistic and resolver is self else (False, None)
+
+        if self.optimistic and resolver is self and not list_hit:
+            # Send currency list and currency record queries together, then validate them in the usual order
+            currency_query = ('_%s._wallet.%s' % (currency, name), 'TXT')
+            list_answer, currency_answer = self._query_many([list_query, currency_query], deadline=deadline)
+            self._check_currency(self._process_result(*list_answer, cache_key=list_query, deadline=deadline), currency)
+            return self._process_result_detail(*currency_answer, cache_key=currency_query, forwarded_for=forwarded_for, start=start, deadline=deadline)
+
+        if resolver is not self:
+            # bcresolver only returns answers validated against the blockchain's DS records, without their TTL. It has
+            # no async interface and is not bounded by timeout.
+            self._check_currency(resolver.resolve('_wallet.%s' % name, 'TXT'), currency)
+            value = resolver.resolve('_%s._wallet.%s' % (currency, name), 'TXT')
+            kind = classify_record(value).kind if value else None
+            return WalletNameResult(value, kind, None, True, NAMECOIN, timer() - start)
+
         # Resolve Top-Level Available Currencies
-        currency_list_str = resolver.resolve('_wallet.%s' % name, 'TXT')
+        if list_hit:
+            currency_list_str = self._record_result(list_record, deadline=deadline)
+        else:
+            currency_list_str = self.resolve(list_query[0], 'TXT', timeout=remaining(deadline))
+        self._check_currency(currency_list_str, currency)
+
+        result = self.resolve_result('_%s._wallet.%s' % (currency, name), 'TXT', forwarded_for=forwarded_for, timeout=remaining(deadline))
+        result.elapsed = timer() - start
+        return result
+
+    def resolve_many(self, pairs, max_in_flight=64, ordered=False, forwarded_for=None):
+
+        # Stream (name, currency, address or exception) for each input pair, in completion order unless ordered
+        return iter(BulkResolution(self, pairs, max_in_flight=max_in_flight, ordered=ordered, forwarded_for=forwarded_for))
+
+    def resolve_all_currencies(self, name, forwarded_for=None, timeout=None):
+
+        # {currency: address or exception} for every currency the name lists. The currency list is looked up once, then
+        # every currency record is queried together and BIP32/BIP70 endpoints are fetched in parallel.
+        if not name:
+            raise AttributeError('resolve_all_currencies requires a name')
+
+        deadline = timer() + timeout if timeout is not None else None
+
+        if name.endswith('.bit'):
+            # Namecoin Resolution Required
+            resolver = self._get_namecoin_resolver()
+        else:
+            # Default ICANN Resolution
+            resolver = self
+
+        name = self.preprocess_name(name)
+
+        if resolver is self:
+            currency_list_str = self.resolve('_wallet.%s' % name, 'TXT', timeout=remaining(deadline))
+        else:
+            currency_list_str = resolver.resolve('_wallet.%s' % name, 'TXT')
+        if not currency_list_str:
+            raise WalletNameUnavailableError
+        currencies = list(OrderedDict.fromkeys(currency_list_str.split()))
+
+        if resolver is not self:
+            # bcresolver has no async interface, its records are resolved in turn
+            values = {}
+            for currency in currencies:
+                try:
+                    values[currency] = resolver.resolve('_%s._wallet.%s' % (currency, name), 'TXT')
+                except Exception as e:
+                    values[currency] = e
+            return values
+
+        # Endpoint fetch threads have no Flask request context, the client address is taken here
+        if forwarded_for is None:
+            forwarded_for = request_client_address()
+
+        records = {}
+        queries = []
+        for currency in currencies:
+            query = ('_%s._wallet.%s' % (currency, name), 'TXT')
+            hit, record = self._cache_get(*query)
+            if hit:
+                records[currency] = record
+            else:
+                queries.append((currency, query))
+
+        answers = self._query_many([query for currency, query in queries], deadline=deadline) if queries else []
+        for (currency, query), (status, result) in zip(queries, answers):
+            try:
+                records[currency] = self._record(status, result, cache_key=query)
+            except Exception as e:
+                records[currency] = e
+
+        return self._record_results(records, forwarded_for=forwarded_for, deadline=deadline)
+
+    def _record_results(self, records, forwarded_for=None, deadline=None):
+
+        # {key: record or exception} to {key: value or exception}. Endpoint hostnames not yet cached are resolved in one
+        # batch, then each endpoint is fetched on its own thread.
+        hostnames = OrderedDict()
+        for record in records.values():
+            hostname = self._endpoint_lookup_host(record.endpoint_url) if isinstance(record, WalletNameRecord) and record.endpoint_url else None
+            if hostname and hostname not in hostnames:
+                hit, addresses = self._host_cache_get(hostname)
+                hostnames[hostname] = addresses if hit else None
+
+        lookups = [x for x in hostnames if hostnames[x] is None]
+        if lookups:
+            try:
+                answers = self._query_many([(hostname, qtype) for hostname in lookups for qtype in ('A', 'AAAA')], deadline=deadline)
+            except WalletNameTimeoutError:
+                answers = [(STATUS_DEADLINE, None)] * (len(lookups) * 2)
+
+            for index, hostname in enumerate(lookups):
+                host_answers = answers[index * 2:index * 2 + 2]
+                if [x for x in host_answers if x[0] == STATUS_DEADLINE]:
+                    # Out of time, currencies with this endpoint time out rather than come back unroutable
+                    hostnames[hostname] = WalletNameTimeoutError()
+                else:
+                    hostnames[hostname] = self._host_addresses(hostname, host_answers)
+
+        values = {}
+        fetches = []
+        for key, record in records.items():
+            if isinstance(record, Exception):
+                values[key] = record
+            elif record is None or not record.endpoint_url:
+                values[key] = self._record_result(record)
+            else:
+                addresses = hostnames.get(self._endpoint_lookup_host(record.endpoint_url))
+                if isinstance(addresses, WalletNameTimeoutError):
+                    values[key] = addresses
+                else:
+                    fetches.append((values, key, record, addresses, forwarded_for, deadline))
+
+        # The first fetch runs on the calling thread
+        threads = [threading.Thread(target=self._fetch_record_result, args=x, name='wnsresolver-fetch') for x in fetches[1:]]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        if fetches:
+            self._fetch_record_result(*fetches[0])
+        for thread in threads:
+            thread.join()
+
+        return values
+
+    def _fetch_record_result(self, values, key, record, addresses, forwarded_for, deadline):
+
+        try:
+            values[key] = self._record_result(record, addresses=addresses, forwarded_for=forwarded_for, deadline=deadline)
+        except Exception as e:
+            values[key] = e
+
+    def _check_currency(self, currency_list_str, currency):
+
         if not currency_list_str:
             raise WalletNameUnavailableError
 
         if not [x for x in currency_list_str.split() if x == currency]:
             raise WalletNameCurrencyUnavailableError
 
-        return resolver.resolve('_%s._wallet.%s' % (currency, name), 'TXT')
+    def save_snapshot(self, path, secret):
+
+        # Record and endpoint hostname caches to path, for load_snapshot on the next start. Returns entries written.
+        return snapshot.save(path, {'records': self.cache, 'hosts': self.host_cache}, secret)
+
+    def load_snapshot(self, path, secret):
+
+        # Entries of a save_snapshot file still within their TTL, returns {'loaded', 'expired', 'rejected'} counts
+        return snapshot.load(path, {'records': self.cache, 'hosts': self.host_cache}, secret)
+
+    def reload_context(self):
+
+        # Rebuild unbound contexts on next use, picking up resolv_conf and dnssec_root_key changes
+        self.ctx_pool.reload()
+        self.bulk_pool.reload()
+        with self._upstream_lock:
+            self._upstream_pools = None
 
-    def resolve(self, name, qtype):
+    def _build_context(self, forwarder=None):
+
+        start = timer() if self.metrics is not None else None
 
         ctx = ub_ctx()
-        ctx.resolvconf(self.resolv_conf)
+        if forwarder:
+            ctx.set_fwd(forwarder)
+        else:
+            ctx.resolvconf(self.resolv_conf)
+
+        if start is not None:
+            start = self._observe('context', start, outcome='ok')
 
         if not os.path.isfile(self.dnssec_root_key):
+            if start is not None:
+                self._observe('trust_anchor', start, outcome='missing')
             raise Exception('Trust anchor is missing or inaccessible')
         else:
             ctx.add_ta_file(self.dnssec_root_key)
 
-        status, result = ctx.resolve(name, rdatatype.from_text(qtype), RR_CLASS_IN)
+        if start is not None:
+            self._observe('trust_anchor', start, outcome='ok')
+
+        return ctx
+
+    def resolve(self, name, qtype, forwarded_for=None, timeout=None):
+
+        return self.resolve_result(name, qtype, forwarded_for=forwarded_for, timeout=timeout).value
+
+    def resolve_result(self, name, qtype, forwarded_for=None, timeout=None):
+
+        start = timer()
+        deadline = start + timeout if timeout is not None else None
+
+        hit, record = self._cache_get(name, qtype)
+        if hit:
+            return self._result(record, start, forwarded_for=forwarded_for, deadline=deadline)
+
+        status, result = self._query(name, qtype, deadline=deadline)
+        return self._process_result_detail(status, result, cache_key=(name, qtype), forwarded_for=forwarded_for, start=start, deadline=deadline)
+
+    def resolve_all(self, name, qtype, forwarded_for=None, timeout=None):
+
+        # Every record in the answer's RRset, in answer order, rather than only the first. [] without data.
+        deadline = timer() + timeout if timeout is not None else None
+        cache_key = (name, qtype, 'all')
+        hit, records = self._cache_get(name, qtype, cache_key=cache_key)
+
+        if not hit:
+            records = self._records(*self._query(name, qtype, deadline=deadline), cache_key=cache_key)
+
+        return [self._record_result(x, forwarded_for=forwarded_for, deadline=deadline) for x in records or []]
+
+    def _query(self, name, qtype, deadline=None):
+
+        upstreams = self._upstreams() if self.query_policy is not None else None
+
+        if upstreams:
+            start = timer() if self.metrics is not None else None
+            status, result = self._retried_query(name, qtype, upstreams, deadline=deadline)
+        elif deadline is not None:
+            start = timer() if self.metrics is not None else None
+            status, result = self._query_many([(name, qtype)], deadline=deadline, timed=False)[0]
+        else:
+            ctx = self.ctx_pool.shared()
+            start = timer() if self.metrics is not None else None
+            status, result = ctx.resolve(name, rr_type(qtype), RR_CLASS_IN)
+
+        if start is not None:
+            self._observe('query', start, qtype=qtype, outcome=self._query_outcome(status, result))
+
+        return status, result
+
+    def _cache_get(self, name, qtype, cache_key=None):
+
+        if self.cache is None:
+            return False, None
+
+        cache_key = cache_key or (name, qtype)
+
+        if self.metrics is None:
+            hit, record = self.cache.get(cache_key)
+        else:
+            start = timer()
+            hit, record = self.cache.get(cache_key)
+            self._observe('record_cache', start, qtype=qtype, outcome='hit' if hit else 'miss')
+
+        if hit and self.refresher is not None:
+            self.refresher.touch(cache_key, self._refresh)
+        return hit, record
+
+    def _refresh(self, cache_key):
+
+        # Run on a CacheRefresher worker: resolve cache_key again and replace its cache entry
+        status, result = self._query(*cache_key[:2])
+
+        start = timer() if self.metrics is not None else None
+        try:
+            # A failed refresh leaves the current entry to expire, and the stale one to be served
+            if self._upstream_failed(status, result):
+                raise WalletNameLookupError
+
+            if len(cache_key) > 2:
+                records = self._records(status, result, cache_key=cache_key)
+            else:
+                record = self._record(status, result, cache_key=cache_key)
+                records = [record] if record is not None else []
+        except Exception:
+            if start is not None:
+                self._observe('refresh', start, outcome='error')
+            raise
+
+        # Endpoint hostnames are resolved ahead too, the fetch itself still happens per request
+        for record in records:
+            hostname = self._endpoint_lookup_host(record.endpoint_url) if record.endpoint_url else None
+            if hostname and not self._host_cache_get(hostname)[0]:
+                self._hostname_addresses(hostname)
+
+        if start is not None:
+            self._observe('refresh', start, outcome='ok')
+
+    def _upstream_failed(self, status, result):
+
+        return status != 0 or getattr(result, 'rcode', RCODE_NOERROR) == RCODE_SERVFAIL
+
+    def _upstreams(self):
+
+        # Forwarder -> UnboundContextPool of contexts forwarding only to it, read from resolv_conf on first use
+        pools = self._upstream_pools
+        if pools is not None:
+            return pools
+
+        with self._upstream_lock:
+            if self._upstream_pools is None:
+                try:
+                    nameservers = read_nameservers(self.resolv_conf)
+                except (IOError, OSError):
+                    # No forwarders to choose between, unbound reports the missing resolv_conf itself
+                    nameservers = []
+
+                self._upstream_pools = OrderedDict(
+                    (x, UnboundContextPool(lambda forwarder=x: self._build_context(forwarder), size=self.ctx_pool.size)) for x in nameservers
+                )
+            return self._upstream_pools
+
+    def _retried_query(self, name, qtype, upstreams, deadline=None):
+
+        # Hedged attempts until one gets an answer, with a jittered backoff between them, within the policy's deadline
+        # and the caller's, whichever comes first
+        policy = self.query_policy
+        deadline = min(timer() + policy.deadline, deadline if deadline is not None else float('inf'))
+        attempt = 0
+
+        while True:
+            status, result = self._hedged_query(name, qtype, upstreams, deadline)
+            if not self._upstream_failed(status, result) or attempt >= policy.retries:
+                return status, result
+
+            delay = policy.backoff_delay(attempt)
+            if timer() + delay >= deadline:
+                return status, result
+
+            policy.retrying()
+            time.sleep(delay)
+            attempt += 1
+
+    def _hedged_query(self, name, qtype, upstreams, deadline):
+
+        # Best ranked forwarder first, the next ones too while answers are overdue, until a secure answer arrives
+        policy = self.query_policy
+        pending = policy.ranked(list(upstreams))
+        in_flight = OrderedDict()
+        answers = []
+        answer = (STATUS_DEADLINE, None)
+        hedge_at = None
+
+        def callback(upstream, status, result):
+            answers.append((upstream, status, result))
+
+        try:
+            while True:
+                now = timer()
+                if now >= deadline:
+                    return answer
+
+                if pending and (not in_flight or (hedge_at is not None and now >= hedge_at)):
+                    upstream = pending.pop(0)
+
+                    # Only the first query may wait for a context, a hedge skips a forwarder with none free
+                    status, query = self._send_query(upstreams[upstream], upstream, name, qtype, callback, blocking=not in_flight, timeout=deadline - now)
+                    if query is None:
+                        if status != 0 and answer[1] is None:
+                            answer = (status, None)
+                        continue
+                    if in_flight:
+                        policy.hedged()
+
+                    in_flight[upstream] = query
+                    delay = policy.hedge_after(upstream)
+                    hedge_at = now + delay if delay is not None else None
+                    continue
+
+                if not in_flight:
+                    return answer
+
+                timeout = deadline - now
+                if pending and hedge_at is not None:
+                    timeout = min(timeout, hedge_at - now)
+
+                contexts = dict((query[2].fd(), query[2]) for query in in_flight.values())
+                readable, _, _ = select.select(list(contexts), [], [], max(0.0, timeout))
+                for fd in readable:
+                    contexts[fd].process()
+
+                for upstream, status, result in answers:
+                    pool, generation, ctx, async_id, sent = in_flight.pop(upstream)
+                    pool.release(generation, ctx)
+
+                    failed = self._upstream_failed(status, result)
+                    policy.observed(upstream, timer() - sent, failed)
+
+                    if not failed:
+                        if result.secure and not result.bogus:
+                            return status, result
+
+                        # Insecure or bogus, wait on the queries in flight for a secure answer but send no more
+                        answer = (status, result)
+                        pending = []
+                    elif answer[1] is None:
+                        answer = (status, result)
+                del answers[:]
+        finally:
+            for upstream, (pool, generation, ctx, async_id, sent) in in_flight.items():
+                # Not waited for, its elapsed time still tells the ranking this forwarder is slow
+                ctx.cancel(async_id)
+                pool.release(generation, ctx)
+                policy.observed(upstream, timer() - sent)
+
+    def _send_query(self, pool, upstream, name, qtype, callback, blocking=True, timeout=None):
+
+        # (status, query), query is (pool, generation, ctx, async_id, sent) or None when it could not be submitted,
+        # including when no context came free within timeout seconds
+        acquired = pool.acquire(blocking=blocking, timeout=timeout)
+        if acquired is None:
+            return 0, None
+
+        generation, ctx = acquired
+        try:
+            status, async_id = ctx.resolve_async(name, upstream, callback, rr_type(qtype), RR_CLASS_IN)
+        except Exception:
+            pool.release(generation, ctx)
+            raise
+
+        if status != 0:
+            pool.release(generation, ctx)
+            self.query_policy.observed(upstream, 0.0, True)
+            return status, None
+        return status, (pool, generation, ctx, async_id, timer())
+
+    def _query_many(self, queries, deadline=None, timed=True):
+
+        # Issue every (name, qtype) query on one context and wait for all answers. Queries still unanswered at deadline
+        # are cancelled and get STATUS_DEADLINE, so the pooled context goes back with nothing outstanding.
+        answers = [None] * len(queries)
+        async_ids = {}
+
+        def callback(index, status, result):
+            answers[index] = (status, result)
+
+        acquired = self.ctx_pool.acquire(timeout=remaining(deadline))
+        if acquired is None:
+            # Every pooled context stayed busy until the deadline
+            raise WalletNameTimeoutError
+
+        generation, ctx = acquired
+        try:
+            for index, (name, qtype) in enumerate(queries):
+                status, async_id = self._submit_query(ctx, name, qtype, callback, index, timed=timed)
+                if status != 0:
+                    answers[index] = (status, None)
+                else:
+                    async_ids[index] = async_id
+
+            if deadline is None:
+                ctx.wait()
+                return answers
+
+            while None in answers:
+                left = deadline - timer()
+                if left <= 0:
+                    for index, answer in enumerate(answers):
+                        if answer is None:
+                            ctx.cancel(async_ids[index])
+                            answers[index] = (STATUS_DEADLINE, None)
+                    break
+                self._process_answers(ctx, left)
+        finally:
+            self.ctx_pool.release(generation, ctx)
+
+        return answers
+
+    def _submit_query(self, ctx, name, qtype, callback, mydata, timed=True):
+
+        if self.metrics is not None and timed:
+            callback = self._timed_callback(qtype, callback)
+
+        return ctx.resolve_async(name, mydata, callback, rr_type(qtype), RR_CLASS_IN)
+
+    def _timed_callback(self, qtype, callback):
+
+        # Async queries are timed from submission until unbound delivers the answer
+        start = timer()
+
+        def timed_callback(mydata, status, result):
+            self._observe('query', start, qtype=qtype, outcome=self._query_outcome(status, result))
+            callback(mydata, status, result)
+
+        return timed_callback
+
+    def _observe(self, stage, start, **labels):
+
+        # Report a stage that began at start, returns its end time so consecutive stages can be chained
+        end = timer()
+        self.metrics.observe(stage, end - start, labels)
+        return end
+
+    def _query_outcome(self, status, result):
+
+        if status == STATUS_DEADLINE:
+            return 'timeout'
+        if status != 0:
+            return 'error'
+        if result.bogus:
+            return 'bogus'
+        if not result.secure:
+            return 'insecure'
+        if not result.havedata:
+            return 'nodata'
+        return 'secure'
+
+    def _process_answers(self, ctx, timeout=None):
+
+        # Block until unbound has answers ready, then run their callbacks
+        readable, _, _ = select.select([ctx.fd()], [], [], timeout)
+        if readable:
+            ctx.process()
+
+    def _process_result(self, status, result, cache_key=None, forwarded_for=None, deadline=None):
+
+        return self._record_result(self._record(status, result, cache_key=cache_key), forwarded_for=forwarded_for, deadline=deadline)
+
+    def _process_result_detail(self, status, result, cache_key=None, forwarded_for=None, start=None, deadline=None):
+
+        record = self._record(status, result, cache_key=cache_key)
+        return self._result(record, start, ttl=getattr(result, 'ttl', None), forwarded_for=forwarded_for, deadline=deadline)
+
+    def _result(self, record, start, ttl=None, forwarded_for=None, deadline=None):
+
+        # Only secure answers get this far, insecure and bogus ones raise in _record
+        kind = None
+        if record is not None:
+            kind = record.kind
+            if kind == ENDPOINT_URL:
+                # Endpoint responses are fetched on every resolution and must not be cached for the record's TTL
+                ttl = 0
+            elif ttl is None and record.expires is not None:
+                # Cache hit, whatever remains of the answer's TTL
+                ttl = max(0, int(record.expires - time.time()))
+
+        value = self._record_result(record, forwarded_for=forwarded_for, deadline=deadline)
+        return WalletNameResult(value, kind, ttl, True, ICANN, timer() - start if start is not None else 0.0)
+
+    def _record(self, status, result, cache_key=None):
+
+        if self.refresher is not None and cache_key and self._upstream_failed(status, result):
+            # Upstream failing, serve the last good record while there is one
+            stale = self.refresher.stale(cache_key)
+            if stale is not None:
+                return stale
+
+        # Insecure, bogus and failed lookups raise here and are never cached
+        txt = self._record_value(status, result)
+        record = self._classified(txt, getattr(result, 'ttl', 0)) if txt is not None else None
+
+        if cache_key and self.cache is not None:
+            self.cache.set(cache_key, record, getattr(result, 'ttl', 0))
+        if cache_key and self.refresher is not None:
+            self.refresher.stored(cache_key, record, getattr(result, 'ttl', 0))
+
+        return record
+
+    def _records(self, status, result, cache_key=None):
+
+        # _record for every record in the RRset, cached as one list
+        if self.refresher is not None and cache_key and self._upstream_failed(status, result):
+            stale = self.refresher.stale(cache_key)
+            if stale is not None:
+                return stale
+
+        records = [self._classified(x, getattr(result, 'ttl', 0)) for x in self._record_values(status, result)]
+
+        if cache_key and self.cache is not None:
+            self.cache.set(cache_key, records or None, getattr(result, 'ttl', 0))
+        if cache_key and self.refresher is not None:
+            self.refresher.stored(cache_key, records or None, getattr(result, 'ttl', 0))
+
+        return records
+
+    def _classified(self, txt, ttl):
+
+        if self.metrics is None:
+            record = self._classify_record(txt)
+        else:
+            start = timer()
+            record = self._classify_record(txt)
+            self._observe('classify', start, outcome='ok', kind=record.kind)
+
+        if ttl:
+            record.expires = time.time() + ttl
+        return record
+
+    def _record_result(self, record, addresses=None, forwarded_for=None, deadline=None):
+
+        # Endpoint URLs are cached as records, the BIP32/BIP70 fetch itself always happens
+        if record is None:
+            return None
+
+        value, endpoint_url = record
+        if not endpoint_url:
+            return value
+
+        start = timer() if self.metrics is not None else None
+        stage = 'endpoint_host'
+
+        try:
+            # Identify localhost or link_local/multicast/private IPs and return without issuing a GET.
+            lookup_url, return_data = self.get_endpoint_host(endpoint_url, addresses=addresses, deadline=deadline)
+
+            if start is not None:
+                start = self._observe(stage, start, outcome='routable' if lookup_url else 'unroutable')
+            stage = 'endpoint_fetch'
+
+            if return_data:
+                return return_data
+
+            # Without an explicit client address, fall back to the current Flask request, if any
+            if forwarded_for is None:
+                forwarded_for = request_client_address()
+
+            # Try the URL. Returning response text and expect a Bitcoin URI as delivered from Addressimo.
+            headers = {'X-Forwarded-For': '%s' % forwarded_for} if forwarded_for else {}
+            if deadline is None:
+                text = self.endpoint_client.get(lookup_url, headers=headers)
+            else:
+                text = self.endpoint_client.get(lookup_url, headers=headers, deadline=deadline)
+
+            if start is not None:
+                self._observe(stage, start, outcome='ok')
+            return text
+        except Exception:
+            if deadline is not None and timer() >= deadline:
+                # Out of time, not an endpoint failure the requester could handle with the URL
+                if start is not None:
+                    self._observe(stage, start, outcome='timeout')
+                raise WalletNameTimeoutError
+
+            if start is not None:
+                self._observe(stage, start, outcome='error')
+
+            # Return base64 decoded value if we cannot perform a GET on the URL to allow requester to handle.
+            return endpoint_url
+
+    def _record_value(self, status, result):
+
+        if not self._has_data(status, result):
+            return None
+
+        # We got data, the first record's character-strings joined
+        return txt_value(result.data.as_raw_data()[0])
+
+    def _record_values(self, status, result):
+
+        if not self._has_data(status, result):
+            return []
+        return [txt_value(x) for x in result.data.as_raw_data()]
+
+    def _has_data(self, status, result):
+
+        if status == STATUS_DEADLINE:
+            raise WalletNameTimeoutError
         if status != 0:
             raise WalletNameLookupError
 
         if not result.secure or result.bogus:
             raise WalletNameLookupInsecureError
-        elif not result.havedata:
-            return None
-        else:
-            # We got data
-            txt = result.data.as_domain_list()
+        return result.havedata
 
-            # Reference implementation for serving BIP32 and BIP70 requests
-            try:
-                # BIP32/BIP70 URL will be base64 encoded. Some wallet addresses fail decode.
-                # If it fails, assume wallet address or unknown and return
-                b64txt = b64decode(txt[0])
-            except:
-                return txt[0]
-
-            # Fully qualified bitcoin URI, return as is
-            if b64txt.startswith('bitcoin:'):
-                return b64txt
-            elif re.match(r'^https?:\/\/', b64txt):
-                try:
-                    # Identify localhost or link_local/multicast/private IPs and return without issuing a GET.
-                    lookup_url, return_data = WalletNameResolver.get_endpoint_host(b64txt)
-
-                    if return_data:
-                        return return_data
-
-                    # Try the URL. Returning response.text and expect a Bitcoin URI as delivered from Addressimo.
-                    response = requests.get(lookup_url, headers={'X-Forwarded-For': '%s' % request.access_route[0]})
-                    return response.text
-                except Exception:
-                    # Return base64 decoded value if we cannot perform a GET on the URL to allow requester to handle.
-                    return b64txt
-            else:
-                # If you made it this far, assume wallet address and return
-                return txt[0]
+    def _classify_record(self, txt):
 
-    @staticmethod
-    def get_endpoint_host(b64txt):
+        # Returns a WalletNameRecord, which unpacks as (value, endpoint_url)
+        return classify_record(txt)
+
+    def get_endpoint_host(self, b64txt, addresses=None, deadline=None):
         url = urlparse(b64txt)
 
         if url.hostname == 'localhost':
@@ -179,40 +910,117 @@ class WalletNameResolver:
         if not url.hostname:
             return None, b64txt
 
-        no_route_ip_range_list = iptools.IpRangeList(
-            iptools.ipv4.LOCALHOST,
-            iptools.ipv4.PRIVATE_NETWORK_10,
-            iptools.ipv4.PRIVATE_NETWORK_172_16,
-            iptools.ipv4.PRIVATE_NETWORK_192_168,
-            iptools.ipv4.LINK_LOCAL,
-            iptools.ipv4.MULTICAST,
-            iptools.ipv6.LOCALHOST,
-            iptools.ipv6.PRIVATE_NETWORK,
-            iptools.ipv6.LINK_LOCAL,
-            iptools.ipv6.MULTICAST
-        )
-
         if not iptools.ipv4.validate_ip(url.hostname) and not iptools.ipv6.validate_ip(url.hostname):
             # This will catch hostnames, determine if reachable, and return as a URL to fetch or raw value to return.
-            try:
-                socket.gethostbyname(url.hostname)
-                return url.geturl(), None
-            except socket.gaierror:
-                return None, b64txt
+            if addresses is None:
+                addresses = self._hostname_addresses(url.hostname, deadline=deadline)
+        else:
+            addresses = [url.hostname]
+
+        return self._endpoint_route(url, b64txt, addresses)
+
+    def _endpoint_lookup_host(self, b64txt):
+
+        # Hostname of an endpoint URL whose addresses must be resolved before it can be routed, if any
+        hostname = urlparse(b64txt).hostname
+        if not hostname or hostname == 'localhost' or iptools.ipv4.validate_ip(hostname) or iptools.ipv6.validate_ip(hostname):
+            return None
+        return hostname
+
+    def _host_cache_get(self, hostname):
+
+        start = timer() if self.metrics is not None else None
+        hit, addresses = self.host_cache.get(hostname)
+
+        if start is not None:
+            self._observe('host_cache', start, outcome='hit' if hit else 'miss')
+        return hit, addresses or []
+
+    def _hostname_addresses(self, hostname, deadline=None):
+
+        hit, addresses = self._host_cache_get(hostname)
+        if hit:
+            return addresses
+
+        # A and AAAA go out together on a pooled context, sharing unbound's cache instead of a libc lookup
+        answers = self._query_many([(hostname, 'A'), (hostname, 'AAAA')], deadline=deadline)
+        if [x for x in answers if x[0] == STATUS_DEADLINE]:
+            raise WalletNameTimeoutError
+        return self._host_addresses(hostname, answers)
 
-        elif url.hostname in no_route_ip_range_list:
+    def _host_addresses(self, hostname, answers):
+
+        # (status, result) answers for A and AAAA, in that order
+        addresses = []
+        ttls = []
+
+        for (status, result), family in zip(answers, (socket.AF_INET, socket.AF_INET6)):
+            if status != 0 or result is None or result.bogus:
+                # Failed or forged answers leave the hostname unreachable, and are not cached
+                return []
+
+            # Endpoint hostnames are rarely signed, insecure answers are accepted
+            if result.havedata:
+                addresses.extend(socket.inet_ntop(family, x) for x in result.data.as_raw_data())
+                ttls.append(result.ttl)
+
+        # Hostnames without addresses are cached for the cache's negative_ttl
+        addresses = sorted(set(addresses))
+        self.host_cache.set(hostname, addresses or None, min(ttls) if ttls else 0)
+        return addresses
+
+    def _endpoint_route(self, url, b64txt, addresses):
+
+        if not addresses or [x for x in addresses if x in self.no_route_index]:
             return None, b64txt
 
         return url.geturl(), None
 
     def preprocess_name(self, name):
 
+        # UTF-8 encoded names are accepted on Python 3 too
+        if not isinstance(name, str) and isinstance(name, bytes):
+            name = name.decode('utf-8')
+
         # Process Names in E-Mail Address Format (RFCs 2822 & 6530)
-        if '@' in name:
-            localpart, domain = name.split('@', 1)
-            name = '%s.%s' % (hashlib.sha224(localpart).hexdigest(), domain)
+        if '@' not in name:
+            return name
+
+        qname = self._names.get(name)
+        if qname is None:
+            qname = self._email_qname(name)
+            with self._names_lock:
+                self._names[name] = qname
+                if len(self._names) > self.name_cache_size:
+                    self._names.popitem(last=False)
+
+        return qname
+
+    def preprocess_names(self, names):
+
+        # preprocess_name over a batch, each distinct name is processed once
+        processed = {}
+        qnames = []
+        for name in names:
+            if name not in processed:
+                processed[name] = self.preprocess_name(name)
+            qnames.append(processed[name])
+        return qnames
+
+    def _email_qname(self, name):
+
+        localpart, domain = name.split('@', 1)
+
+        # Internationalized localparts are hashed as NFC-normalized UTF-8, so composed and decomposed forms match
+        if isinstance(localpart, bytes):
+            try:
+                localpart = localpart.decode('utf-8')
+            except UnicodeDecodeError:
+                return '%s.%s' % (hashlib.sha224(localpart).hexdigest(), domain)
+        localpart = unicodedata.normalize('NFC', localpart).encode('utf-8')
 
-        return name
+        # The domain is left as given, like any other name
+        return '%s.%s' % (hashlib.sha224(localpart).hexdigest(), domain)
 
 
 if __name__ == '__main__':
@@ -224,4 +1032,4 @@ if __name__ == '__main__':
         password='rpcpassword'
     )
     result = wn_resolver.resolve_wallet_name('bip70.netki.xyz', 'btc')
-    print result
+    print(result)
@@ -0,0 +1,307 @@
+__author__ = 'mdavid'
+
+# Requires Python 3.5+ and the aiohttp module for BIP32/BIP70 endpoint fetches
+
+import asyncio
+
+from collections import OrderedDict
+
+from . import WalletNameResolver, WalletNameTimeoutError, WalletNameUnavailableError
+from .endpoint import EndpointResponseTooLargeError
+from .instrumentation import timer
+
+
+class AsyncWalletNameResolver:
+
+    def __init__(self, resolv_conf='/etc/resolv.conf', dnssec_root_key='/usr/local/etc/unbound/root.key', nc_host=None, nc_port=8336, nc_rpcuser=None, nc_rpcpassword=None, nc_tmpdir=None, optimistic=True, cache=None, endpoint_client=None, http_session=None, metrics=None, refresher=None):
+
+        # Configuration, record processing and Namecoin handling are shared with the sync resolver
+        self.resolver = WalletNameResolver(
+            resolv_conf=resolv_conf,
+            dnssec_root_key=dnssec_root_key,
+            nc_host=nc_host,
+            nc_port=nc_port,
+            nc_rpcuser=nc_rpcuser,
+            nc_rpcpassword=nc_rpcpassword,
+            nc_tmpdir=nc_tmpdir,
+            optimistic=optimistic,
+            cache=cache,
+            endpoint_client=endpoint_client,
+            metrics=metrics,
+            refresher=refresher
+        )
+
+        self.http_session = http_session
+        self._endpoint_fetches = {}
+        self._fetches_loop = None
+        self._ctx = None
+        self._loop = None
+
+        # Loop a session built here belongs to, a caller's http_session is left to the caller
+        self._http_loop = None
+
+    def set_namecoin_options(self, host=None, port=8336, user=None, password=None, tmpdir=None):
+
+        self.resolver.set_namecoin_options(host=host, port=port, user=user, password=password, tmpdir=tmpdir)
+
+    def preprocess_name(self, name):
+
+        return self.resolver.preprocess_name(name)
+
+    async def resolve_available_currencies(self, name, timeout=None):
+
+        return await self._within(self._resolve_available_currencies(name), timeout)
+
+    async def _resolve_available_currencies(self, name):
+
+        if not name:
+            raise AttributeError('resolve_wallet_name requires both name and currency')
+
+        if name.endswith('.bit'):
+            # Namecoin backend is blocking, keep it off the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, self.resolver.resolve_available_currencies, name)
+
+        # Resolve Top-Level Available Currencies
+        currency_list_str = await self.resolve('_wallet.%s' % self.preprocess_name(name), 'TXT')
+        if not currency_list_str:
+            return []
+        return currency_list_str.split()
+
+    async def resolve_wallet_name(self, name, currency, forwarded_for=None, timeout=None):
+
+        return await self._within(self._resolve_wallet_name(name, currency, forwarded_for), timeout)
+
+    async def _resolve_wallet_name(self, name, currency, forwarded_for=None):
+
+        if not name or not currency:
+            raise AttributeError('resolve_wallet_name requires both name and currency')
+
+        if name.endswith('.bit'):
+            # Namecoin backend is blocking, keep it off the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, self.resolver.resolve_wallet_name, name, currency, forwarded_for)
+
+        name = self.preprocess_name(name)
+        list_query = ('_wallet.%s' % name, 'TXT')
+        currency_query = ('_%s._wallet.%s' % (currency, name), 'TXT')
+
+        if self.resolver.optimistic:
+            # Both lookups are in flight together, the currency record is only used once the currency is listed
+            currency_record = asyncio.ensure_future(self._lookup(*currency_query))
+            try:
+                self.resolver._check_currency(await self._record_result(await self._lookup(*list_query)), currency)
+            except BaseException:
+                currency_record.cancel()
+                raise
+            return await self._record_result(await currency_record, forwarded_for=forwarded_for)
+
+        self.resolver._check_currency(await self.resolve(*list_query), currency)
+        return await self.resolve(*currency_query, forwarded_for=forwarded_for)
+
+    async def resolve_all_currencies(self, name, forwarded_for=None, timeout=None):
+
+        return await self._within(self._resolve_all_currencies(name, forwarded_for), timeout)
+
+    async def _resolve_all_currencies(self, name, forwarded_for=None):
+
+        # {currency: address or exception}, every currency record is resolved concurrently once the list is known
+        if not name:
+            raise AttributeError('resolve_all_currencies requires a name')
+
+        if name.endswith('.bit'):
+            # Namecoin backend is blocking, keep it off the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, self.resolver.resolve_all_currencies, name, forwarded_for)
+
+        name = self.preprocess_name(name)
+        currency_list_str = await self.resolve('_wallet.%s' % name, 'TXT')
+        if not currency_list_str:
+            raise WalletNameUnavailableError
+
+        currencies = list(OrderedDict.fromkeys(currency_list_str.split()))
+        values = await asyncio.gather(*[
+            self.resolve('_%s._wallet.%s' % (currency, name), 'TXT', forwarded_for=forwarded_for) for currency in currencies
+        ], return_exceptions=True)
+        return dict(zip(currencies, values))
+
+    async def resolve(self, name, qtype, forwarded_for=None, timeout=None):
+
+        return await self._within(self._resolve(name, qtype, forwarded_for), timeout)
+
+    async def _resolve(self, name, qtype, forwarded_for=None):
+
+        return await self._record_result(await self._lookup(name, qtype), forwarded_for=forwarded_for)
+
+    async def _within(self, coro, timeout=None):
+
+        # timeout in seconds for the whole resolution. Running out cancels it, which cancels its outstanding unbound
+        # queries and HTTP requests. Endpoint fetches other callers share are left to finish for them.
+        if timeout is None:
+            return await coro
+
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            raise WalletNameTimeoutError
+
+    async def _lookup(self, name, qtype):
+
+        hit, record = self.resolver._cache_get(name, qtype)
+        if hit:
+            return record
+
+        status, result = await self._query(name, qtype)
+        return self.resolver._record(status, result, cache_key=(name, qtype))
+
+    async def _record_result(self, record, forwarded_for=None):
+
+        if record is None:
+            return None
+
+        value, endpoint_url = record
+        if not endpoint_url:
+            return value
+
+        start = timer() if self.resolver.metrics is not None else None
+        stage = 'endpoint_host'
+
+        try:
+            # Identify localhost or link_local/multicast/private IPs and return without issuing a GET.
+            lookup_url, return_data = await self.get_endpoint_host(endpoint_url)
+
+            if start is not None:
+                start = self.resolver._observe(stage, start, outcome='routable' if lookup_url else 'unroutable')
+            stage = 'endpoint_fetch'
+
+            if return_data:
+                return return_data
+
+            # Try the URL. Returning response text and expect a Bitcoin URI as delivered from Addressimo.
+            text = await self._fetch_endpoint(lookup_url, forwarded_for=forwarded_for)
+
+            if start is not None:
+                self.resolver._observe(stage, start, outcome='ok')
+            return text
+        except Exception:
+            if start is not None:
+                self.resolver._observe(stage, start, outcome='error')
+
+            # Return base64 decoded value if we cannot perform a GET on the URL to allow requester to handle.
+            return endpoint_url
+
+    async def _fetch_endpoint(self, url, forwarded_for=None):
+
+        client = self.resolver.endpoint_client
+        if client.cache is not None:
+            hit, text = client.cache.get(url)
+            if hit:
+                return text
+
+        # Identical concurrent fetches on one event loop share one request, the first caller's headers are sent
+        loop = asyncio.get_event_loop()
+        if self._fetches_loop is not loop:
+            self._endpoint_fetches = {}
+            self._fetches_loop = loop
+
+        fetches = self._endpoint_fetches
+        fetch = fetches.get(url)
+        if fetch is None:
+            headers = {'X-Forwarded-For': '%s' % forwarded_for} if forwarded_for else {}
+            fetch = fetches[url] = asyncio.ensure_future(self._get_endpoint(url, headers))
+            fetch.add_done_callback(lambda _: fetches.pop(url, None))
+
+        # A cancelled caller must not cancel the fetch other callers are waiting on
+        return await asyncio.shield(fetch)
+
+    async def _get_endpoint(self, url, headers):
+
+        client = self.resolver.endpoint_client
+        async with self._get_http_session().get(url, headers=headers) as response:
+            # A single read only returns what is buffered so far, the body is read to its end
+            body = b''
+            async for chunk in response.content.iter_chunked(8192):
+                body += chunk
+                if len(body) > client.max_response_size:
+                    raise EndpointResponseTooLargeError('Endpoint response exceeds %d bytes' % client.max_response_size)
+
+            text = body.decode(response.charset or 'utf-8', 'replace')
+            client.cache_response(url, text, response.headers.get('Cache-Control'), status=response.status)
+            return text
+
+    async def get_endpoint_host(self, b64txt):
+
+        hostname = self.resolver._endpoint_lookup_host(b64txt)
+        if not hostname:
+            # No hostname lookup required, the sync checks never block
+            return self.resolver.get_endpoint_host(b64txt)
+
+        hit, addresses = self.resolver._host_cache_get(hostname)
+        if not hit:
+            # A and AAAA in parallel on the event loop's unbound context
+            answers = await asyncio.gather(self._query(hostname, 'A'), self._query(hostname, 'AAAA'))
+            addresses = self.resolver._host_addresses(hostname, answers)
+
+        return self.resolver.get_endpoint_host(b64txt, addresses=addresses)
+
+    async def _query(self, name, qtype):
+
+        ctx = self._get_context()
+        future = self._loop.create_future()
+
+        def callback(future, status, result):
+            if not future.done():
+                future.set_result((status, result))
+
+        status, async_id = self.resolver._submit_query(ctx, name, qtype, callback, future)
+        if status != 0:
+            return status, None
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            ctx.cancel(async_id)
+            raise
+
+    def _get_context(self):
+
+        loop = asyncio.get_event_loop()
+        if self._ctx is None:
+            self._ctx = self.resolver._build_context()
+        elif loop is self._loop:
+            return self._ctx
+        elif not self._loop.is_closed():
+            # Used from another event loop, such as a later asyncio.run(), the context and its cache move over
+            self._loop.remove_reader(self._ctx.fd())
+
+        # unbound answers are delivered when its fd is readable, process them on the event loop
+        self._loop = loop
+        self._loop.add_reader(self._ctx.fd(), self._ctx.process)
+        return self._ctx
+
+    def _get_http_session(self):
+
+        loop = asyncio.get_event_loop()
+        if self._http_loop is not None and self._http_loop is not loop:
+            # Built for an earlier event loop it cannot be used from, dropped with that loop's connections
+            self.http_session = None
+            self._http_loop = None
+
+        if self.http_session is None:
+            # Same timeouts and per-host connection limits as the sync EndpointClient
+            import aiohttp
+            client = self.resolver.endpoint_client
+            self._http_loop = loop
+            self.http_session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=client.connect_timeout, sock_read=client.read_timeout),
+                connector=aiohttp.TCPConnector(limit_per_host=client.pool_maxsize)
+            )
+        return self.http_session
+
+    async def close(self):
+
+        if self._ctx is not None:
+            self._loop.remove_reader(self._ctx.fd())
+            self._ctx = None
+
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+            self._http_loop = None
@@ -0,0 +1,217 @@
+__author__ = 'mdavid'
+
+from collections import deque
+
+
+class BulkResolution:
+
+    def __init__(self, resolver, pairs, max_in_flight=64, ordered=False, forwarded_for=None):
+
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+
+        self.resolver = resolver
+        self.pairs = enumerate(pairs)
+        self.max_in_flight = max_in_flight
+        self.ordered = ordered
+        self.forwarded_for = forwarded_for
+
+        # _wallet.<name> lookups shared by every currency of a name: qname -> [waiting items] or ('done', value, error)
+        self.currency_lists = {}
+
+        # Endpoint hostname lookups in flight: hostname -> [A answer, AAAA answer, [(query, record) waiting]]
+        self.host_lookups = {}
+
+        self.active = 0
+        self.query_id = 0
+        self.queries = {}
+        self.answers = []
+        self.finished = deque()
+        self.buffered = {}
+        self.next_index = 0
+        self.exhausted = False
+
+    def __iter__(self):
+
+        # The batch holds its context for as long as the caller iterates. It comes from the resolver's bulk_pool, so the
+        # resolver's other callers, including the loop body itself, never wait on it.
+        pool = self.resolver.bulk_pool
+        generation, ctx = pool.acquire()
+        try:
+            while True:
+                self._start_items(ctx)
+
+                while self.finished:
+                    yield self.finished.popleft()
+
+                if not self.queries:
+                    if self.exhausted and not self.active:
+                        break
+                    continue
+
+                self.resolver._process_answers(ctx)
+                self._handle_answers(ctx)
+        finally:
+            # Abandoned iteration, do not leave queries outstanding on a pooled context
+            for async_id, name, query in self.queries.values():
+                ctx.cancel(async_id)
+            pool.release(generation, ctx)
+
+    def _start_items(self, ctx):
+
+        while not self.exhausted and self.active < self.max_in_flight:
+            try:
+                index, (name, currency) = next(self.pairs)
+            except StopIteration:
+                self.exhausted = True
+                return
+
+            item = (index, name, currency)
+            self.active += 1
+
+            if not name or not currency:
+                self._finish(item, AttributeError('resolve_wallet_name requires both name and currency'))
+                continue
+
+            if name.endswith('.bit'):
+                # Namecoin backend has no async interface, resolve inline
+                try:
+                    self._finish(item, self.resolver.resolve_wallet_name(name, currency))
+                except Exception as e:
+                    self._finish(item, e)
+                continue
+
+            qname = self.resolver.preprocess_name(name)
+            entry = self.currency_lists.get(qname)
+
+            if entry is None:
+                self.currency_lists[qname] = [item]
+                self._lookup(ctx, '_wallet.%s' % qname, ('list', qname))
+            elif isinstance(entry, list):
+                entry.append(item)
+            else:
+                self._resolve_currency(ctx, item, qname, entry)
+
+    def _lookup(self, ctx, name, query):
+
+        hit, record = self.resolver._cache_get(name, 'TXT')
+        if hit:
+            self._on_record(ctx, query, record)
+            return
+
+        self._submit(ctx, name, 'TXT', query)
+
+    def _submit(self, ctx, name, qtype, query):
+
+        self.query_id += 1
+        status, async_id = self.resolver._submit_query(ctx, name, qtype, self._callback, self.query_id)
+        if status != 0:
+            self._on_answer(ctx, name, query, status, None)
+        else:
+            self.queries[self.query_id] = (async_id, name, query)
+
+    def _callback(self, query_id, status, result):
+
+        # Called from within ctx.process(), defer handling so errors never surface inside unbound
+        self.answers.append((query_id, status, result))
+
+    def _handle_answers(self, ctx):
+
+        answers, self.answers = self.answers, []
+        for query_id, status, result in answers:
+            if query_id in self.queries:
+                async_id, name, query = self.queries.pop(query_id)
+                self._on_answer(ctx, name, query, status, result)
+
+    def _on_answer(self, ctx, name, query, status, result):
+
+        if query[0] == 'host':
+            self._on_host_answer(ctx, name, query[1], status, result)
+            return
+
+        try:
+            record = self.resolver._record(status, result, cache_key=(name, 'TXT'))
+        except Exception as e:
+            self._on_value(ctx, query, None, e)
+            return
+
+        self._on_record(ctx, query, record)
+
+    def _on_record(self, ctx, query, record):
+
+        hostname = self.resolver._endpoint_lookup_host(record[1]) if record and record[1] else None
+        if hostname:
+            hit, addresses = self.resolver._host_cache_get(hostname)
+            if not hit:
+                # Endpoint hostnames are resolved on the batch's context too
+                self._lookup_host(ctx, hostname, query, record)
+                return
+        else:
+            addresses = None
+
+        self._on_value(ctx, query, self.resolver._record_result(record, addresses=addresses, forwarded_for=self.forwarded_for), None)
+
+    def _lookup_host(self, ctx, hostname, query, record):
+
+        lookup = self.host_lookups.get(hostname)
+        if lookup is not None:
+            lookup[2].append((query, record))
+            return
+
+        self.host_lookups[hostname] = [None, None, [(query, record)]]
+        self._submit(ctx, hostname, 'A', ('host', 0))
+        self._submit(ctx, hostname, 'AAAA', ('host', 1))
+
+    def _on_host_answer(self, ctx, hostname, index, status, result):
+
+        lookup = self.host_lookups[hostname]
+        lookup[index] = (status, result)
+        if lookup[0] is None or lookup[1] is None:
+            return
+
+        del self.host_lookups[hostname]
+        addresses = self.resolver._host_addresses(hostname, lookup[:2])
+        for query, record in lookup[2]:
+            self._on_value(ctx, query, self.resolver._record_result(record, addresses=addresses, forwarded_for=self.forwarded_for), None)
+
+    def _on_value(self, ctx, query, value, error):
+
+        if query[0] == 'list':
+            qname = query[1]
+            entry = ('done', value, error)
+
+            waiting, self.currency_lists[qname] = self.currency_lists[qname], entry
+            for item in waiting:
+                self._resolve_currency(ctx, item, qname, entry)
+        else:
+            self._finish(query[1], error or value)
+
+    def _resolve_currency(self, ctx, item, qname, entry):
+
+        _, currency_list_str, error = entry
+        if error:
+            self._finish(item, error)
+            return
+
+        try:
+            self.resolver._check_currency(currency_list_str, item[2])
+        except Exception as e:
+            self._finish(item, e)
+            return
+
+        self._lookup(ctx, '_%s._wallet.%s' % (item[2], qname), ('currency', item))
+
+    def _finish(self, item, value):
+
+        self.active -= 1
+        index, name, currency = item
+
+        if not self.ordered:
+            self.finished.append((name, currency, value))
+            return
+
+        # Hold completed items until every earlier input has been yielded
+        self.buffered[index] = (name, currency, value)
+        while self.next_index in self.buffered:
+            self.finished.append(self.buffered.pop(self.next_index))
+            self.next_index += 1
@@ -0,0 +1,130 @@
+__author__ = 'mdavid'
+
+import threading
+import time
+from collections import OrderedDict
+
+from .records import WalletNameRecord
+
+# Rough per-entry bookkeeping cost (dict slot, tuples, key object) used for the byte budget
+ENTRY_OVERHEAD = 128
+
+
+def estimate_size(value):
+
+    if value is None:
+        return 0
+    if isinstance(value, (tuple, list, WalletNameRecord)):
+        return sum(estimate_size(x) for x in value)
+    if isinstance(value, (int, float)):
+        return 8
+    return len(value)
+
+
+class ResultCache:
+
+    def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024, negative_ttl=300, max_ttl=86400):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+
+        # Returns (hit, value) so cached negative answers (None) are distinguishable from misses
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            expires, value, size = entry
+            if expires <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            # Most recently used entries live at the end
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value, ttl):
+
+        if value is None:
+            # Negative answers use the record's negative TTL, capped at negative_ttl
+            ttl = min(ttl, self.negative_ttl) if ttl else self.negative_ttl
+        else:
+            ttl = min(ttl or 0, self.max_ttl)
+
+        if ttl <= 0:
+            return
+
+        size = ENTRY_OVERHEAD + estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.time() + ttl, value, size)
+            self.bytes += size
+
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def entries(self):
+
+        # (key, value, expires) for every unexpired entry, least recently used first
+        now = time.time()
+        with self._lock:
+            return [(key, value, expires) for key, (expires, value, size) in self._entries.items() if expires > now]
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def _remove(self, key):
+
+        expires, value, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._entries)
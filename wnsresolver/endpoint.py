@@ -0,0 +1,135 @@
+__author__ = 'mdavid'
+
+import re
+import threading
+
+from .instrumentation import timer
+from .singleflight import SingleFlight, SingleFlightTimeoutError
+
+CACHE_CONTROL_MAX_AGE = re.compile(r'max-age\s*=\s*"?(\d+)')
+CACHE_CONTROL_NO_CACHE = re.compile(r'no-store|no-cache|private')
+
+
+class EndpointResponseTooLargeError(Exception):
+    pass
+
+class EndpointTimeoutError(Exception):
+    pass
+
+
+class EndpointClient:
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10, max_response_size=64 * 1024, pool_connections=10, pool_maxsize=10, session=None, cache=None, cache_ttl=5):
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_response_size = max_response_size
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+
+        # Opt-in micro-cache (a ResultCache) of endpoint responses keyed on URL, honoring Cache-Control
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+
+        self._session = session
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    @property
+    def session(self):
+
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+
+        # requests is only loaded once an endpoint is fetched
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Keep-alive connections are pooled per host, failed requests are not retried
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url, headers=None, deadline=None):
+
+        # deadline is an absolute instrumentation.timer() value the whole fetch must finish by
+        if self.cache is not None:
+            hit, text = self.cache.get(url)
+            if hit:
+                return text
+
+        # Identical concurrent fetches share one request with the first caller's headers. A caller waiting on another's
+        # fetch gives up at its own deadline, and fetches again if that one ran out of time first.
+        while True:
+            timeout = max(0.0, deadline - timer()) if deadline is not None else None
+            try:
+                return self._flight.do_within(timeout, url, self._fetch, url, headers, deadline)
+            except SingleFlightTimeoutError:
+                raise EndpointTimeoutError('Endpoint fetch deadline passed')
+            except EndpointTimeoutError:
+                if deadline is not None and timer() >= deadline:
+                    raise
+
+    def _fetch(self, url, headers=None, deadline=None):
+
+        timeout = (self.connect_timeout, self.read_timeout)
+        if deadline is not None:
+            remaining = deadline - timer()
+            if remaining <= 0:
+                raise EndpointTimeoutError('Endpoint fetch deadline passed')
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+
+        response = self.session.get(url, headers=headers, timeout=timeout, stream=True)
+        try:
+            content_length = response.headers.get('Content-Length')
+            if content_length and int(content_length) > self.max_response_size:
+                raise EndpointResponseTooLargeError('Endpoint response exceeds %d bytes' % self.max_response_size)
+
+            body = b''
+            for chunk in response.iter_content(8192):
+                body += chunk
+                if len(body) > self.max_response_size:
+                    raise EndpointResponseTooLargeError('Endpoint response exceeds %d bytes' % self.max_response_size)
+
+                # The read timeout applies per read, a slowly trickling response is cut off here
+                if deadline is not None and timer() >= deadline:
+                    raise EndpointTimeoutError('Endpoint fetch deadline passed')
+        finally:
+            # A fully read response hands its connection back to the pool, a partial one is discarded
+            response.close()
+
+        text = body.decode(response.encoding or 'utf-8', 'replace')
+        self.cache_response(url, text, response.headers.get('Cache-Control'), status=response.status_code)
+        return text
+
+    def cache_response(self, url, text, cache_control=None, status=200):
+
+        # Error responses are returned to the caller but never cached as a wallet address
+        if self.cache is None or not 200 <= status < 300:
+            return
+
+        ttl = self.cache_ttl
+        if cache_control:
+            if CACHE_CONTROL_NO_CACHE.search(cache_control):
+                return
+
+            max_age = CACHE_CONTROL_MAX_AGE.search(cache_control)
+            if max_age:
+                ttl = min(ttl, int(max_age.group(1)))
+
+        if ttl > 0:
+            self.cache.set(url, text, ttl)
+
+    def close(self):
+
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,109 @@
+__author__ = 'mdavid'
+
+import logging
+import threading
+import time
+
+# Monotonic where available, stage durations are reported in seconds
+timer = getattr(time, 'perf_counter', time.time)
+
+# Stages reported by WalletNameResolver, each with an outcome label:
+#   context        unbound context setup (ok)
+#   trust_anchor   trust anchor loading (ok, missing)
+#   record_cache   ResultCache lookup (hit, miss), labelled with qtype
+#   query          DNS query including DNSSEC validation (secure, insecure, bogus, nodata, error, timeout),
+#                  labelled with qtype
+#   classify       base64/URI classification (ok), labelled with kind (address, bitcoin_uri, endpoint_url)
+#   host_cache     endpoint hostname cache lookup (hit, miss)
+#   endpoint_host  endpoint reachability check (routable, unroutable, error, timeout)
+#   endpoint_fetch BIP32/BIP70 HTTP GET (ok, error, timeout)
+#   refresh        CacheRefresher background re-resolution of a hot record, after its query (ok, error)
+STAGES = ('context', 'trust_anchor', 'record_cache', 'query', 'classify', 'host_cache', 'endpoint_host', 'endpoint_fetch', 'refresh')
+
+
+class MetricsSink:
+
+    # Receives one observe() per completed stage, called from resolver threads and must not raise
+    def observe(self, stage, duration, labels):
+        pass
+
+
+class MultiSink(MetricsSink):
+
+    def __init__(self, *sinks):
+
+        self.sinks = sinks
+
+    def observe(self, stage, duration, labels):
+
+        for sink in self.sinks:
+            sink.observe(stage, duration, labels)
+
+
+class StatsSink(MetricsSink):
+
+    # In-process count and total duration per (stage, outcome), for reporting without a metrics backend
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, stage, duration, labels):
+
+        key = (stage, labels.get('outcome', ''))
+        with self._lock:
+            count, total = self._stats.get(key, (0, 0.0))
+            self._stats[key] = (count + 1, total + duration)
+
+    def snapshot(self):
+
+        # {(stage, outcome): (count, total seconds)}
+        with self._lock:
+            return dict(self._stats)
+
+
+class LoggingSink(MetricsSink):
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+
+        self.logger = logger or logging.getLogger('wnsresolver.metrics')
+        self.level = level
+
+    def observe(self, stage, duration, labels):
+
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        # key=value message for plain handlers, the same fields in extra for structured formatters
+        fields = dict(labels, stage=stage, duration_ms=round(duration * 1000, 3))
+        self.logger.log(
+            self.level,
+            ' '.join('%s=%s' % (key, fields[key]) for key in sorted(fields)),
+            extra={'wnsresolver': fields}
+        )
+
+
+class PrometheusSink(MetricsSink):
+
+    LABELS = ('stage', 'qtype', 'outcome', 'kind')
+    BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, registry=None, namespace='wnsresolver', buckets=BUCKETS):
+
+        # Requires the prometheus_client module
+        from prometheus_client import Histogram
+
+        kwargs = {'registry': registry} if registry is not None else {}
+        self.histogram = Histogram(
+            'stage_duration_seconds',
+            'Duration of wallet name resolution stages',
+            self.LABELS,
+            namespace=namespace,
+            buckets=buckets,
+            **kwargs
+        )
+
+    def observe(self, stage, duration, labels):
+
+        self.histogram.labels(stage, labels.get('qtype', ''), labels.get('outcome', ''), labels.get('kind', '')).observe(duration)
@@ -0,0 +1,81 @@
+__author__ = 'mdavid'
+
+import iptools
+from bisect import bisect_right
+
+# Addresses BIP32/BIP70 endpoints may never point at
+NO_ROUTE_RANGES = [
+    iptools.ipv4.LOCALHOST,
+    iptools.ipv4.PRIVATE_NETWORK_10,
+    iptools.ipv4.PRIVATE_NETWORK_172_16,
+    iptools.ipv4.PRIVATE_NETWORK_192_168,
+    iptools.ipv4.LINK_LOCAL,
+    iptools.ipv4.MULTICAST,
+    iptools.ipv6.LOCALHOST,
+    iptools.ipv6.PRIVATE_NETWORK,
+    iptools.ipv6.LINK_LOCAL,
+    iptools.ipv6.MULTICAST
+]
+
+IPV4_MAPPED_START, IPV4_MAPPED_END = [iptools.ipv6.ip2long(x) for x in iptools.ipv6.cidr2block(iptools.ipv6.IPV4_MAPPED)]
+
+
+class IpRangeIndex:
+
+    def __init__(self, ranges=NO_ROUTE_RANGES):
+
+        ipv4_blocks = []
+        ipv6_blocks = []
+
+        for cidr in ranges:
+            if iptools.ipv4.validate_ip(cidr):
+                ipv4_blocks.append((iptools.ipv4.ip2long(cidr),) * 2)
+            elif iptools.ipv4.validate_cidr(cidr):
+                ipv4_blocks.append(tuple(iptools.ipv4.ip2long(x) for x in iptools.ipv4.cidr2block(cidr)))
+            elif iptools.ipv6.validate_ip(cidr):
+                ipv6_blocks.append((iptools.ipv6.ip2long(cidr),) * 2)
+            elif iptools.ipv6.validate_cidr(cidr):
+                ipv6_blocks.append(tuple(iptools.ipv6.ip2long(x) for x in iptools.ipv6.cidr2block(cidr)))
+            else:
+                raise ValueError('Invalid IP address or CIDR block: %s' % cidr)
+
+        self.ranges = list(ranges)
+        self._ipv4_starts, self._ipv4_ends = self._merge(ipv4_blocks)
+        self._ipv6_starts, self._ipv6_ends = self._merge(ipv6_blocks)
+
+    @staticmethod
+    def _merge(blocks):
+
+        # Sorted, non-overlapping [start, end] intervals so a lookup is one binary search
+        starts = []
+        ends = []
+        for start, end in sorted(blocks):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    @staticmethod
+    def _search(starts, ends, value):
+
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def __contains__(self, ip):
+
+        # Drop any IPv6 zone index (fe80::1%eth0)
+        ip = ip.split('%', 1)[0]
+
+        if iptools.ipv4.validate_ip(ip):
+            return self._search(self._ipv4_starts, self._ipv4_ends, iptools.ipv4.ip2long(ip))
+
+        if iptools.ipv6.validate_ip(ip):
+            value = iptools.ipv6.ip2long(ip)
+            if IPV4_MAPPED_START <= value <= IPV4_MAPPED_END:
+                # ::ffff:a.b.c.d reaches the same host as a.b.c.d
+                return self._search(self._ipv4_starts, self._ipv4_ends, value - IPV4_MAPPED_START)
+            return self._search(self._ipv6_starts, self._ipv6_ends, value)
+
+        return False
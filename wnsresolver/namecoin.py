@@ -0,0 +1,105 @@
+__author__ = 'mdavid'
+
+import json
+import threading
+
+from .cache import ResultCache
+
+
+class NamecoinRPCError(Exception):
+
+    def __init__(self, message=None, code=0):
+        Exception.__init__(self, message)
+        self.message = message
+        self.code = code
+
+
+class NamecoinRPCResolver:
+
+    # Drop-in nc_name_resolver for bcresolver.NamecoinResolver, built once and shared across threads
+
+    def __init__(self, host, user, password, port, timeout=60, pool_maxsize=10, cache_ttl=10):
+
+        self.host = host if host else '127.0.0.1'
+        self.user = user if user else ''
+        self.password = password if password else ''
+        self.port = port if port else 8336
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+
+        # A wallet name lookup issues name_show for the same name per record, answer those from one round trip
+        self.cache_ttl = cache_ttl
+        self.cache = ResultCache(max_entries=1024)
+
+        self.url = 'http://%s:%d/' % (self.host, self.port)
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+
+        # requests is only loaded once namecoind is queried
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Keep-alive connections to namecoind, reused across lookups and threads
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0))
+        session.headers.update({
+            'User-Agent': 'bitcoin-json-rpc/0.3.50',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        })
+        if self.user and self.password:
+            session.auth = (self.user, self.password)
+        return session
+
+    def send(self, method, params):
+
+        import requests
+
+        try:
+            response = self.session.post(self.url, data=json.dumps({'method': method, 'params': params, 'id': 1}), timeout=self.timeout)
+        except requests.RequestException:
+            raise NamecoinRPCError('Unable to connect to Namecoin node', 500)
+
+        try:
+            result = response.json()
+        except ValueError:
+            raise NamecoinRPCError('Unable to parse namecoind rpc response', 500)
+
+        if result.get('error'):
+            raise NamecoinRPCError(result['error'].get('message', ''), int(result['error'].get('code', 0)))
+        return result.get('result')
+
+    def name_show(self, name):
+
+        hit, domain = self.cache.get(name)
+        if hit:
+            return domain
+
+        try:
+            domain = self.send('name_show', ['d/%s' % name])
+        except NamecoinRPCError as e:
+            # Name not found
+            if e.code != -4:
+                raise
+            domain = None
+
+        self.cache.set(name, domain, self.cache_ttl)
+        return domain
+
+    def close(self):
+
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,102 @@
+__author__ = 'mdavid'
+
+import threading
+from contextlib import contextmanager
+
+from .instrumentation import timer
+
+
+class UnboundContextPool:
+
+    def __init__(self, factory, size=1):
+
+        # size=None builds a context whenever none is idle, keeping as many as were ever busy at once
+        if size is not None and size < 1:
+            raise ValueError('UnboundContextPool size must be at least 1')
+
+        self.factory = factory
+        self.size = size
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._created = 0
+        self._generation = 0
+
+        # (generation, ctx) for blocking resolves, outside the checked out contexts
+        self._shared = None
+        self._shared_lock = threading.Lock()
+
+    @contextmanager
+    def context(self):
+
+        generation, ctx = self.acquire()
+        try:
+            yield ctx
+        finally:
+            self.release(generation, ctx)
+
+    def shared(self):
+
+        # Blocking ub_resolve calls run concurrently on one context, so it is never checked out. Built on first use and
+        # again after a reload.
+        with self._shared_lock:
+            if self._shared is None or self._shared[0] != self._generation:
+                self._shared = (self._generation, self.factory())
+            return self._shared[1]
+
+    def acquire(self, blocking=True, timeout=None):
+
+        # (generation, ctx), or None when every context is busy and not blocking, or still busy after timeout seconds
+        end = timer() + timeout if timeout is not None else None
+
+        with self._cond:
+            while not self._idle and self.size is not None and self._created >= self.size:
+                if not blocking:
+                    return None
+                if end is None:
+                    self._cond.wait()
+                    continue
+
+                remaining = end - timer()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            if self._idle:
+                return self._idle.pop()
+
+            # Reserve a slot before building so concurrent callers cannot exceed size
+            self._created += 1
+            generation = self._generation
+
+        try:
+            return generation, self.factory()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, generation, ctx):
+
+        with self._cond:
+            if generation == self._generation:
+                self._idle.append((generation, ctx))
+            else:
+                # Context was built with stale config, drop it and free the slot
+                self._created -= 1
+            self._cond.notify()
+
+    def reload(self):
+
+        # Idle contexts are dropped now, busy ones when they are released
+        with self._cond:
+            self._generation += 1
+            self._created -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def __len__(self):
+
+        with self._cond:
+            return self._created
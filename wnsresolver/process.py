@@ -0,0 +1,123 @@
+__author__ = 'mdavid'
+
+import multiprocessing
+
+from . import WalletNameResolver, request_client_address
+from .sharedcache import SharedResultCache
+
+# The worker process's resolver, built once by _init_worker
+_resolver = None
+
+
+def _init_worker(resolver_class, cache, resolver_args):
+
+    global _resolver
+    _resolver = resolver_class(cache=cache, **resolver_args)
+
+    try:
+        # Warm the shared unbound context the worker's lookups run on, a failure here surfaces on its first lookup instead
+        _resolver.ctx_pool.shared()
+    except Exception:
+        pass
+
+
+def _resolve_wallet_name(name, currency, forwarded_for, timeout=None):
+
+    return _resolver.resolve_wallet_name(name, currency, forwarded_for=forwarded_for, timeout=timeout)
+
+
+def _resolve_wallet_name_result(name, currency, forwarded_for, timeout=None):
+
+    return _resolver.resolve_wallet_name_result(name, currency, forwarded_for=forwarded_for, timeout=timeout)
+
+
+def _resolve_available_currencies(name, timeout=None):
+
+    return _resolver.resolve_available_currencies(name, timeout=timeout)
+
+
+def _resolve_all_currencies(name, forwarded_for, timeout=None):
+
+    return _resolver.resolve_all_currencies(name, forwarded_for=forwarded_for, timeout=timeout)
+
+
+def _resolve_pair(item):
+
+    name, currency, forwarded_for = item
+    try:
+        return name, currency, _resolver.resolve_wallet_name(name, currency, forwarded_for=forwarded_for)
+    except Exception as e:
+        return name, currency, e
+
+
+class ProcessPoolResolver:
+
+    # resolve_wallet_name spread across worker processes, each with its own WalletNameResolver and unbound context.
+    # Workers share one SharedResultCache, a name resolved in one worker is a cache hit in all of them.
+
+    def __init__(self, processes=None, cache=None, context=None, resolver_class=WalletNameResolver, **resolver_args):
+
+        # resolver_args are resolver_class keyword arguments, both must be picklable under the spawn start method
+        self.cache = cache if cache is not None else SharedResultCache()
+        self._owns_cache = cache is None
+
+        self.pool = (context or multiprocessing).Pool(processes, _init_worker, (resolver_class, self.cache, resolver_args))
+
+    def resolve_wallet_name(self, name, currency, forwarded_for=None, timeout=None):
+
+        # Workers have no Flask request context, the client address is taken here. timeout is applied in the worker.
+        if forwarded_for is None:
+            forwarded_for = request_client_address()
+        return self.pool.apply(_resolve_wallet_name, (name, currency, forwarded_for, timeout))
+
+    def resolve_wallet_name_result(self, name, currency, forwarded_for=None, timeout=None):
+
+        if forwarded_for is None:
+            forwarded_for = request_client_address()
+        return self.pool.apply(_resolve_wallet_name_result, (name, currency, forwarded_for, timeout))
+
+    def resolve_available_currencies(self, name, timeout=None):
+
+        return self.pool.apply(_resolve_available_currencies, (name, timeout))
+
+    def resolve_all_currencies(self, name, forwarded_for=None, timeout=None):
+
+        # Fanned out within one worker, its unbound context has every currency query in flight together
+        if forwarded_for is None:
+            forwarded_for = request_client_address()
+        return self.pool.apply(_resolve_all_currencies, (name, forwarded_for, timeout))
+
+    def resolve_many(self, pairs, ordered=False, chunksize=8, forwarded_for=None):
+
+        # Stream (name, currency, address or exception) for each input pair, in completion order unless ordered
+        if forwarded_for is None:
+            forwarded_for = request_client_address()
+
+        items = ((name, currency, forwarded_for) for name, currency in pairs)
+        if ordered:
+            return self.pool.imap(_resolve_pair, items, chunksize)
+        return self.pool.imap_unordered(_resolve_pair, items, chunksize)
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+        if self._owns_cache:
+            self.cache.close()
+
+    def terminate(self):
+
+        self.pool.terminate()
+        self.pool.join()
+
+        if self._owns_cache:
+            self.cache.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.close()
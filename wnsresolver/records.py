@@ -0,0 +1,145 @@
+__author__ = 'mdavid'
+
+import re
+import sys
+from base64 import b64decode
+
+ADDRESS = 'address'
+BITCOIN_URI = 'bitcoin_uri'
+ENDPOINT_URL = 'endpoint_url'
+
+ICANN = 'icann'
+NAMECOIN = 'namecoin'
+
+BITCOIN_URI_PREFIX = 'bitcoin:'
+ENDPOINT_URL_PATTERN = re.compile(r'^https?://')
+
+# Base64 of 'bitcoin:' and 'http' share these leading characters whatever follows, nothing else can decode to either
+BASE64_PREFIXES = ('Yml0Y29pbj', 'aHR0c')
+BASE64_PATTERN = re.compile(r'^[A-Za-z0-9+/]+={0,2}$')
+
+# Indexing a memoryview gives a one byte str on Python 2 and an int on Python 3
+if sys.version_info[0] < 3:
+    def _octet(view, offset):
+        return ord(view[offset])
+else:
+    def _octet(view, offset):
+        return view[offset]
+
+
+class WalletNameRecord(object):
+
+    # Classified TXT record. Unpacks and indexes as (value, endpoint_url) like the tuples records used to be.
+    # expires is the record's absolute expiry (time.time()), set once the DNS answer's TTL is known.
+    __slots__ = ('kind', 'value', 'endpoint_url', 'expires')
+
+    def __init__(self, kind, value, endpoint_url=None, expires=None):
+
+        self.kind = kind
+        self.value = value
+        self.endpoint_url = endpoint_url
+        self.expires = expires
+
+    def __iter__(self):
+
+        return iter((self.value, self.endpoint_url))
+
+    def __getitem__(self, index):
+
+        return (self.value, self.endpoint_url)[index]
+
+    def __len__(self):
+
+        return 2
+
+    def __eq__(self, other):
+
+        if isinstance(other, WalletNameRecord):
+            return (self.kind, self.value, self.endpoint_url) == (other.kind, other.value, other.endpoint_url)
+        return (self.value, self.endpoint_url) == other
+
+    def __ne__(self, other):
+
+        return not self == other
+
+    def __hash__(self):
+
+        return hash((self.value, self.endpoint_url))
+
+    def __reduce__(self):
+
+        return WalletNameRecord, (self.kind, self.value, self.endpoint_url, self.expires)
+
+    def __repr__(self):
+
+        return 'WalletNameRecord(%r, %r, %r)' % (self.kind, self.value, self.endpoint_url)
+
+
+class WalletNameResult(object):
+
+    # Resolved value with what a caller needs to cache it: record kind, TTL in seconds (0 for BIP32/BIP70 endpoint
+    # responses, None when unknown), DNSSEC validation, source (ICANN or NAMECOIN) and resolution time in seconds.
+    __slots__ = ('value', 'kind', 'ttl', 'secure', 'source', 'elapsed')
+
+    def __init__(self, value, kind=None, ttl=None, secure=False, source=ICANN, elapsed=0.0):
+
+        self.value = value
+        self.kind = kind
+        self.ttl = ttl
+        self.secure = secure
+        self.source = source
+        self.elapsed = elapsed
+
+    def __reduce__(self):
+
+        return WalletNameResult, (self.value, self.kind, self.ttl, self.secure, self.source, self.elapsed)
+
+    def __repr__(self):
+
+        return 'WalletNameResult(%r, kind=%r, ttl=%r, secure=%r, source=%r, elapsed=%.6f)' % (
+            self.value, self.kind, self.ttl, self.secure, self.source, self.elapsed
+        )
+
+
+def classify_record(txt):
+
+    # Reference implementation for serving BIP32 and BIP70 requests. BIP32/BIP70 URLs and bitcoin URIs may be base64
+    # encoded, only candidates that can decode to either are decoded.
+    if txt.startswith(BASE64_PREFIXES) and not len(txt) % 4 and BASE64_PATTERN.match(txt):
+        decoded = b64decode(txt)
+        if not isinstance(decoded, str):
+            try:
+                decoded = decoded.decode('utf-8')
+            except UnicodeDecodeError:
+                decoded = ''
+
+        if decoded.startswith(BITCOIN_URI_PREFIX):
+            return WalletNameRecord(BITCOIN_URI, decoded)
+        if ENDPOINT_URL_PATTERN.match(decoded):
+            return WalletNameRecord(ENDPOINT_URL, decoded, decoded)
+
+    # Wallet address or unencoded bitcoin URI, returned as is
+    return WalletNameRecord(BITCOIN_URI if txt.startswith(BITCOIN_URI_PREFIX) else ADDRESS, txt)
+
+
+def txt_value(rdata):
+
+    # TXT RDATA in wire format is one or more character-strings, each a length octet followed by its bytes. Values over
+    # 255 bytes are split across several, concatenated back here straight from the buffer.
+    view = memoryview(rdata)
+    size = len(view)
+    length = _octet(view, 0) if size else 0
+
+    if length + 1 >= size:
+        # A single character-string, nearly every wallet name record
+        value = view[1:length + 1].tobytes()
+    else:
+        value = bytearray()
+        offset = 0
+        while offset < size:
+            length = _octet(view, offset)
+            value += view[offset + 1:offset + 1 + length]
+            offset += length + 1
+        value = bytes(value)
+
+    return value if str is bytes else value.decode('utf-8', 'replace')
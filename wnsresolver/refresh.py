@@ -0,0 +1,174 @@
+__author__ = 'mdavid'
+
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+
+class _Entry(object):
+
+    __slots__ = ('value', 'hits', 'refresh_at', 'expires', 'queued')
+
+    def __init__(self, value, refresh_at, expires):
+
+        self.value = value
+        self.hits = 0
+        self.refresh_at = refresh_at
+        self.expires = expires
+        self.queued = False
+
+
+class CacheRefresher:
+
+    # Re-resolves hot records in the background once refresh_fraction of their TTL has passed, so frequently used wallet
+    # names are refreshed before they expire rather than by the request that finds them gone. An entry is hot when it
+    # had min_hits cache hits since it was last resolved. The last good value of each tracked entry is kept max_stale
+    # seconds past its expiry and served while upstream lookups fail.
+
+    def __init__(self, refresh_fraction=0.75, min_hits=2, max_entries=10000, workers=4, queue_size=256, max_stale=3600, retry_interval=10):
+
+        self.refresh_fraction = refresh_fraction
+        self.min_hits = min_hits
+        self.max_entries = max_entries
+        self.workers = workers
+        self.max_stale = max_stale
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        # Refreshes beyond queue_size are dropped, the entry is refreshed on its next hit or resolved again on expiry
+        self._queue = Queue(queue_size)
+        self._threads = []
+
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.dropped = 0
+        self.stale_served = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+    def stored(self, key, value, ttl):
+
+        # A freshly resolved value was cached for ttl seconds
+        if value is None or not ttl:
+            return
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            self._entries[key] = _Entry(value, now + ttl * self.refresh_fraction, now + ttl)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, key, refresh):
+
+        # Cache hit on key, queues refresh(key) once the entry is hot and due
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+
+            entry.hits += 1
+            if entry.queued or entry.hits < self.min_hits or time.time() < entry.refresh_at:
+                return
+
+            entry.queued = True
+            if not self._threads:
+                self._start()
+
+            try:
+                self._queue.put_nowait((refresh, key, entry.refresh_at))
+            except Full:
+                entry.queued = False
+                self.dropped += 1
+
+    def stale(self, key):
+
+        # Last good value for key while within max_stale of its expiry, else None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now > entry.expires + self.max_stale:
+                return None
+
+            self.stale_served += 1
+            return entry.value
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'tracked': len(self._entries),
+                'queued': self._queue.qsize(),
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'dropped': self.dropped,
+                'stale_served': self.stale_served,
+                'lag_seconds_total': self.lag_total,
+                'lag_seconds_max': self.lag_max
+            }
+
+    def close(self):
+
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _start(self):
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, name='wnsresolver-refresh')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            refresh, key, due = item
+            try:
+                refresh(key)
+            except Exception:
+                self._failed(key)
+            else:
+                self._refreshed(key, due)
+
+    def _refreshed(self, key, due):
+
+        # Refresh lag: how long past its refresh point the entry was resolved again
+        lag = max(0.0, time.time() - due)
+
+        with self._lock:
+            self.refreshes += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+
+            # Still queued means nothing was stored, the name no longer has a record
+            entry = self._entries.get(key)
+            if entry is not None and entry.queued:
+                del self._entries[key]
+
+    def _failed(self, key):
+
+        with self._lock:
+            self.refresh_errors += 1
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.queued = False
+                entry.refresh_at = time.time() + self.retry_interval
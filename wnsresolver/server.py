@@ -0,0 +1,358 @@
+__author__ = 'mdavid'
+
+# Standalone resolution service, requires Python 3.5+ and the aiohttp module
+#
+#     python -m wnsresolver.server --port 8080 --workers 4
+#
+#     GET  /resolve/<name>/<currency>   {"name": ..., "currency": ..., "result": ...}
+#     GET  /currencies/<name>           {"name": ..., "currencies": [...]}
+#     POST /resolve                     [{"name": ..., "currency": ...}, ...] -> {"results": [...]}
+#     GET  /health
+#     GET  /metrics                     Prometheus text format, per worker
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+
+from aiohttp import web
+
+from . import WalletNameCurrencyUnavailableError, WalletNameLookupError, WalletNameLookupInsecureError, WalletNameNamecoinUnavailable, WalletNameTimeoutError, WalletNameUnavailableError
+from .aio import AsyncWalletNameResolver
+from .cache import ResultCache
+from .instrumentation import StatsSink
+from .refresh import CacheRefresher
+
+ERROR_STATUS = {
+    AttributeError: 400,
+    WalletNameUnavailableError: 404,
+    WalletNameCurrencyUnavailableError: 404,
+    WalletNameLookupInsecureError: 502,
+    WalletNameLookupError: 502,
+    WalletNameTimeoutError: 504,
+    WalletNameNamecoinUnavailable: 501
+}
+
+
+class ResolutionService:
+
+    def __init__(self, resolver, stats=None, trust_forwarded=False, batch_limit=100, batch_concurrency=32, snapshot=None, snapshot_secret=None, snapshot_interval=300, timeout=None):
+
+        self.resolver = resolver
+        self.stats = stats
+        self.trust_forwarded = trust_forwarded
+        self.batch_limit = batch_limit
+        self.batch_concurrency = batch_concurrency
+
+        # Cache snapshot loaded on startup, saved every snapshot_interval seconds and on shutdown
+        self.snapshot = snapshot
+        self.snapshot_secret = snapshot_secret
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_task = None
+
+        # Seconds each resolution may take before answering 504, None for no limit
+        self.timeout = timeout
+
+        # Identical lookups in flight share one resolution: key -> future
+        self.inflight = {}
+        self.counters = {'requests': 0, 'coalesced': 0, 'errors': 0}
+
+    def application(self):
+
+        app = web.Application()
+        app.router.add_get('/resolve/{name}/{currency}', self.handle_resolve)
+        app.router.add_get('/currencies/{name}', self.handle_currencies)
+        app.router.add_post('/resolve', self.handle_batch)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/metrics', self.handle_metrics)
+        if self.snapshot:
+            app.on_startup.append(self.start_snapshots)
+            app.on_shutdown.append(self.stop_snapshots)
+        app.on_cleanup.append(self.close)
+        return app
+
+    async def start_snapshots(self, app=None):
+
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.resolver.resolver.load_snapshot, self.snapshot, self.snapshot_secret)
+        except (IOError, OSError, ValueError):
+            # No usable snapshot, start cold
+            pass
+
+        self._snapshot_task = asyncio.ensure_future(self.save_snapshots())
+
+    async def stop_snapshots(self, app=None):
+
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        await self.save_snapshot()
+
+    async def save_snapshots(self):
+
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.save_snapshot()
+
+    async def save_snapshot(self):
+
+        # Every worker writes its own cache to the same file, the last one written is loaded
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.resolver.resolver.save_snapshot, self.snapshot, self.snapshot_secret)
+        except (IOError, OSError):
+            pass
+
+    async def close(self, app=None):
+
+        await self.resolver.close()
+
+    def client_ip(self, request):
+
+        # X-Forwarded-For is only honored behind a trusted proxy
+        if self.trust_forwarded:
+            forwarded_for = request.headers.get('X-Forwarded-For')
+            if forwarded_for:
+                return forwarded_for.split(',')[0].strip()
+        return request.remote
+
+    async def handle_resolve(self, request):
+
+        name = request.match_info['name']
+        currency = request.match_info['currency']
+        status, body = await self.resolve_wallet_name(name, currency, self.client_ip(request))
+        return web.json_response(body, status=status)
+
+    async def handle_currencies(self, request):
+
+        self.counters['requests'] += 1
+        name = request.match_info['name']
+
+        try:
+            currencies = await self.coalesce(('currencies', name), lambda: self.resolver.resolve_available_currencies(name, timeout=self.timeout))
+        except Exception as e:
+            status, body = self.error(e)
+            body['name'] = name
+            return web.json_response(body, status=status)
+
+        return web.json_response({'name': name, 'currencies': currencies})
+
+    async def handle_batch(self, request):
+
+        try:
+            pairs = [(x['name'], x['currency']) for x in await request.json()]
+        except (ValueError, TypeError, KeyError):
+            return web.json_response({'error': 'InvalidRequest', 'message': 'Expected a JSON list of {"name": ..., "currency": ...}'}, status=400)
+
+        if len(pairs) > self.batch_limit:
+            return web.json_response({'error': 'BatchTooLarge', 'message': 'At most %d lookups per request' % self.batch_limit}, status=413)
+
+        client_ip = self.client_ip(request)
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def resolve(name, currency):
+            async with semaphore:
+                status, body = await self.resolve_wallet_name(name, currency, client_ip)
+            if status != 200:
+                body['status'] = status
+            return body
+
+        return web.json_response({'results': await asyncio.gather(*[resolve(name, currency) for name, currency in pairs])})
+
+    async def handle_health(self, request):
+
+        return web.json_response({'status': 'ok', 'worker': os.getpid()})
+
+    async def handle_metrics(self, request):
+
+        return web.Response(text=self.render_metrics(), content_type='text/plain')
+
+    async def resolve_wallet_name(self, name, currency, client_ip):
+
+        self.counters['requests'] += 1
+
+        try:
+            result = await self.coalesce(
+                ('resolve', name, currency),
+                lambda: self.resolver.resolve_wallet_name(name, currency, forwarded_for=client_ip, timeout=self.timeout)
+            )
+            if result is None:
+                raise WalletNameUnavailableError()
+        except Exception as e:
+            status, body = self.error(e)
+        else:
+            status, body = 200, {'result': result}
+
+        body.update({'name': name, 'currency': currency})
+        return status, body
+
+    async def coalesce(self, key, resolve):
+
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = asyncio.ensure_future(resolve())
+            future.add_done_callback(lambda _: self._resolved(key))
+        else:
+            self.counters['coalesced'] += 1
+
+        # A disconnected client must not cancel the resolution other requests are waiting on
+        return await asyncio.shield(future)
+
+    def _resolved(self, key):
+
+        future = self.inflight.pop(key)
+        if not future.cancelled():
+            # Retrieved here so an error nobody is still waiting on is not logged as unhandled
+            future.exception()
+
+    def error(self, e):
+
+        self.counters['errors'] += 1
+        status = ERROR_STATUS.get(type(e), 500)
+        return status, {'error': type(e).__name__, 'message': str(e) if status < 500 or status == 501 else ''}
+
+    def render_metrics(self):
+
+        worker = os.getpid()
+        lines = [
+            '# TYPE wnsresolver_server_requests_total counter',
+            'wnsresolver_server_requests_total{worker="%d"} %d' % (worker, self.counters['requests']),
+            '# TYPE wnsresolver_server_coalesced_total counter',
+            'wnsresolver_server_coalesced_total{worker="%d"} %d' % (worker, self.counters['coalesced']),
+            '# TYPE wnsresolver_server_errors_total counter',
+            'wnsresolver_server_errors_total{worker="%d"} %d' % (worker, self.counters['errors']),
+            '# TYPE wnsresolver_server_inflight gauge',
+            'wnsresolver_server_inflight{worker="%d"} %d' % (worker, len(self.inflight))
+        ]
+
+        cache = self.resolver.resolver.cache
+        if cache is not None:
+            for key, value in sorted(cache.stats().items()):
+                lines.append('wnsresolver_cache_%s{worker="%d"} %d' % (key, worker, value))
+
+        refresher = self.resolver.resolver.refresher
+        if refresher is not None:
+            for key, value in sorted(refresher.stats().items()):
+                lines.append('wnsresolver_refresh_%s{worker="%d"} %s' % (key, worker, value))
+
+        if self.stats is not None:
+            snapshot = sorted(self.stats.snapshot().items())
+            lines.append('# TYPE wnsresolver_stage_total counter')
+            for (stage, outcome), (count, total) in snapshot:
+                lines.append('wnsresolver_stage_total{worker="%d",stage="%s",outcome="%s"} %d' % (worker, stage, outcome, count))
+            lines.append('# TYPE wnsresolver_stage_seconds_total counter')
+            for (stage, outcome), (count, total) in snapshot:
+                lines.append('wnsresolver_stage_seconds_total{worker="%d",stage="%s",outcome="%s"} %.6f' % (worker, stage, outcome, total))
+
+        return '\n'.join(lines) + '\n'
+
+
+def build_application(args):
+
+    # One resolver per worker process, shared by every request it serves
+    stats = StatsSink()
+    resolver = AsyncWalletNameResolver(
+        resolv_conf=args.resolv_conf,
+        dnssec_root_key=args.dnssec_root_key,
+        nc_host=args.nc_host,
+        nc_port=args.nc_port,
+        nc_rpcuser=args.nc_rpcuser,
+        nc_rpcpassword=args.nc_rpcpassword,
+        nc_tmpdir=args.nc_tmpdir,
+        optimistic=not args.no_optimistic,
+        cache=ResultCache(max_entries=args.cache_entries) if args.cache_entries else None,
+        metrics=stats,
+        refresher=CacheRefresher(refresh_fraction=args.refresh_fraction) if args.refresh_fraction else None
+    )
+
+    service = ResolutionService(
+        resolver,
+        stats=stats,
+        trust_forwarded=args.trust_forwarded,
+        batch_limit=args.batch_limit,
+        batch_concurrency=args.batch_concurrency,
+        snapshot=args.snapshot,
+        snapshot_secret=args.snapshot_secret,
+        snapshot_interval=args.snapshot_interval,
+        timeout=args.timeout or None
+    )
+    return service.application()
+
+
+def serve(sock, args):
+
+    web.run_app(build_application(args), sock=sock, print=None, access_log=None)
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Wallet Name resolution service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--resolv-conf', default='/etc/resolv.conf')
+    parser.add_argument('--dnssec-root-key', default='/usr/local/etc/unbound/root.key')
+    parser.add_argument('--cache-entries', type=int, default=10000, help='ResultCache size per worker, 0 disables it')
+    parser.add_argument('--refresh-fraction', type=float, default=0.75, help='refresh hot records after this fraction of their TTL, 0 disables it')
+    parser.add_argument('--no-optimistic', action='store_true', help='query the currency record only after the currency list')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds a resolution may take before a 504, 0 disables it')
+    parser.add_argument('--trust-forwarded', action='store_true', help='take the client IP from X-Forwarded-For')
+    parser.add_argument('--batch-limit', type=int, default=100)
+    parser.add_argument('--batch-concurrency', type=int, default=32)
+    parser.add_argument('--nc-host')
+    parser.add_argument('--nc-port', type=int, default=8336)
+    parser.add_argument('--nc-rpcuser')
+    parser.add_argument('--nc-rpcpassword')
+    parser.add_argument('--nc-tmpdir')
+    parser.add_argument('--snapshot', help='cache snapshot file, loaded on startup and saved periodically and on shutdown')
+    parser.add_argument('--snapshot-secret-file', help='file holding the key snapshots are authenticated with')
+    parser.add_argument('--snapshot-interval', type=int, default=300)
+    args = parser.parse_args(argv)
+
+    args.snapshot_secret = None
+    if args.snapshot:
+        if not args.snapshot_secret_file:
+            parser.error('--snapshot requires --snapshot-secret-file')
+        with open(args.snapshot_secret_file, 'rb') as fp:
+            args.snapshot_secret = fp.read().strip()
+        if not args.snapshot_secret:
+            parser.error('%s is empty' % args.snapshot_secret_file)
+
+    return args
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+
+    # Workers accept from one shared listening socket
+    sock = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    if args.workers <= 1:
+        serve(sock, args)
+        return
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=serve, args=(sock, args)) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+
+    main()
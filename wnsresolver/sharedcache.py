@@ -0,0 +1,275 @@
+__author__ = 'mdavid'
+
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+MAGIC = b'WNSC'
+FILE_HEADER = struct.Struct('<4sII')
+
+# version, key hash, expiry, payload length. Version is odd while a writer is mid-update.
+SLOT_HEADER = struct.Struct('<IQdH')
+VERSION = struct.Struct('<I')
+
+# Slots tried per key before the entry closest to expiry is evicted
+PROBES = 4
+
+# Reads of a slot that keeps changing, or was left mid-update by a killed writer, give up as a miss
+READ_RETRIES = 100
+
+
+class SharedResultCache:
+
+    # ResultCache interface over a memory-mapped file, so every process mapping it (forked workers included) shares entries.
+    # Entries live in fixed-size slots, a value that does not fit in slot_size is not cached. Entries are pickled,
+    # the file must only be writable by the resolver's own user.
+
+    def __init__(self, path=None, slots=16384, slot_size=512, negative_ttl=300, max_ttl=86400):
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+
+        # A cache file created here is removed by close() in the creating process
+        self._owner_pid = None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='wnsresolver-cache')
+            os.close(fd)
+            self._owner_pid = os.getpid()
+
+        self.path = path
+        self._open()
+
+    def _open(self):
+
+        # Writers exclude other threads with the lock and other processes with lockf, readers take neither
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = FILE_HEADER.size + self.slots * self.slot_size
+
+        with self._locked():
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.write(self._fd, FILE_HEADER.pack(MAGIC, self.slots, self.slot_size))
+
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            header = FILE_HEADER.unpack(os.read(self._fd, FILE_HEADER.size))
+
+        if header != (MAGIC, self.slots, self.slot_size):
+            os.close(self._fd)
+            raise ValueError('%s is not a SharedResultCache of %d slots of %d bytes' % (self.path, self.slots, self.slot_size))
+
+        self._map = mmap.mmap(self._fd, size)
+
+        # Per process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __getstate__(self):
+
+        # Pickled into spawned workers as its configuration, the file is mapped again on arrival
+        return {
+            'path': self.path,
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'negative_ttl': self.negative_ttl,
+            'max_ttl': self.max_ttl
+        }
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self._owner_pid = None
+        self._open()
+
+    @contextmanager
+    def _locked(self):
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def get(self, key):
+
+        # Returns (hit, value) so cached negative answers (None) are distinguishable from misses
+        key_data = pickle.dumps(key, 2)
+        key_hash = self._hash(key_data)
+        now = time.time()
+
+        for index in self._probe(key_hash):
+            entry = self._read(index)
+            if entry is None or entry[0] != key_hash:
+                continue
+
+            _, expires, payload = entry
+            stored_key, value = pickle.loads(payload)
+            if stored_key != key:
+                continue
+
+            if expires <= now:
+                self._count('expirations', 'misses')
+                return False, None
+
+            self._count('hits')
+            return True, value
+
+        self._count('misses')
+        return False, None
+
+    def set(self, key, value, ttl):
+
+        if value is None:
+            # Negative answers use the record's negative TTL, capped at negative_ttl
+            ttl = min(ttl, self.negative_ttl) if ttl else self.negative_ttl
+        else:
+            ttl = min(ttl or 0, self.max_ttl)
+
+        if ttl <= 0:
+            return
+
+        payload = pickle.dumps((key, value), 2)
+        if SLOT_HEADER.size + len(payload) > self.slot_size:
+            return
+
+        key_hash = self._hash(pickle.dumps(key, 2))
+
+        with self._locked():
+            now = time.time()
+            target = None
+            oldest = None
+
+            for index in self._probe(key_hash):
+                entry = self._read(index)
+                if entry is None or entry[0] == key_hash or entry[1] <= now:
+                    target = index
+                    break
+                if oldest is None or entry[1] < oldest[1]:
+                    oldest = index, entry[1]
+
+            if target is None:
+                target = oldest[0]
+                self.evictions += 1
+
+            self._write(target, key_hash, now + ttl, payload)
+
+    def invalidate(self, key):
+
+        key_hash = self._hash(pickle.dumps(key, 2))
+
+        with self._locked():
+            for index in self._probe(key_hash):
+                entry = self._read(index)
+                if entry is not None and entry[0] == key_hash and pickle.loads(entry[2])[0] == key:
+                    self._write(index, 0, 0, b'')
+
+    def clear(self):
+
+        with self._locked():
+            for index in range(self.slots):
+                if self._read(index) is not None:
+                    self._write(index, 0, 0, b'')
+
+    def entries(self):
+
+        # (key, value, expires) for every unexpired entry, in slot order
+        now = time.time()
+        items = []
+
+        for index in range(self.slots):
+            entry = self._read(index)
+            if entry is not None and entry[1] > now:
+                key, value = pickle.loads(entry[2])
+                items.append((key, value, entry[1]))
+        return items
+
+    def stats(self):
+
+        entries = 0
+        size = 0
+        now = time.time()
+
+        for index in range(self.slots):
+            _, _, expires, length = SLOT_HEADER.unpack_from(self._map, FILE_HEADER.size + index * self.slot_size)
+            if length and expires > now:
+                entries += 1
+                size += length
+
+        with self._lock:
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def close(self):
+
+        self._map.close()
+        os.close(self._fd)
+
+        if self._owner_pid == os.getpid():
+            os.unlink(self.path)
+
+    def __len__(self):
+
+        return self.stats()['entries']
+
+    def _count(self, *counters):
+
+        with self._lock:
+            for counter in counters:
+                setattr(self, counter, getattr(self, counter) + 1)
+
+    def _hash(self, data):
+
+        return struct.unpack('<Q', hashlib.sha1(data).digest()[:8])[0]
+
+    def _probe(self, key_hash):
+
+        return [(key_hash + x) % self.slots for x in range(min(PROBES, self.slots))]
+
+    def _read(self, index):
+
+        # Seqlock read: retry while a writer holds the slot or it changed underneath us
+        offset = FILE_HEADER.size + index * self.slot_size
+        start = offset + SLOT_HEADER.size
+
+        for _ in range(READ_RETRIES):
+            version, key_hash, expires, length = SLOT_HEADER.unpack_from(self._map, offset)
+            if version & 1:
+                continue
+            if not length:
+                return None
+
+            payload = self._map[start:start + min(length, self.slot_size - SLOT_HEADER.size)]
+            if VERSION.unpack_from(self._map, offset)[0] == version:
+                return key_hash, expires, payload
+
+        return None
+
+    def _write(self, index, key_hash, expires, payload):
+
+        offset = FILE_HEADER.size + index * self.slot_size
+        start = offset + SLOT_HEADER.size
+        # Forced odd, a slot left odd by a writer killed mid-update is recovered by its next write
+        writing = VERSION.unpack_from(self._map, offset)[0] | 1
+
+        VERSION.pack_into(self._map, offset, writing)
+        SLOT_HEADER.pack_into(self._map, offset, writing, key_hash, expires, len(payload))
+        self._map[start:start + len(payload)] = payload
+        VERSION.pack_into(self._map, offset, (writing + 1) % 2 ** 32)
@@ -0,0 +1,61 @@
+__author__ = 'mdavid'
+
+import threading
+
+
+class SingleFlightTimeoutError(Exception):
+    pass
+
+
+class _Call:
+
+    def __init__(self):
+
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+
+        # Concurrent callers with the same key wait for the first caller's result instead of repeating the work
+        return self.do_within(None, key, fn, *args, **kwargs)
+
+    def do_within(self, timeout, key, fn, *args, **kwargs):
+
+        # As do, but a caller waiting on another's call gives up after timeout seconds, the call carries on for the rest
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise SingleFlightTimeoutError('Gave up waiting on the call in flight')
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn(*args, **kwargs)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,185 @@
+__author__ = 'mdavid'
+
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from .records import WalletNameRecord
+
+# File: header, then entries until end of file. Each entry is its header, a body holding the encoded (section, key) and
+# value, and a truncated HMAC-SHA256 over file header, entry header and body.
+MAGIC = b'WNSS'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sB3x')
+ENTRY_HEADER = struct.Struct('<Id')
+MAC_SIZE = 16
+
+# Values are encoded as a tag octet followed by its data, never pickled: a snapshot is only data
+TAG = struct.Struct('<B')
+LENGTH = struct.Struct('<I')
+COUNT = struct.Struct('<H')
+FLOAT = struct.Struct('<d')
+NONE, TEXT, RECORD, LIST, TUPLE, NUMBER = range(6)
+
+TEXT_TYPES = (str, type(u''))
+
+
+def save(path, caches, secret):
+
+    # Write every unexpired entry of each named cache ({section: cache}) to path, replacing it atomically
+    header = FILE_HEADER.pack(MAGIC, VERSION)
+    data = bytearray(header)
+    count = 0
+
+    for section, cache in sorted(caches.items()):
+        if cache is None:
+            continue
+
+        for key, value, expires in cache.entries():
+            body = bytearray()
+            _encode((section, key), body)
+            _encode(value, body)
+
+            entry = ENTRY_HEADER.pack(len(body), expires) + bytes(body)
+            data += entry
+            data += _mac(secret, header, entry)
+            count += 1
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, bytes(data))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.rename(tmp_path, path)
+    return count
+
+
+def load(path, caches, secret):
+
+    # Restore entries still within their TTL into the named caches. Entries failing their HMAC or malformed are rejected
+    # one by one, a file of another format or version raises ValueError.
+    with open(path, 'rb') as fp:
+        data = fp.read()
+
+    header = data[:FILE_HEADER.size]
+    if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header) != (MAGIC, VERSION):
+        raise ValueError('%s is not a version %d wnsresolver snapshot' % (path, VERSION))
+
+    view = memoryview(data)
+    stats = {'loaded': 0, 'expired': 0, 'rejected': 0}
+    now = time.time()
+    offset = FILE_HEADER.size
+
+    while offset < len(data):
+        if offset + ENTRY_HEADER.size > len(data):
+            stats['rejected'] += 1
+            break
+
+        length, expires = ENTRY_HEADER.unpack_from(view, offset)
+        end = offset + ENTRY_HEADER.size + length
+        if end + MAC_SIZE > len(data):
+            # Truncated, nothing after it can be framed
+            stats['rejected'] += 1
+            break
+
+        entry = view[offset:end]
+        mac = view[end:end + MAC_SIZE].tobytes()
+        offset = end + MAC_SIZE
+
+        if not hmac.compare_digest(mac, _mac(secret, header, entry.tobytes())):
+            stats['rejected'] += 1
+            continue
+
+        if expires <= now:
+            stats['expired'] += 1
+            continue
+
+        try:
+            (section, key), body_offset = _decode(view, end - length)
+            value, body_offset = _decode(view, body_offset)
+            if body_offset != end:
+                raise ValueError('Entry length mismatch')
+        except (ValueError, TypeError, struct.error):
+            stats['rejected'] += 1
+            continue
+
+        cache = caches.get(section)
+        if cache is not None:
+            cache.set(key, value, expires - now)
+            stats['loaded'] += 1
+
+    return stats
+
+
+def _mac(secret, header, entry):
+
+    if not secret:
+        raise ValueError('A snapshot secret is required')
+    if isinstance(secret, type(u'')):
+        secret = secret.encode('utf-8')
+    return hmac.new(secret, header + entry, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def _encode(value, out):
+
+    if value is None:
+        out += TAG.pack(NONE)
+    elif isinstance(value, TEXT_TYPES):
+        data = value.encode('utf-8') if isinstance(value, type(u'')) else value
+        out += TAG.pack(TEXT) + LENGTH.pack(len(data)) + data
+    elif isinstance(value, WalletNameRecord):
+        out += TAG.pack(RECORD)
+        for field in (value.kind, value.value, value.endpoint_url, value.expires):
+            _encode(field, out)
+    elif isinstance(value, (list, tuple)):
+        out += TAG.pack(LIST if isinstance(value, list) else TUPLE) + COUNT.pack(len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, (int, float)):
+        out += TAG.pack(NUMBER) + FLOAT.pack(value)
+    else:
+        raise TypeError('Cannot snapshot %r' % type(value))
+
+
+def _decode(view, offset):
+
+    # Returns (value, offset past it)
+    tag = TAG.unpack_from(view, offset)[0]
+    offset += TAG.size
+
+    if tag == NONE:
+        return None, offset
+
+    if tag == TEXT:
+        length = LENGTH.unpack_from(view, offset)[0]
+        offset += LENGTH.size
+        if offset + length > len(view):
+            raise ValueError('Truncated text')
+        data = view[offset:offset + length].tobytes()
+        return (data if str is bytes else data.decode('utf-8')), offset + length
+
+    if tag == RECORD:
+        fields = []
+        for _ in range(4):
+            field, offset = _decode(view, offset)
+            fields.append(field)
+        return WalletNameRecord(*fields), offset
+
+    if tag in (LIST, TUPLE):
+        count = COUNT.unpack_from(view, offset)[0]
+        offset += COUNT.size
+        items = []
+        for _ in range(count):
+            item, offset = _decode(view, offset)
+            items.append(item)
+        return (items if tag == LIST else tuple(items)), offset
+
+    if tag == NUMBER:
+        return FLOAT.unpack_from(view, offset)[0], offset + FLOAT.size
+
+    raise ValueError('Unknown tag %d' % tag)
@@ -0,0 +1,128 @@
+__author__ = 'mdavid'
+
+import random
+import threading
+from collections import deque
+
+
+def read_nameservers(resolv_conf):
+
+    # nameserver addresses listed in a resolv.conf, in order
+    nameservers = []
+    with open(resolv_conf) as fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) > 1 and fields[0] == 'nameserver' and fields[1] not in nameservers:
+                nameservers.append(fields[1])
+    return nameservers
+
+
+class _Upstream(object):
+
+    __slots__ = ('srtt', 'samples', 'queries', 'failures')
+
+    def __init__(self, window):
+
+        self.srtt = None
+        self.samples = deque(maxlen=window)
+        self.queries = 0
+        self.failures = 0
+
+
+class QueryPolicy:
+
+    # Retries, deadline and hedging for WalletNameResolver queries. Each forwarder in resolv_conf gets its own unbound
+    # contexts, and a query goes to the one with the lowest smoothed RTT first. When it has not answered after that
+    # forwarder's hedge_quantile RTT (hedge_delay until min_samples are observed), the query is sent to the next
+    # forwarder as well and the first secure answer wins. A failed attempt is retried after a jittered exponential
+    # backoff while retries and the deadline allow.
+
+    def __init__(self, retries=2, backoff=0.05, max_backoff=1.0, deadline=5.0, hedge=True, hedge_quantile=0.95, hedge_delay=0.2, min_samples=8, window=64, failure_penalty=1.0):
+
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.window = window
+
+        # Failed queries count as at least this RTT, so a failing forwarder drops down the ranking
+        self.failure_penalty = failure_penalty
+
+        self._lock = threading.Lock()
+        self._upstreams = {}
+
+        self.hedge_count = 0
+        self.retry_count = 0
+
+    def ranked(self, upstreams):
+
+        # Lowest smoothed RTT first, forwarders not yet measured ahead of the rest in their given order
+        with self._lock:
+            return sorted(upstreams, key=lambda x: self._entry(x).srtt or 0.0)
+
+    def hedge_after(self, upstream):
+
+        # Seconds to wait on upstream before hedging to the next one, None when hedging is disabled
+        if not self.hedge:
+            return None
+
+        with self._lock:
+            samples = sorted(self._entry(upstream).samples)
+
+        if len(samples) < self.min_samples:
+            return self.hedge_delay
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))]
+
+    def observed(self, upstream, rtt, failed=False):
+
+        with self._lock:
+            entry = self._entry(upstream)
+            entry.queries += 1
+            if failed:
+                entry.failures += 1
+                rtt = max(rtt, self.failure_penalty)
+
+            entry.samples.append(rtt)
+
+            # Smoothed as TCP does (RFC 6298), gain 1/8
+            entry.srtt = rtt if entry.srtt is None else entry.srtt + (rtt - entry.srtt) / 8.0
+
+    def hedged(self):
+
+        with self._lock:
+            self.hedge_count += 1
+
+    def retrying(self):
+
+        with self._lock:
+            self.retry_count += 1
+
+    def backoff_delay(self, attempt):
+
+        # Full jitter, uniform up to the capped exponential backoff of this attempt
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def stats(self):
+
+        with self._lock:
+            upstreams = dict((upstream, {
+                'queries': entry.queries,
+                'failures': entry.failures,
+                'srtt_seconds': entry.srtt or 0.0
+            }) for upstream, entry in self._upstreams.items())
+            stats = {'hedges': self.hedge_count, 'retries': self.retry_count, 'upstreams': upstreams}
+
+        for upstream, entry in upstreams.items():
+            entry['hedge_after_seconds'] = self.hedge_after(upstream) or 0.0
+        return stats
+
+    def _entry(self, upstream):
+
+        entry = self._upstreams.get(upstream)
+        if entry is None:
+            entry = self._upstreams[upstream] = _Upstream(self.window)
+        return entry